@@ -2,22 +2,23 @@
 
 import streamlit as st
 import json
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-import requests
 import traceback
 import time
 from streamlit_local_storage import LocalStorage
 
-# --- ツールインポート ---
-from tools import koutsuhi, calendar_tool, transcript_tool, research_tool
-# from tools import okozukai_recorder # コメントアウトされているようなので、そのままに
-from tools import translator_tool # ★ 1. 新しい「翻訳専門家」をインポート
+# --- ツール登録簿 ---
+# 各ツールのモジュール（と重い依存）は、そのツールが初めて選ばれたときに読み込む
+from tools import registry
+from tools import google_auth
+from tools import perf_trace
+from tools.structured_output import get_structured_output_stats
 
 # ===============================================================
 # 1. アプリの基本設定
 # ===============================================================
 st.set_page_config(page_title="AIアシスタント・ポータル", page_icon="🤖", layout="wide")
+# 遅さの原因が再実行の多さなのかを見分けるため、このセッションでスクリプトが走った回数を数える
+st.session_state["perf_script_runs"] = st.session_state.get("perf_script_runs", 0) + 1
 
 try:
     CLIENT_ID = st.secrets["GOOGLE_CLIENT_ID"]
@@ -34,26 +35,30 @@ except (KeyError, FileNotFoundError):
     st.stop()
 
 # ===============================================================
-# 2. ログイン/ログアウト関数 (変更なし)
+# 2. ログイン/ログアウト関数
 # ===============================================================
-def get_google_auth_flow():
-    return Flow.from_client_config(
-        client_config={ "web": { "client_id": CLIENT_ID, "client_secret": CLIENT_SECRET,
-                                 "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token",
-                                 "redirect_uris": [REDIRECT_URI], }},
-        scopes=SCOPE,
-        redirect_uri=REDIRECT_URI
-    )
+def get_google_auth_flow(scopes=SCOPE):
+    return google_auth.build_flow(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, scopes)
+
+def get_login_url():
+    # ログイン用URLはセッションごとに1回だけ作り、再実行のたびに Flow を作り直さない
+    if "google_auth_url" not in st.session_state:
+        authorization_url, state = get_google_auth_flow().authorization_url(prompt="consent", access_type="offline", include_granted_scopes='true')
+        st.session_state["google_auth_url"] = authorization_url
+        st.session_state["google_auth_state"] = state
+    return st.session_state["google_auth_url"]
 
 def google_logout():
-    keys_to_clear = ["google_credentials", "google_user_info", "google_auth_state", "gemini_api_key", "speech_api_key"]
+    if "google_credentials" in st.session_state:
+        google_auth.unregister_credentials(st.session_state["google_credentials"])
+    keys_to_clear = ["google_credentials", "google_user_info", "google_auth_state", "google_auth_url", "gemini_api_key", "speech_api_key"]
     for key in keys_to_clear:
         st.session_state.pop(key, None)
     st.success("ログアウトしました。")
     st.rerun()
 
 # ===============================================================
-# 3. 認証処理の核心部 (変更なし)
+# 3. 認証処理の核心部
 # ===============================================================
 if "code" in st.query_params and "google_credentials" not in st.session_state:
     query_state = st.query_params.get("state")
@@ -63,22 +68,19 @@ if "code" in st.query_params and "google_credentials" not in st.session_state:
             with st.spinner("Google認証処理中..."):
                 flow = get_google_auth_flow()
                 try:
-                    flow.fetch_token(code=st.query_params["code"])
+                    with perf_trace.trace_call("oauth", "token_exchange"):
+                        flow.fetch_token(code=st.query_params["code"])
                 except Exception as token_error:
                     if "Scope has changed" in str(token_error):
-                        flow = Flow.from_client_config(
-                            client_config={ "web": { "client_id": CLIENT_ID, "client_secret": CLIENT_SECRET,
-                                                     "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token",
-                                                     "redirect_uris": [REDIRECT_URI], }},
-                            scopes=None, redirect_uri=REDIRECT_URI
-                        )
-                        flow.fetch_token(code=st.query_params["code"])
+                        flow = get_google_auth_flow(scopes=None)
+                        with perf_trace.trace_call("oauth", "token_exchange:retry"):
+                            flow.fetch_token(code=st.query_params["code"])
                     else: raise token_error
-                creds = flow.credentials
-                st.session_state["google_credentials"] = { "token": creds.token, "refresh_token": creds.refresh_token, "token_uri": creds.token_uri, "client_id": creds.client_id, "client_secret": creds.client_secret, "scopes": creds.scopes }
-                user_info_response = requests.get("https://www.googleapis.com/oauth2/v2/userinfo", headers={"Authorization": f"Bearer {creds.token}"})
-                user_info_response.raise_for_status()
-                st.session_state["google_user_info"] = user_info_response.json()
+                # 生きた Credentials をそのまま保持し、期限前に裏で更新させる
+                creds = google_auth.register_credentials(flow.credentials)
+                st.session_state["google_credentials"] = creds
+                with perf_trace.trace_call("oauth", "userinfo"):
+                    st.session_state["google_user_info"] = google_auth.fetch_user_info(creds)
                 st.success("✅ Google認証が正常に完了しました！"); st.query_params.clear(); time.sleep(1); st.rerun()
         except Exception as e:
             st.error(f"Google認証中にエラーが発生しました: {str(e)}"); st.code(traceback.format_exc()); st.query_params.clear()
@@ -93,10 +95,7 @@ with st.sidebar:
     st.title("🤖 AIアシスタント・ポータル")
     if "google_user_info" not in st.session_state:
         st.info("各ツールを利用するには、Googleアカウントでのログインが必要です。")
-        flow = get_google_auth_flow()
-        authorization_url, state = flow.authorization_url(prompt="consent", access_type="offline", include_granted_scopes='true')
-        st.session_state["google_auth_state"] = state
-        st.link_button("🗝️ Googleアカウントでログイン", authorization_url, use_container_width=True)
+        st.link_button("🗝️ Googleアカウントでログイン", get_login_url(), use_container_width=True)
     else:
         st.success("✅ ログイン中")
         user_info = st.session_state.get("google_user_info", {})
@@ -105,8 +104,7 @@ with st.sidebar:
         if st.button("🔑 ログアウト", use_container_width=True): google_logout()
         st.divider()
 
-        # ★ 2. ツール選択肢に「フレンドリー翻訳」を追加
-        tool_options = ("🤝 フレンドリー翻訳", "📅 カレンダー登録", "💹 価格リサーチ", "📝 議事録作成", "🚇 AI乗り換え案内")
+        tool_options = registry.tool_labels()
         tool_choice = st.radio("使いたいツールを選んでください:", tool_options, key="tool_choice_radio")
         st.divider()
         
@@ -135,6 +133,13 @@ with st.sidebar:
         
         st.markdown("""<div style="font-size: 0.9em;"><a href="https://aistudio.google.com/app/apikey" target="_blank">1. Gemini APIキーの取得</a><br><a href="https://console.cloud.google.com/apis/credentials" target="_blank">2. Speech-to-Text APIキーの取得</a></div>""", unsafe_allow_html=True)
 
+        # AI応答のJSON解析がどれだけ失敗・再試行しているか（無駄なLLM呼び出しの計測用）
+        structured_stats = get_structured_output_stats()
+        if structured_stats:
+            with st.expander("📈 AI応答の解析統計"):
+                for tool_name, stats in structured_stats.items():
+                    st.caption(f"**{tool_name}**: 呼び出し {stats['calls']} 回 / 解析失敗率 {stats['parse_failure_rate']:.0%} / 修復リトライ率 {stats['retry_rate']:.0%} / 最終失敗 {stats['failures']} 回")
+
 # --- メイン ---
 if "google_user_info" not in st.session_state:
     st.header("ようこそ、AIアシスタント・ポータルへ！")
@@ -144,18 +149,26 @@ else:
     gemini_api_key = st.session_state.get('gemini_api_key', '')
     speech_api_key = st.session_state.get('speech_api_key', '')
 
-    # ★ 3. 「フレンドリー翻訳」を呼び出す処理を追加
-    if tool_choice == "🤝 フレンドリー翻訳":
-        translator_tool.show_tool(gemini_api_key=gemini_api_key, speech_api_key=speech_api_key)
-    elif tool_choice == "🚇 AI乗り換え案内":
-        koutsuhi.show_tool(gemini_api_key=gemini_api_key)
-    elif tool_choice == "📅 カレンダー登録":
-        calendar_tool.show_tool(gemini_api_key=gemini_api_key, speech_api_key=speech_api_key)
-    elif tool_choice == "📝 議事録作成":
-        transcript_tool.show_tool(speech_api_key=speech_api_key)
-    elif tool_choice == "💹 価格リサーチ":
-        research_tool.show_tool(gemini_api_key=gemini_api_key)
-    # elif tool_choice == "💰 お小遣いレコーダー": # 元のコードでコメントアウトされていたので、そのままにしておきます
-    #     okozukai_recorder.show_tool(gemini_api_key=gemini_api_key)
+    if registry.get_tool_spec(tool_choice):
+        with perf_trace.trace_call("streamlit", f"run_tool:{tool_choice}"):
+            registry.run_tool(tool_choice, gemini_api_key=gemini_api_key, speech_api_key=speech_api_key)
     else:
         st.warning(f"ツール「{tool_choice}」は現在準備中です。")
+
+    # どのツールの読み込みに、どれだけ時間がかかったか（ツール実行後に描画し、初回選択の計測も反映する）
+    with st.sidebar.expander("⏱️ ツールの読み込み時間"):
+        for label, cost_ms in registry.import_cost_report():
+            st.caption(f"{label}: {f'{cost_ms:,.0f} ms' if cost_ms is not None else '未読み込み'}")
+
+    # このセッションで、どの外部呼び出しにどれだけ時間がかかったか（Speech・Gemini・再実行のどれが遅いのかを見分ける）
+    with st.sidebar.expander("⚡ このセッションの処理時間"):
+        st.caption(f"画面の再実行: {st.session_state.perf_script_runs} 回")
+        perf_summary = perf_trace.session_summary()
+        if perf_summary:
+            st.dataframe([
+                {"種類": backend, "処理": operation, "回数": row["count"], "平均 ms": round(row["total_ms"] / row["count"]),
+                 "最大 ms": round(row["max_ms"]), "エラー": row["errors"], "キャッシュ命中": row["cache_hits"]}
+                for (backend, operation), row in perf_summary.items()
+            ], hide_index=True, use_container_width=True)
+        else:
+            st.caption("まだ外部APIの呼び出しはありません。")
@@ -0,0 +1,197 @@
+# benchmarks/fakes.py
+
+import re
+import sys
+import json
+import time
+import threading
+from types import SimpleNamespace
+from collections import Counter
+
+# ===============================================================
+# オフライン計測用の Gemini / Speech-to-Text の身代わり
+# 本物のAPIを呼ばずに、決まった遅延と決まった応答を返す。
+# 各ツールの system_instruction（またはプロンプト）の特徴的な語句で、返す応答を選ぶ。
+# ===============================================================
+class FakeBackendConfig:
+    def __init__(self, gemini_latency=0.3, gemini_stream_chunks=4, speech_latency=0.5, transcript="来週の月曜日の10時に歯医者の予約", payloads=None):
+        self.gemini_latency = gemini_latency  # 1回の generate_content にかかる秒数（ストリーミングでは全チャンクの合計）
+        self.gemini_stream_chunks = gemini_stream_chunks
+        self.speech_latency = speech_latency  # 1回の recognize にかかる秒数
+        self.transcript = transcript
+        self.payloads = dict(payloads or {})  # 種類名 -> 応答テキスト（既定の応答を差し替える）
+
+_config = FakeBackendConfig()
+_calls = {"gemini": 0, "speech": 0}
+_script_runs = Counter()  # ツールの表示名 -> AppTest がスクリプトを実行した回数（st.rerun による再実行を含む）
+_calls_lock = threading.Lock()
+
+def configure_fakes(**options):
+    """遅延や応答を変更する。指定しなかった項目は既定値に戻る"""
+    global _config
+    _config = FakeBackendConfig(**options)
+    return _config
+
+def _count(backend):
+    with _calls_lock:
+        _calls[backend] += 1
+
+def call_counts():
+    with _calls_lock:
+        return dict(_calls)
+
+def reset_call_counts():
+    with _calls_lock:
+        for backend in _calls:
+            _calls[backend] = 0
+        _script_runs.clear()
+
+def record_script_run(label):
+    with _calls_lock:
+        _script_runs[label] += 1
+
+def script_run_count(label):
+    with _calls_lock:
+        return _script_runs[label]
+
+# ===============================================================
+# 既定の応答
+# ===============================================================
+def _routes_payload(_contents):
+    steps = [
+        {"transport_type": "電車", "line_name": "JR大阪環状線", "station_from": "大阪", "station_to": "鶴橋", "details": "内回り"},
+        {"transport_type": "徒歩", "details": "近鉄線へ乗り換え"},
+        {"transport_type": "電車", "line_name": "近鉄奈良線", "station_from": "鶴橋", "station_to": "河内小阪", "details": "普通・奈良行き"},
+    ]
+    return json.dumps([
+        {"route_name": "ルート1：最速", "summary": {"total_time": 30, "total_fare": 450, "transfers": 1}, "steps": steps},
+        {"route_name": "ルート2：乗り換え楽", "summary": {"total_time": 35, "total_fare": 480, "transfers": 0}, "steps": steps[:1]},
+        {"route_name": "ルート3：最安", "summary": {"total_time": 40, "total_fare": 400, "transfers": 2}, "steps": steps},
+    ], ensure_ascii=False)
+
+def _prices_payload(_contents):
+    return json.dumps([{"name": f"商品{i}", "price": 500 + i * 150} for i in range(1, 21)], ensure_ascii=False)
+
+def _events_payload(_contents):
+    return json.dumps([
+        {"title": "歯医者", "start_time": "2026-10-19T10:00:00", "end_time": "2026-10-19T11:00:00", "location": "駅前歯科", "details": ""},
+        {"title": "打ち合わせ", "start_time": "2026-10-21T15:00:00", "end_time": "2026-10-21T16:00:00", "location": "", "details": ""},
+    ], ensure_ascii=False)
+
+def _receipt_payload(_contents):
+    return json.dumps({"date": "2026-10-17 12:34", "store_name": "テストマート", "total_amount": 1280,
+                       "items": [{"name": "お茶", "price": 150}, {"name": "弁当", "price": 1130}]}, ensure_ascii=False)
+
+def _batch_translation_payload(contents):
+    try:
+        lines = json.loads(contents)
+    except (TypeError, ValueError):
+        lines = [contents]
+    return json.dumps([f"(en) {line}" for line in lines], ensure_ascii=False)
+
+def _translation_payload(_contents):
+    return "Hey, thanks so much! See you tomorrow."
+
+_PAYLOAD_RULES = [
+    # (system_instruction / プロンプトに含まれる語句, 種類名, 応答を作る関数)
+    ("乗り換え案内エンジン", "routes", _routes_payload),
+    ("リサーチアシスタント", "prices", _prices_payload),
+    ("予定を解釈", "events", _events_payload),
+    ("JSON配列", "batch_translation", _batch_translation_payload),
+    ("翻訳アシスタント", "translation", _translation_payload),
+    ("レシート", "receipt", _receipt_payload),
+]
+
+def _select_payload(system_instruction, contents):
+    prompt_text = system_instruction or ""
+    if isinstance(contents, list):
+        prompt_text += "".join(part for part in contents if isinstance(part, str))
+    for phrase, kind, build in _PAYLOAD_RULES:
+        if phrase in prompt_text:
+            return _config.payloads.get(kind) or build(contents)
+    return _config.payloads.get("default", "{}")
+
+# ===============================================================
+# Gemini の身代わり（google.generativeai.GenerativeModel と同じ呼び方ができる）
+# ===============================================================
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [SimpleNamespace(text=text)] if text else []
+
+class FakeGenerativeModel:
+    def __init__(self, model_name="gemini-1.5-flash-latest", system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self._client = None  # 本物と同じく、gemini_clients.get_model がキーごとのクライアントを入れる
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        _count("gemini")
+        text = _select_payload(self.system_instruction, contents)
+        if stream:
+            return self._stream(text)
+        time.sleep(_config.gemini_latency)
+        return FakeResponse(text)
+
+    def _stream(self, text):
+        chunk_count = max(1, _config.gemini_stream_chunks)
+        chunk_size = max(1, -(-len(text) // chunk_count))
+        for start in range(0, len(text) or 1, chunk_size):
+            time.sleep(_config.gemini_latency / chunk_count)
+            yield FakeResponse(text[start:start + chunk_size])
+
+# ===============================================================
+# Speech-to-Text の身代わり（SpeechClient.recognize と同じ形の応答を返す）
+# ===============================================================
+class FakeSpeechClient:
+    def recognize(self, config=None, audio=None, **kwargs):
+        _count("speech")
+        time.sleep(_config.speech_latency)
+        alternative = SimpleNamespace(transcript=_config.transcript, confidence=0.95)
+        return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative])])
+
+    def streaming_recognize(self, config=None, requests=(), **kwargs):
+        """StreamingRecognize の身代わり。音声を受け取りながら途中経過を返し、
+        最後の区間を受け取った後に、文ごと（「、」「。」区切り）の確定した結果を返す"""
+        _count("speech")
+        chunks = [request.audio_content for request in requests]
+        text = _config.transcript
+        chunk_count = max(1, len(chunks))
+        interim_every = max(1, chunk_count // max(1, len(text)))
+        def result(transcript, is_final):
+            return SimpleNamespace(alternatives=[SimpleNamespace(transcript=transcript, confidence=0.9)], is_final=is_final)
+        for index in range(1, chunk_count + 1):
+            time.sleep(_config.speech_latency / chunk_count)
+            if index % interim_every == 0 and index < chunk_count:
+                yield SimpleNamespace(results=[result(text[:len(text) * index // chunk_count], False)])
+        for sentence in re.findall(r"[^、。]+[、。]?", text) or [text]:
+            yield SimpleNamespace(results=[result(sentence, True)])
+
+_fake_speech_client = FakeSpeechClient()
+
+def fake_get_speech_client(api_key):
+    return _fake_speech_client
+
+# ===============================================================
+# 差し替え
+# ===============================================================
+def install_fakes():
+    """google.generativeai のモデル・Gemini クライアントのプール・Speech クライアントのプールを身代わりに差し替える。元に戻す関数を返す
+    `from tools.speech_service import get_speech_client` 済みのモジュールも差し替えるが、
+    確実にするため、ツールを読み込む前に呼ぶこと"""
+    import google.generativeai as genai
+    from tools import speech_service, gemini_clients
+    original_get_client = speech_service.get_speech_client
+    originals = [(genai, "GenerativeModel", genai.GenerativeModel), (gemini_clients, "_new_client", gemini_clients._new_client)]
+    originals += [(module, "get_speech_client", original_get_client) for name, module in list(sys.modules.items())
+                  if name.startswith("tools.") and getattr(module, "get_speech_client", None) is original_get_client]
+    genai.GenerativeModel = FakeGenerativeModel
+    # APIキーごとのクライアントは作るが、通信はしない（応答は FakeGenerativeModel が返す）
+    gemini_clients._new_client = lambda api_key: SimpleNamespace(api_key=api_key)
+    for module, name, _ in originals[2:]:
+        setattr(module, name, fake_get_speech_client)
+
+    def uninstall():
+        for module, name, original in originals:
+            setattr(module, name, original)
+    return uninstall
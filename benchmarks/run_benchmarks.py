@@ -0,0 +1,206 @@
+# benchmarks/run_benchmarks.py
+#
+# 使い方（リポジトリの直下で）:
+#   python -m benchmarks.run_benchmarks
+#   python -m benchmarks.run_benchmarks --gemini-latency 1.0 --speech-latency 2.0 --repeat 3 --json bench.json
+#
+# 本物のAPIは呼ばず、benchmarks/fakes.py の身代わりを使って各ツールの show_tool を
+# Streamlit の AppTest で動かし、操作ごとのスクリプト実行時間・実行回数・ピークメモリを表示する。
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes
+
+APP_TEST_TIMEOUT_SECONDS = 120
+
+# AppTest が実行するスクリプト。実行のたびに回数を記録してから、登録簿経由でツールを起動する
+SCRIPT_TEMPLATE = """
+from benchmarks import fakes
+from tools import registry
+fakes.record_script_run({label!r})
+registry.run_tool({label!r}, gemini_api_key="fake-gemini-key", speech_api_key="fake-speech-key")
+"""
+
+# ===============================================================
+# 操作のシナリオ（AppTest は file_uploader とカスタムコンポーネントを操作できないため、
+# 音声・ファイル入力はテキスト入力やボタンで代用し、議事録ツールは初回描画のみ計測する）
+# 各操作は (操作名, 操作する関数, 呼ばれるはずのバックエンド) の組。ツールはエラーを st.error で表示して
+# 例外を外に出さないため、呼ばれるはずのバックエンドが1回も呼ばれなかった操作は失敗として扱う
+# ===============================================================
+def _button(at, label_prefix):
+    return next(button for button in at.button if button.label.startswith(label_prefix))
+
+def _translator_steps():
+    return [
+        ("初回描画", lambda at: at, ()),
+        ("翻訳（ストリーミング）", lambda at: at.text_input(key="translator_text").set_value("明日の予定を教えてくれてありがとう"), ("gemini",)),
+        ("翻訳（一括表示）", lambda at: (at.toggle(key="translator_streaming").set_value(False), at.text_input(key="translator_text").set_value("また来週会いましょう"))[-1], ("gemini",)),
+        ("翻訳メモリから再表示", lambda at: at.text_input(key="translator_text").set_value("明日の予定を教えてくれてありがとう"), ()),
+    ]
+
+def _calendar_steps():
+    return [
+        ("初回描画", lambda at: at, ()),
+        ("予定の抽出（2件）", lambda at: at.chat_input(key="cal_text_input").set_value("月曜10時に歯医者、水曜15時に打ち合わせ"), ("gemini",)),
+    ]
+
+def _research_steps():
+    return [
+        ("初回描画", lambda at: at, ()),
+        ("1キーワードのリサーチ", lambda at: (at.text_input[0].set_value("北海道の人気お土産"), _button(at, "このキーワードで").click())[-1], ("gemini",)),
+        ("価格履歴から再表示", lambda at: _button(at, "このキーワードで").click(), ()),
+        ("複数キーワードのリサーチ", lambda at: (at.radio(key="research_mode").set_value("複数のキーワードをまとめて"), at.run(),
+                                                 at.text_area[0].set_value("\n".join(f"キーワード{i}" for i in range(10))),
+                                                 _button(at, "これらのキーワードで").click())[-1], ("gemini",)),
+    ]
+
+def _transcript_steps():
+    return [("初回描画", lambda at: at, ())]
+
+def _koutsuhi_steps():
+    return [
+        ("初回描画", lambda at: at, ()),
+        ("ルート検索", lambda at: _button(at, "「").click(), ()),
+        ("キャッシュから再表示", lambda at: _button(at, "「").click(), ()),
+    ]
+
+SCENARIOS = {
+    "🤝 フレンドリー翻訳": _translator_steps,
+    "📅 カレンダー登録": _calendar_steps,
+    "💹 価格リサーチ": _research_steps,
+    "📝 議事録作成": _transcript_steps,
+    "🚇 AI乗り換え案内": _koutsuhi_steps,
+}
+
+# ===============================================================
+# 計測
+# ===============================================================
+def _reset_shared_caches(work_dir):
+    """ツール間・繰り返し間で結果が使い回されないよう、プロセス内のキャッシュを作り直す
+    翻訳メモリと価格履歴は SQLite に残るため、毎回新しいディレクトリのファイルを使わせる"""
+    from tools import gemini_cache, translation_memory, price_history
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+    os.environ["TRANSLATION_MEMORY_PATH"] = os.path.join(run_dir, "translation_memory.sqlite3")
+    os.environ["PRICE_HISTORY_PATH"] = os.path.join(run_dir, "price_history.sqlite3")
+    gemini_cache._response_cache = gemini_cache.ResponseCache()
+    translation_memory._memory = None
+    price_history._history = None
+
+def run_scenario(label, steps, work_dir):
+    """1ツール分のシナリオを実行し、操作ごとの計測結果のリストを返す（work_dir の下に、この回専用のデータを置く）"""
+    from streamlit.testing.v1 import AppTest
+    _reset_shared_caches(work_dir)
+    at = AppTest.from_string(SCRIPT_TEMPLATE.format(label=label), default_timeout=APP_TEST_TIMEOUT_SECONDS)
+    results = []
+    for step_name, interact, expected_backends in steps:
+        if results:
+            interact(at)
+        runs_before = fakes.script_run_count(label)
+        calls_before = fakes.call_counts()
+        tracemalloc.reset_peak()
+        base_memory = tracemalloc.get_traced_memory()[0]
+        started_at = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - started_at
+        peak_memory = tracemalloc.get_traced_memory()[1] - base_memory
+        calls_after = fakes.call_counts()
+        calls = {backend: calls_after[backend] - calls_before[backend] for backend in ("gemini", "speech")}
+        results.append({
+            "tool": label,
+            "step": step_name,
+            "seconds": elapsed,
+            "script_runs": fakes.script_run_count(label) - runs_before,
+            "gemini_calls": calls["gemini"],
+            "speech_calls": calls["speech"],
+            "peak_kib": peak_memory / 1024,
+            "exception": [str(e.message) for e in at.exception] or None,
+            "error": [str(e.value) for e in at.error] or None,
+            # 呼ばれるはずなのに呼ばれなかったバックエンド（失敗が速さに見えないように）
+            "missing_calls": [backend for backend in expected_backends if not calls[backend]] or None,
+        })
+    return results
+
+def _summarize(rows, repeat):
+    """繰り返し計測した結果を、(ツール, 操作) ごとの中央値にまとめる"""
+    grouped = {}
+    for row in rows:
+        grouped.setdefault((row["tool"], row["step"]), []).append(row)
+    summary = []
+    for (tool, step), samples in grouped.items():
+        def median(field):
+            values = sorted(sample[field] for sample in samples)
+            return values[len(values) // 2]
+        summary.append({
+            "tool": tool, "step": step, "repeat": repeat,
+            "seconds": median("seconds"), "script_runs": median("script_runs"),
+            "gemini_calls": median("gemini_calls"), "speech_calls": median("speech_calls"),
+            "peak_kib": median("peak_kib"),
+            "exception": next((sample["exception"] for sample in samples if sample["exception"]), None),
+            "error": next((sample["error"] for sample in samples if sample["error"]), None),
+            "missing_calls": next((sample["missing_calls"] for sample in samples if sample["missing_calls"]), None),
+        })
+    return summary
+
+def _print_table(summary):
+    print(f"{'ツール':<14} {'操作':<20} {'時間(s)':>8} {'実行回数':>6} {'Gemini':>6} {'Speech':>6} {'ピーク(KiB)':>12}")
+    for row in summary:
+        print(f"{row['tool']:<14} {row['step']:<20} {row['seconds']:>8.3f} {row['script_runs']:>6} {row['gemini_calls']:>6} {row['speech_calls']:>6} {row['peak_kib']:>12.1f}")
+        if row["exception"]:
+            print(f"    ⚠️ 例外: {row['exception']}")
+        if row["error"]:
+            print(f"    ⚠️ エラー表示: {row['error']}")
+        if row["missing_calls"]:
+            print(f"    ⚠️ 呼ばれるはずのバックエンドが呼ばれていません: {', '.join(row['missing_calls'])}")
+
+def failed_steps(summary):
+    """例外・エラー表示・呼ばれなかったバックエンドのいずれかがある操作"""
+    return [row for row in summary if row["exception"] or row["error"] or row["missing_calls"]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="身代わりのバックエンドで各ツールの応答時間を計測する")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="Gemini 1回あたりの遅延（秒）")
+    parser.add_argument("--gemini-stream-chunks", type=int, default=4, help="ストリーミング応答のチャンク数")
+    parser.add_argument("--speech-latency", type=float, default=0.5, help="Speech-to-Text 1回あたりの遅延（秒）")
+    parser.add_argument("--transcript", default=None, help="Speech-to-Text の身代わりが返す文字列")
+    parser.add_argument("--repeat", type=int, default=1, help="各シナリオの繰り返し回数（中央値を表示）")
+    parser.add_argument("--tool", action="append", choices=list(SCENARIOS), help="計測するツール（省略時はすべて）")
+    parser.add_argument("--json", dest="json_path", help="結果をJSONで書き出すパス")
+    args = parser.parse_args(argv)
+
+    options = {"gemini_latency": args.gemini_latency, "gemini_stream_chunks": args.gemini_stream_chunks, "speech_latency": args.speech_latency}
+    if args.transcript:
+        options["transcript"] = args.transcript
+    fakes.configure_fakes(**options)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 実際の翻訳メモリ・価格履歴・ディスクキャッシュを汚さない（保存先は run_scenario ごとに作り直す）
+        os.environ.pop("GEMINI_CACHE_DIR", None)
+        uninstall = fakes.install_fakes()
+        tracemalloc.start()
+        try:
+            rows = []
+            for _ in range(max(1, args.repeat)):
+                for label in args.tool or SCENARIOS:
+                    rows.extend(run_scenario(label, SCENARIOS[label](), work_dir))
+        finally:
+            tracemalloc.stop()
+            uninstall()
+
+    summary = _summarize(rows, args.repeat)
+    _print_table(summary)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+if __name__ == "__main__":
+    # 失敗した操作があれば、終了コードで知らせる（CI などで速さだけを見て通さないように）
+    sys.exit(1 if failed_steps(main()) else 0)
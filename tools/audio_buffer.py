@@ -0,0 +1,162 @@
+# tools/audio_buffer.py
+
+import streamlit as st
+import io
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+# ===============================================================
+# 音声入力の一時置き場（セッションごとのメモリ上限つき）
+# アップロードされた音声を getvalue() で丸ごとコピーせず、SpooledTemporaryFile に流し込む。
+# セッション内でメモリに置く合計がメモリ上限を超える分は、最初からディスクに置く。
+# 処理が終わったら close() で解放し、閉じ忘れもセッションが破棄された時点でまとめて閉じる。
+#   AUDIO_SESSION_MEMORY_BUDGET_MB … 1セッションがメモリに置ける音声の合計（既定 32MB）
+#   AUDIO_SPOOL_DIR                … ディスクに置くときの一時ディレクトリ（既定はOSの一時ディレクトリ）
+# ===============================================================
+DEFAULT_SESSION_MEMORY_BUDGET = int(float(os.environ.get("AUDIO_SESSION_MEMORY_BUDGET_MB", 32)) * 1024 * 1024)
+COPY_CHUNK_SIZE = 1024 * 1024
+SESSION_STATE_KEY = "audio_spool"
+
+class AudioBuffer:
+    """一時置き場の音声1つ分。open() で先頭に戻したファイルオブジェクトを返す"""
+    def __init__(self, spool, file, size, in_memory, name=None):
+        self._spool = spool
+        self._file = file
+        self.size = size
+        self.in_memory = in_memory
+        self.name = name
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def open(self):
+        if self._file is None:
+            raise ValueError("この音声はすでに解放されています。")
+        self._file.seek(0)
+        return self._file
+
+    def read_bytes(self):
+        """APIへ送るときなど、どうしてもバイト列が必要な場合だけ使う"""
+        return self.open().read()
+
+    def close(self):
+        if self._file is not None:
+            self._spool._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _close_files(files):
+    for file in list(files.values()):
+        try:
+            file.close()
+        except Exception:
+            pass
+    files.clear()
+
+class AudioSpool:
+    """1セッション分の一時置き場。セッションステートに置き、セッションと一緒に破棄される"""
+    def __init__(self, memory_budget=DEFAULT_SESSION_MEMORY_BUDGET, spool_dir=None):
+        self.memory_budget = memory_budget
+        self.spool_dir = spool_dir or os.environ.get("AUDIO_SPOOL_DIR") or None
+        self._files = {}  # id(AudioBuffer) -> 一時ファイル
+        self._memory_in_use = 0
+        self._lock = threading.Lock()
+        # 終了処理は self を参照しない（参照するとセッション破棄後も回収されない）
+        self._finalizer = weakref.finalize(self, _close_files, self._files)
+
+    @property
+    def memory_in_use(self):
+        with self._lock:
+            return self._memory_in_use
+
+    @property
+    def open_count(self):
+        with self._lock:
+            return len(self._files)
+
+    def spool(self, source, size=None, name=None):
+        """アップロードされたファイル（UploadedFile などのファイルオブジェクト）またはバイト列を一時置き場に移す"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source)
+            size = view.nbytes
+        else:
+            view = source.getbuffer() if hasattr(source, "getbuffer") else None
+            size = size if size is not None else getattr(source, "size", None)
+            if size is None and view is not None:
+                size = view.nbytes
+            name = name or getattr(source, "name", None)
+        with self._lock:
+            remaining = self.memory_budget - self._memory_in_use
+            # 上限の残りまではメモリに置き、超えた時点でディスクへ移る。残りが無ければ最初からディスクに置く
+            if remaining > 0 and (size is None or size <= remaining):
+                file = tempfile.SpooledTemporaryFile(max_size=remaining, dir=self.spool_dir)
+            else:
+                file = tempfile.TemporaryFile(dir=self.spool_dir)
+        try:
+            if view is not None:
+                for start in range(0, view.nbytes, COPY_CHUNK_SIZE):
+                    file.write(view[start:start + COPY_CHUNK_SIZE])
+            else:
+                source.seek(0)
+                shutil.copyfileobj(source, file, COPY_CHUNK_SIZE)
+            written = file.tell()
+        except BaseException:
+            file.close()
+            raise
+        finally:
+            if view is not None:
+                view.release()
+        # SpooledTemporaryFile は max_size を超えて書かれた時点でディスクへ移る
+        in_memory = isinstance(file, tempfile.SpooledTemporaryFile) and written <= remaining
+        buffer = AudioBuffer(self, file, written, in_memory, name)
+        with self._lock:
+            self._files[id(buffer)] = file
+            if in_memory:
+                self._memory_in_use += written
+        return buffer
+
+    def _release(self, buffer):
+        with self._lock:
+            file = self._files.pop(id(buffer), None)
+            if buffer.in_memory:
+                self._memory_in_use -= buffer.size
+        buffer._file = None
+        if file is not None:
+            file.close()
+
+    def close(self):
+        with self._lock:
+            self._memory_in_use = 0
+        self._finalizer()
+
+def get_audio_spool():
+    """このセッションの一時置き場（無ければ作る）"""
+    if SESSION_STATE_KEY not in st.session_state:
+        st.session_state[SESSION_STATE_KEY] = AudioSpool()
+    return st.session_state[SESSION_STATE_KEY]
+
+def open_audio(audio):
+    """バイト列・AudioBuffer・ファイルオブジェクトのどれからでも、先頭から読めるファイルオブジェクトを返す"""
+    if isinstance(audio, (bytes, bytearray)):
+        return io.BytesIO(audio)
+    if isinstance(audio, AudioBuffer):
+        return audio.open()
+    audio.seek(0)
+    return audio
+
+def audio_bytes_of(audio):
+    """バイト列・AudioBuffer・ファイルオブジェクトのどれからでも、APIへ送るバイト列を取り出す"""
+    if audio is None or isinstance(audio, (bytes, bytearray)):
+        return audio
+    if isinstance(audio, AudioBuffer):
+        return audio.read_bytes()
+    audio.seek(0)
+    return audio.read()
@@ -0,0 +1,167 @@
+# tools/audio_normalize.py
+
+import os
+import math
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+from io import BytesIO
+from google.cloud import speech
+from pydub import AudioSegment
+from pydub.silence import detect_leading_silence
+from tools.audio_buffer import AudioBuffer, open_audio, COPY_CHUNK_SIZE
+
+# ===============================================================
+# Speech-to-Text へ送る前の音声の正規化
+# wav / mp3 / m4a / flac / webm など、どの入力もここで
+# モノラル化 → 16kHz へ変換 → 前後の無音を削除 → FLAC（または LINEAR16）に変換してから送る。
+# 送る形式が決まっているので、RecognitionConfig に正確な encoding と sample_rate_hertz を書ける。
+# 長い音声でもメモリに丸ごと載せないよう、ffmpeg で一時ファイル（AUDIO_SPOOL_DIR）に PCM として書き出し、
+# 無音の検出や区間の切り出しは、そのファイルから必要な範囲だけを読んで行う。
+# ===============================================================
+SPEECH_SAMPLE_RATE = 16000
+SPEECH_SAMPLE_WIDTH = 2  # 16bit
+TRIM_SILENCE_THRESH_DB = -45
+TRIM_KEEP_MS = 200  # 発話の頭や語尾が切れないよう、前後に残す無音
+SCAN_WINDOW_MS = 10_000  # 無音を探すときに一度に読む長さ
+
+_ENCODINGS = {
+    "FLAC": speech.RecognitionConfig.AudioEncoding.FLAC,
+    "LINEAR16": speech.RecognitionConfig.AudioEncoding.LINEAR16,
+}
+
+# content: 送信するバイト列 / offset_ms: 元の音声の先頭から、削除した無音の長さ
+NormalizedAudio = namedtuple("NormalizedAudio", ["content", "encoding", "sample_rate", "duration_ms", "offset_ms"])
+
+class PcmFile:
+    """モノラル・16kHz・16bit の PCM を置いた一時ファイル。segment() で指定した範囲だけを AudioSegment にする"""
+    def __init__(self, file):
+        file.flush()
+        self._file = file
+        self._lock = threading.Lock()  # 複数のスレッドから区間を読むため
+        self.frame_rate = SPEECH_SAMPLE_RATE
+        self.sample_width = SPEECH_SAMPLE_WIDTH
+        self.frame_count = os.fstat(file.fileno()).st_size // SPEECH_SAMPLE_WIDTH
+
+    @property
+    def duration_ms(self):
+        return self.frame_count * 1000 // self.frame_rate
+
+    def _offset(self, ms):
+        return min(self.frame_count, ms * self.frame_rate // 1000) * self.sample_width
+
+    def segment(self, start_ms, end_ms):
+        start, end = self._offset(max(0, start_ms)), self._offset(end_ms)
+        with self._lock:
+            self._file.seek(start)
+            data = self._file.read(max(0, end - start))
+        return AudioSegment(data=data, sample_width=self.sample_width, frame_rate=self.frame_rate, channels=1)
+
+    def dbfs(self, start_ms=0, end_ms=None):
+        """範囲全体の音量（dBFS）を、区間ごとに読みながら求める"""
+        end_ms = self.duration_ms if end_ms is None else end_ms
+        squares, frames = 0.0, 0
+        for window_start in range(start_ms, end_ms, SCAN_WINDOW_MS):
+            window = self.segment(window_start, min(end_ms, window_start + SCAN_WINDOW_MS))
+            squares += window.rms ** 2 * window.frame_count()
+            frames += window.frame_count()
+        if not frames or not squares:
+            return -float("inf")
+        max_amplitude = float(2 ** (8 * self.sample_width - 1))
+        return 20 * math.log10(math.sqrt(squares / frames) / max_amplitude)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+@contextmanager
+def _input_fd(audio):
+    """ffmpeg に渡すファイル記述子。ディスクに置かれた AudioBuffer はそのまま使い、
+    メモリ上の小さな音声（マイク入力や、セッションのメモリ上限内の AudioBuffer）だけ一時ファイルに書き出す"""
+    if isinstance(audio, AudioBuffer) and not audio.in_memory:
+        yield audio.open().fileno()
+        return
+    with tempfile.TemporaryFile(dir=os.environ.get("AUDIO_SPOOL_DIR") or None) as file:
+        shutil.copyfileobj(open_audio(audio), file, COPY_CHUNK_SIZE)
+        file.flush()
+        yield file.fileno()
+
+def decode_to_pcm(audio):
+    """音声（バイト列・AudioBuffer・ファイル）を ffmpeg でモノラル・16kHz・16bit の PCM にし、一時ファイルの PcmFile で返す
+    入力も出力もファイルのまま受け渡すので、元の音声もデコード後の PCM もメモリに丸ごとは載らない"""
+    output = tempfile.TemporaryFile(dir=os.environ.get("AUDIO_SPOOL_DIR") or None)
+    try:
+        with _input_fd(audio) as fd:
+            command = [AudioSegment.converter, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", f"/dev/fd/{fd}",
+                       "-vn", "-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE), "-f", "s16le", "-acodec", "pcm_s16le", "pipe:1"]
+            process = subprocess.run(command, stdout=output, stderr=subprocess.PIPE, pass_fds=(fd,))
+        if process.returncode != 0:
+            raise ValueError(f"音声をデコードできませんでした: {process.stderr.decode('utf-8', 'replace').strip()[-500:]}")
+        return PcmFile(output)
+    except BaseException:
+        output.close()
+        raise
+
+def silence_bounds(pcm, silence_thresh=TRIM_SILENCE_THRESH_DB, keep_ms=TRIM_KEEP_MS):
+    """前後の無音を除いた範囲 (開始ミリ秒, 終了ミリ秒) を返す。全体が無音なら None
+    先頭からと末尾から SCAN_WINDOW_MS ずつ読んで探し、音声全体を反転・コピーしない"""
+    duration_ms = pcm.duration_ms
+    lead_ms = None
+    for window_start in range(0, duration_ms, SCAN_WINDOW_MS):
+        window = pcm.segment(window_start, window_start + SCAN_WINDOW_MS)
+        silent_ms = detect_leading_silence(window, silence_threshold=silence_thresh)
+        if silent_ms < len(window):
+            lead_ms = window_start + silent_ms
+            break
+    if lead_ms is None:
+        return None
+    trail_end_ms = duration_ms
+    window_end = duration_ms
+    while window_end > lead_ms:
+        window_start = max(lead_ms, window_end - SCAN_WINDOW_MS)
+        window = pcm.segment(window_start, window_end)
+        silent_ms = detect_leading_silence(window.reverse(), silence_threshold=silence_thresh)
+        if silent_ms < len(window):
+            trail_end_ms = window_end - silent_ms
+            break
+        window_end = window_start
+    return max(0, lead_ms - keep_ms), min(duration_ms, trail_end_ms + keep_ms)
+
+def encode_audio(segment, encoding="FLAC"):
+    """AudioSegment を送信用のバイト列にする（FLAC はおおむね LINEAR16 の半分程度の大きさ）"""
+    if encoding == "LINEAR16":
+        return segment.raw_data
+    buffer = BytesIO()
+    segment.export(buffer, format="flac")
+    return buffer.getvalue()
+
+def to_normalized(segment, encoding="FLAC", offset_ms=0):
+    return NormalizedAudio(encode_audio(segment, encoding), _ENCODINGS[encoding], segment.frame_rate, len(segment), offset_ms)
+
+def normalize_for_speech(audio, encoding="FLAC", trim=True):
+    """デコード → モノラル・16kHz → 前後の無音削除 → エンコード、を1回で行う（同期認識に送る1分程度までの音声向け）
+    全体が無音なら content が空の NormalizedAudio を返す"""
+    with decode_to_pcm(audio) as pcm:
+        bounds = silence_bounds(pcm) if trim else (0, pcm.duration_ms)
+        if bounds is None:
+            return NormalizedAudio(b"", _ENCODINGS[encoding], SPEECH_SAMPLE_RATE, 0, pcm.duration_ms)
+        segment = pcm.segment(*bounds)
+    return to_normalized(segment, encoding, bounds[0])
+
+def recognition_config(normalized, **options):
+    """正規化済みの音声に合わせて、encoding と sample_rate_hertz を明示した RecognitionConfig を作る"""
+    return speech.RecognitionConfig(
+        encoding=normalized.encoding,
+        sample_rate_hertz=normalized.sample_rate,
+        audio_channel_count=1,
+        language_code=options.pop("language_code", "ja-JP"),
+        **options,
+    )
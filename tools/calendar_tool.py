@@ -1,44 +1,143 @@
 # tools/calendar_tool.py
 
 import streamlit as st
-import google.generativeai as genai
-from google.cloud import speech
-from google.api_core.client_options import ClientOptions
+import uuid
 import json
-from datetime import datetime
+import zlib
+from datetime import datetime, timedelta
 import urllib.parse
 import pytz
 from streamlit_mic_recorder import mic_recorder
+from tools.speech_service import transcribe_audio, transcribe_audio_streaming
+from tools.audio_buffer import get_audio_spool
+from tools.structured_output import generate_structured, EVENT_LIST_SCHEMA
+from tools.gemini_clients import get_model
 
 # ===============================================================
-# 補助関数（変更なし）
+# 補助関数
 # ===============================================================
-def transcribe_audio(audio_bytes, api_key):
-    if not audio_bytes or not api_key: return None
-    try:
-        client_options = ClientOptions(api_key=api_key)
-        client = speech.SpeechClient(client_options=client_options)
-        audio = speech.RecognitionAudio(content=audio_bytes)
-        config = speech.RecognitionConfig(language_code="ja-JP", model="latest_long")
-        response = client.recognize(config=config, audio=audio)
-        if response.results: return response.results[0].alternatives[0].transcript
-    except Exception as e:
-        st.error(f"音声認識エラー: {e}")
-    return None
-
 def create_google_calendar_url(details):
     try:
-        jst = pytz.timezone('Asia/Tokyo')
-        start_time_jst = jst.localize(datetime.fromisoformat(details['start_time']))
-        end_time_jst = jst.localize(datetime.fromisoformat(details['end_time']))
-        start_time_utc = start_time_jst.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
-        end_time_utc = end_time_jst.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
-        dates = f"{start_time_utc}/{end_time_utc}"
+        start_time_utc, end_time_utc = event_times_utc(details)
+        dates = f"{start_time_utc.strftime('%Y%m%dT%H%M%SZ')}/{end_time_utc.strftime('%Y%m%dT%H%M%SZ')}"
     except (ValueError, KeyError): dates = ""
     base_url = "https://www.google.com/calendar/render?action=TEMPLATE"
     params = {"text": details.get('title', ''), "dates": dates, "location": details.get('location', ''), "details": details.get('details', '')}
     return f"{base_url}&{urllib.parse.urlencode(params, quote_via=urllib.parse.quote)}"
 
+# ===============================================================
+# 複数の予定をまとめて .ics にする
+# ===============================================================
+def event_times_utc(details):
+    """(開始, 終了) をUTCで返す。終了が無い・開始より前なら開始の1時間後にする"""
+    jst = pytz.timezone('Asia/Tokyo')
+    start = jst.localize(datetime.fromisoformat(details['start_time']))
+    try: end = jst.localize(datetime.fromisoformat(details['end_time']))
+    except (ValueError, KeyError): end = None
+    if end is None or end <= start: end = start + timedelta(hours=1)
+    return start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+
+def _escape_ics_text(text):
+    return str(text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def _fold_ics_line(line):
+    """RFC 5545 に従い、75オクテットを超える行を折り返す（マルチバイト文字は途中で切らない）"""
+    folded, current = [], ""
+    for ch in line:
+        if len((current + ch).encode("utf-8")) > 75:
+            folded.append(current)
+            current = " " + ch
+        else:
+            current += ch
+    folded.append(current)
+    return "\r\n".join(folded)
+
+def build_ics(events):
+    """予定のリストから、1つの .ics ファイルの中身を作る（日時を解釈できない予定は含めない）"""
+    stamp = datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//AI Assistant Portal//Calendar Tool//JA", "CALSCALE:GREGORIAN"]
+    for details in events:
+        try: start, end = event_times_utc(details)
+        except (ValueError, KeyError): continue
+        lines += [
+            "BEGIN:VEVENT", f"UID:{uuid.uuid4()}@ai-assistant-portal", f"DTSTAMP:{stamp}",
+            f"DTSTART:{start.strftime('%Y%m%dT%H%M%SZ')}", f"DTEND:{end.strftime('%Y%m%dT%H%M%SZ')}",
+            f"SUMMARY:{_escape_ics_text(details.get('title'))}",
+            f"LOCATION:{_escape_ics_text(details.get('location'))}",
+            f"DESCRIPTION:{_escape_ics_text(details.get('details'))}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold_ics_line(line) for line in lines) + "\r\n"
+
+def format_event_summary(index, details):
+    display_start_time = "未設定"
+    if details.get('start_time'):
+        try: display_start_time = datetime.fromisoformat(details['start_time']).strftime('%Y年%m月%d日 %H:%M')
+        except: display_start_time = "AIが日付の解析に失敗"
+    return f"""**{index}. {details.get('title') or '未設定'}**\n- **日時:** {display_start_time}\n- **場所:** {details.get('location') or '未設定'}\n- **詳細:** {details.get('details') or '未設定'}\n- [📅 Googleカレンダーにこの予定を追加する]({create_google_calendar_url(details)})"""
+
+# ===============================================================
+# チャット履歴の上限管理
+# 画面に描画するのは直近 N 件だけにし、それより古いやりとりは
+# 圧縮した「過去ログ」にまとめて、開いたときだけ展開する
+# 過去ログには id を持たせ、古いものが捨てられて並びがずれても、開閉の状態が別のまとまりに移らないようにする
+# ===============================================================
+CAL_HISTORY_WINDOW = 20
+CAL_HISTORY_MAX_BYTES = 256 * 1024  # 1セッションあたりのチャット履歴の上限（圧縮後の過去ログを含む）
+# 1つの過去ログにまとめるメッセージ数の上限。溢れたメッセージは最新の過去ログに足していき、
+# ここを超えるときだけ新しい過去ログを作る（1ターンごとに見出しが増えないように）
+CAL_ARCHIVE_BLOCK_MESSAGES = 100
+
+def _messages_size(messages):
+    return len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+
+def _summarize_messages(messages):
+    """過去ログの見出し。ユーザーの発言の冒頭を並べる（LLMは使わない）"""
+    user_turns = [message["content"].replace("\n", " ") for message in messages if message["role"] == "user"]
+    heads = " / ".join(turn[:20] + ("…" if len(turn) > 20 else "") for turn in user_turns[:3])
+    more = f" ほか{len(user_turns) - 3}件" if len(user_turns) > 3 else ""
+    return f"{len(messages)}件のやりとり: {heads or '（ユーザーの発言なし）'}{more}"
+
+def compact_chat_history(messages, archive, window=CAL_HISTORY_WINDOW, max_bytes=CAL_HISTORY_MAX_BYTES):
+    """window を超えた古いメッセージを圧縮して archive の最新の過去ログに足し、上限を超えたら古い過去ログから捨てる（どちらもその場で書き換える）
+    過去ログを捨てきっても上限を超えるときは、直近のメッセージも古いものから捨てる（最後の1件は残す）"""
+    if len(messages) > window:
+        overflow = messages[:len(messages) - window]
+        del messages[:len(messages) - window]
+        if archive and archive[-1]["count"] + len(overflow) <= CAL_ARCHIVE_BLOCK_MESSAGES:
+            # id はそのままにして、開閉の状態を保つ
+            block = archive[-1]
+            overflow = load_archived_messages(block) + overflow
+        else:
+            block = {"id": uuid.uuid4().hex}
+            archive.append(block)
+        block.update({
+            "summary": _summarize_messages(overflow),
+            "data": zlib.compress(json.dumps(overflow, ensure_ascii=False).encode("utf-8")),
+            "count": len(overflow),
+        })
+    while _messages_size(messages) + sum(len(block["data"]) for block in archive) > max_bytes:
+        if archive:
+            archive.pop(0)
+        elif len(messages) > 1:
+            del messages[0]
+        else:
+            break
+
+def load_archived_messages(block):
+    return json.loads(zlib.decompress(block["data"]).decode("utf-8"))
+
+def _remember_history_window():
+    # ウィジェットの値は、そのウィジェットを描画しない間（他のツールを開いている間）に消えるため、別のキーに残す
+    st.session_state.cal_history_window = st.session_state.cal_history_window_select
+
+def render_chat_message(message, key):
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("ics"):
+            st.download_button("🗓️ まとめてカレンダーに取り込む (.ics)", data=message["ics"].encode("utf-8"), file_name="schedule.ics", mime="text/calendar", key=key)
+
 # ===============================================================
 # 専門家のメインの仕事（rerun()との決別）
 # ===============================================================
@@ -53,6 +152,9 @@ def show_tool(gemini_api_key, speech_api_key):
         st.session_state.cal_last_mic_id = None
     if "cal_last_file_name" not in st.session_state:
         st.session_state.cal_last_file_name = None
+    if "cal_archive" not in st.session_state:
+        st.session_state.cal_archive = []
+    compact_chat_history(st.session_state.cal_messages, st.session_state.cal_archive, st.session_state.get("cal_history_window", CAL_HISTORY_WINDOW))
 
     # --- 共通AI処理関数 ---
     def process_with_gemini(prompt_text):
@@ -65,30 +167,30 @@ def show_tool(gemini_api_key, speech_api_key):
                 return
             try:
                 with st.spinner("AIが予定を組み立てています..."):
-                    genai.configure(api_key=gemini_api_key)
                     jst = pytz.timezone('Asia/Tokyo')
                     current_time_jst = datetime.now(jst).isoformat()
                     system_prompt = f"""
-                    あなたは予定を解釈する優秀なアシスタントです。ユーザーのテキストから「title」「start_time」「end_time」「location」「details」を抽出してください。
+                    あなたは予定を解釈する優秀なアシスタントです。ユーザーのテキストに含まれる「すべての予定」について、「title」「start_time」「end_time」「location」「details」を抽出してください。
+                    - 1つのテキストに複数の予定が含まれることがあります（例:「月曜10時に歯医者、水曜15時に打ち合わせ」）。予定ごとに1つの要素にしてください。
                     - 現在の日時は `{current_time_jst}` (JST)です。これを基準に日時を解釈してください。
                     - 日時は `YYYY-MM-DDTHH:MM:SS` 形式で出力してください。
                     - `end_time` が不明な場合は、`start_time` の1時間後を自動設定してください。
-                    - 必ず以下のJSON形式のみで回答してください。他の言葉は一切含めないでください。
+                    - 必ず以下のJSON形式の配列のみで回答してください。予定が1つでも配列にしてください。他の言葉は一切含めないでください。
                     ```json
-                    {{ "title": "（件名）", "start_time": "YYYY-MM-DDTHH:M:SS", "end_time": "YYYY-MM-DDTHH:MM:SS", "location": "（場所）", "details": "（詳細）" }}
+                    [
+                      {{ "title": "（件名）", "start_time": "YYYY-MM-DDTHH:MM:SS", "end_time": "YYYY-MM-DDTHH:MM:SS", "location": "（場所）", "details": "（詳細）" }}
+                    ]
                     ```
                     """
-                    model = genai.GenerativeModel('gemini-1.5-flash-latest', system_instruction=system_prompt)
-                    response = model.generate_content(prompt_text)
-                    json_text = response.text.strip().lstrip("```json").rstrip("```").strip()
-                    schedule_details = json.loads(json_text)
-                    calendar_url = create_google_calendar_url(schedule_details)
-                    display_start_time = "未設定"
-                    if schedule_details.get('start_time'):
-                        try: display_start_time = datetime.fromisoformat(schedule_details['start_time']).strftime('%Y年%m月%d日 %H:%M')
-                        except: display_start_time = "AIが日付の解析に失敗"
-                    ai_response = f"""以下の内容で承りました。よろしければリンクをクリックしてカレンダーに登録してください。\n\n- **件名:** {schedule_details.get('title', '未設定')}\n- **日時:** {display_start_time}\n- **場所:** {schedule_details.get('location', '未設定')}\n- **詳細:** {schedule_details.get('details', '未設定')}\n\n[📅 Googleカレンダーにこの予定を追加する]({calendar_url})"""
-                    st.session_state.cal_messages.append({"role": "assistant", "content": ai_response})
+                    model = get_model(gemini_api_key, 'gemini-1.5-flash-latest', system_prompt)
+                    # 1回の問い合わせで、テキスト中のすべての予定を取り出す
+                    events = generate_structured(model, prompt_text, EVENT_LIST_SCHEMA, "calendar_tool", api_key=gemini_api_key)
+                    summaries = "\n\n".join(format_event_summary(i, details) for i, details in enumerate(events, start=1))
+                    if len(events) == 1:
+                        ai_response = f"以下の内容で承りました。よろしければリンクをクリックしてカレンダーに登録してください。\n\n{summaries}"
+                    else:
+                        ai_response = f"{len(events)} 件の予定を承りました。リンクから1件ずつ登録するか、下の .ics ファイルでまとめて取り込んでください。\n\n{summaries}"
+                    st.session_state.cal_messages.append({"role": "assistant", "content": ai_response, "ics": build_ics(events)})
             except Exception as e:
                 error_message = f"AIとの通信中にエラーが発生しました: {e}"
                 st.session_state.cal_messages.append({"role": "assistant", "content": f"申し訳ありません、エラーが発生しました。({e})"})
@@ -97,9 +199,17 @@ def show_tool(gemini_api_key, speech_api_key):
     
     # --- UIウィジェットの表示 ---
     # `rerun`を、使わないので、チャット履歴表示は、ここが、最適
-    for message in st.session_state.cal_messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    # 古いやりとりは、見出しだけを出しておき、開いたときにだけ展開して描画する
+    st.select_slider("画面に表示する直近のメッセージ数", options=[10, 20, 50, 100], value=st.session_state.get("cal_history_window", CAL_HISTORY_WINDOW),
+                     key="cal_history_window_select", on_change=_remember_history_window)
+    if st.session_state.cal_archive:
+        with st.expander(f"🗄️ 過去の会話（{len(st.session_state.cal_archive)} 件のまとまり）"):
+            for block in st.session_state.cal_archive:
+                if st.toggle(block["summary"], key=f"cal_archive_open_{block['id']}"):
+                    for message_index, message in enumerate(load_archived_messages(block)):
+                        render_chat_message(message, key=f"cal_archive_ics_{block['id']}_{message_index}")
+    for i, message in enumerate(st.session_state.cal_messages):
+        render_chat_message(message, key=f"cal_ics_{i}")
 
     st.write("---")
     # 音声入力ウィジェット
@@ -119,15 +229,18 @@ def show_tool(gemini_api_key, speech_api_key):
     elif audio_info and audio_info['id'] != st.session_state.cal_last_mic_id:
         st.session_state.cal_last_mic_id = audio_info['id']
         if speech_api_key:
-            with st.spinner("音声を文字に変換中..."):
-                prompt = transcribe_audio(audio_info['bytes'], speech_api_key)
+            # 途中経過を表示しながらストリーミング認識し、認識が終わったらすぐ予定の抽出に進む
+            interim = st.empty()
+            prompt = transcribe_audio_streaming(audio_info['bytes'], speech_api_key, model="latest_long", on_interim=lambda text: interim.caption(f"🎙️ {text}"))
+            interim.empty()
         else:
             st.error("サイドバーでSpeech-to-Text APIキーを設定してください。")
     elif uploaded_file and uploaded_file.name != st.session_state.cal_last_file_name:
         st.session_state.cal_last_file_name = uploaded_file.name
         if speech_api_key:
             with st.spinner("音声ファイルを文字に変換中..."):
-                prompt = transcribe_audio(uploaded_file.getvalue(), speech_api_key)
+                with get_audio_spool().spool(uploaded_file) as audio_buffer:
+                    prompt = transcribe_audio(audio_buffer, speech_api_key, model="latest_long")
         else:
             st.error("サイドバーでSpeech-to-Text APIキーを設定してください。")
 
@@ -0,0 +1,121 @@
+# tools/gemini_cache.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from tools.perf_trace import record_cache
+
+# ===============================================================
+# Gemini 応答キャッシュ
+# (モデル名, システムプロンプト, ユーザー入力) の内容からキーを作り、
+# 同じ問い合わせには LLM を呼ばずに前回の応答を返す。
+# 1段目はプロセス内の LRU、2段目は任意のディスク（GEMINI_CACHE_DIR）
+# ===============================================================
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 512
+
+def make_cache_key(model_name, system_prompt, user_input):
+    payload = json.dumps([model_name, system_prompt, user_input], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._memory = OrderedDict()  # key -> (保存時刻, テキスト)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _is_fresh(self, stored_at):
+        return time.time() - stored_at <= self.ttl_seconds
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir: return None
+        try:
+            with open(self._disk_path(key), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._is_fresh(record.get("stored_at", 0)):
+            try: os.remove(self._disk_path(key))
+            except OSError: pass
+            return None
+        return record["stored_at"], record["text"]
+
+    def _write_disk(self, key, stored_at, text):
+        if not self.disk_dir: return
+        tmp_path = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": stored_at, "text": text}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            pass
+
+    def _remember(self, key, stored_at, text):
+        self._memory[key] = (stored_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and self._is_fresh(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._memory.pop(key, None)
+            disk_entry = self._read_disk(key)
+            if disk_entry:
+                self._remember(key, *disk_entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return disk_entry[1]
+            self.misses += 1
+            return None
+
+    def set(self, key, text):
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, stored_at, text)
+            self._write_disk(key, stored_at, text)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "entries": len(self._memory),
+            }
+
+_response_cache = ResponseCache(disk_dir=os.environ.get("GEMINI_CACHE_DIR") or None)
+
+def get_response_cache():
+    return _response_cache
+
+def cached_generate(model_name, system_prompt, user_input, generate, bypass=False, validate=None):
+    """キャッシュにあればそれを、無ければ generate() を呼んで保存した結果を返す
+    validate が例外を出した応答は保存しない。戻り値は (テキスト, キャッシュから取得したか)"""
+    key = make_cache_key(model_name, system_prompt, user_input)
+    if not bypass:
+        text = _response_cache.get(key)
+        record_cache("gemini_response", text is not None)
+        if text is not None:
+            return text, True
+    text = generate()
+    if validate:
+        validate(text)
+    _response_cache.set(key, text)
+    return text, False
@@ -0,0 +1,91 @@
+# tools/gemini_clients.py
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core.client_options import ClientOptions
+
+# ===============================================================
+# Gemini クライアントとモデルの共有プール（APIキーごと）
+# genai.configure はプロセス全体の設定を書き換えるため、別のキーを使うセッションが
+# 同時に動くと、他人のキーで送られてしまうことがある。ここでは genai.configure を使わず、
+# APIキーごとに GenerativeServiceClient を1つ作ってモデルに直接持たせる。
+# モデルもキーごとに (モデル名, システムプロンプト) で使い回し、クリックのたびに作り直さない
+# GenerativeModel._client は google-generativeai の非公開の属性なので、requirements.txt で版を固定し、
+# 属性が無くなったり別のクライアントに差し替わったりしていたら、他人のキーで送る前に RuntimeError で止める
+# ===============================================================
+CLIENT_IDLE_TTL_SECONDS = 30 * 60
+MAX_POOLED_CLIENTS = 32
+MAX_MODELS_PER_KEY = 16
+
+class _KeyEntry:
+    def __init__(self, client):
+        self.client = client
+        self.models = OrderedDict()  # (モデル名, システムプロンプトのハッシュ) -> GenerativeModel
+        self.last_used = time.monotonic()
+
+_pool = OrderedDict()  # api_key -> _KeyEntry
+_pool_lock = threading.Lock()
+
+def _new_client(api_key):
+    return glm.GenerativeServiceClient(client_options=ClientOptions(api_key=api_key))
+
+def _evict_idle(now):
+    """一定時間使われていないキーと、上限を超えた古いキーをプールから外す
+    get_model が返したモデルはロックの外でもクライアントを使い続けるため、ここでは閉じない。
+    どこからも参照されなくなれば、ガベージコレクションでチャネルが閉じられる"""
+    expired = [key for key, entry in _pool.items() if now - entry.last_used > CLIENT_IDLE_TTL_SECONDS]
+    for key in expired:
+        del _pool[key]
+    while len(_pool) > MAX_POOLED_CLIENTS:
+        _pool.popitem(last=False)
+
+def _entry_for(api_key):
+    if not api_key:
+        raise ValueError("Gemini APIキーが設定されていません。")
+    now = time.monotonic()
+    entry = _pool.pop(api_key, None) or _KeyEntry(_new_client(api_key))
+    entry.last_used = now
+    _pool[api_key] = entry
+    _evict_idle(now)
+    return entry
+
+def _bind_client(model, client):
+    """モデルにこのキーのクライアントを持たせる（既定のクライアント＝genai.configure の設定では送らない）"""
+    if not hasattr(model, "_client"):
+        raise RuntimeError("google-generativeai の GenerativeModel に _client がありません。requirements.txt で固定した版を使ってください。")
+    model._client = client
+    _check_bound(model, client)
+
+def _check_bound(model, client):
+    if getattr(model, "_client", None) is not client:
+        raise RuntimeError("Gemini のモデルが、APIキー専用のクライアント以外を使おうとしています。google-generativeai の版を確認してください。")
+
+def get_gemini_client(api_key):
+    """APIキーに対応する GenerativeServiceClient をプールから取り出す（無ければ作成する）"""
+    with _pool_lock:
+        return _entry_for(api_key).client
+
+def get_model(api_key, model_name, system_instruction=None):
+    """APIキー専用のクライアントを持った GenerativeModel を返す。同じキー・モデル名・システムプロンプトなら使い回す"""
+    model_key = (model_name, hashlib.sha256((system_instruction or "").encode("utf-8")).hexdigest())
+    with _pool_lock:
+        entry = _entry_for(api_key)
+        model = entry.models.pop(model_key, None)
+        if model is None:
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+            _bind_client(model, entry.client)
+        else:
+            # 使い回すモデルも、別のクライアントに差し替えられていないか毎回確かめる
+            _check_bound(model, entry.client)
+        entry.models[model_key] = model
+        while len(entry.models) > MAX_MODELS_PER_KEY:
+            entry.models.popitem(last=False)
+        return model
+
+def pooled_client_count():
+    with _pool_lock:
+        return len(_pool)
@@ -0,0 +1,228 @@
+# tools/gemini_gateway.py
+
+import os
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from google.api_core import exceptions as google_exceptions
+from tools.rate_limit import TokenBucket
+from tools.perf_trace import register_collector
+
+# ===============================================================
+# Gemini 呼び出しの共通の入り口
+# すべての generate_content をここに通し、APIキーごとに
+# - トークンバケットで送る速さを抑える（待ちきれなければ GeminiBusyError）
+# - 429 や一時的な 5xx はジッター付きの指数バックオフで再試行する（再試行もトークンを消費する）
+# - 再試行しても失敗した呼び出しが続いたら回路を開き、しばらくは問い合わせずにすぐ GeminiUnavailableError を返す
+#   （1回の呼び出しの中の再試行は数えず、再試行を使い切った呼び出しを1回の失敗として数える）
+# 待ち行列の長さや回路の状態は perf_trace の Prometheus 出力に含まれる。
+#   GEMINI_RATE_PER_MINUTE / GEMINI_BURST          … キーごとの送信速度（既定 60回/分、連続10回）
+#   GEMINI_QUEUE_TIMEOUT_SECONDS                    … トークンを待つ上限（既定 30秒）
+#   GEMINI_MAX_RETRIES                              … 再試行の回数（既定 4回）
+#   GEMINI_BREAKER_THRESHOLD / GEMINI_BREAKER_COOLDOWN_SECONDS … 回路を開く、再試行を使い切った呼び出しの連続数と、開いておく秒数（既定 5回・30秒）
+# 一括翻訳などで画面から指定する送信速度も、このキーごとの上限（GEMINI_RATE_PER_MINUTE）を超えては送られない
+# ===============================================================
+RATE_PER_MINUTE = float(os.environ.get("GEMINI_RATE_PER_MINUTE", 60))
+BURST = int(os.environ.get("GEMINI_BURST", 10))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_QUEUE_TIMEOUT_SECONDS", 30))
+MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", 4))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("GEMINI_BREAKER_COOLDOWN_SECONDS", 30))
+MAX_TRACKED_KEYS = 256
+
+# 待てば回復する見込みのあるエラーだけを再試行する（キーの誤りや入力の誤りは再試行しない）
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+class GeminiBusyError(Exception):
+    """送信速度の上限で、待ち時間内に順番が回ってこなかった"""
+
+class GeminiUnavailableError(Exception):
+    """Gemini が不調で回路が開いている、または再試行しても失敗した"""
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """連続 threshold 回の失敗（再試行を使い切った呼び出し）で開き、cooldown 秒後に1回だけ試しに通す（成功すれば閉じ、失敗すればまた開く）"""
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown_seconds=BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        """通してよければ True。開いている間と、試しの1回が実行中の間は False"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                    return False
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def retry_after(self):
+        with self._lock:
+            return max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at)) if self._state == OPEN else 0.0
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """成功とも失敗とも数えない終わり方（キーの誤りなど）で、試しの枠だけ返す"""
+        with self._lock:
+            self._probing = False
+
+class _KeyState:
+    def __init__(self):
+        self.bucket = TokenBucket(RATE_PER_MINUTE, burst=BURST)
+        self.breaker = CircuitBreaker()
+        self.waiting = 0
+        self.in_flight = 0
+        self.counts = {"calls": 0, "retries": 0, "rejected_busy": 0, "rejected_open": 0, "failures": 0}
+
+_states = OrderedDict()  # キーの識別子 -> _KeyState
+_states_lock = threading.Lock()
+
+def key_id(api_key):
+    """メトリクスやログに出すための、APIキーそのものを含まない識別子"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:8]
+
+def _state_for(api_key):
+    identifier = key_id(api_key)
+    with _states_lock:
+        state = _states.pop(identifier, None) or _KeyState()
+        _states[identifier] = state
+        # 使われなくなったキーから捨てる（待ち・実行中のものは残す）
+        for old_id in list(_states)[:max(0, len(_states) - MAX_TRACKED_KEYS)]:
+            if not (_states[old_id].waiting or _states[old_id].in_flight):
+                del _states[old_id]
+        return state
+
+def _backoff_seconds(attempt):
+    """フルジッター: 0 〜 min(上限, 基準 × 2^attempt) の一様乱数"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def _count(state, field):
+    with _states_lock:
+        state.counts[field] += 1
+
+def _admit(state):
+    """回路が閉じていて、トークンが取れたら通す。どちらかがだめなら例外"""
+    if not state.breaker.allow():
+        _count(state, "rejected_open")
+        raise GeminiUnavailableError(f"AIサービスでエラーが続いたため、問い合わせを一時停止しています。{state.breaker.retry_after():.0f} 秒ほど待ってからもう一度お試しください。")
+    with _states_lock:
+        state.waiting += 1
+    try:
+        acquired = state.bucket.acquire(timeout=QUEUE_TIMEOUT_SECONDS)
+    finally:
+        with _states_lock:
+            state.waiting -= 1
+    if not acquired:
+        state.breaker.release()
+        _count(state, "rejected_busy")
+        raise GeminiBusyError("AIへの問い合わせが混み合っています。少し待ってからもう一度お試しください。")
+
+def _call_with_retries(api_key, call):
+    """call() を、レート制限・再試行・回路遮断つきで実行する"""
+    state = _state_for(api_key)
+    _count(state, "calls")
+    for attempt in range(MAX_RETRIES + 1):
+        _admit(state)
+        with _states_lock:
+            state.in_flight += 1
+        try:
+            result = call()
+        except RETRYABLE_ERRORS as e:
+            # 試しの1回（半開）が失敗したとき、または再試行を使い切ったときだけ、回路の失敗として数える
+            if attempt == MAX_RETRIES or state.breaker.state == HALF_OPEN:
+                state.breaker.record_failure()
+                _count(state, "failures")
+                raise GeminiUnavailableError(f"AIサービスが一時的に利用できません。しばらくしてからもう一度お試しください。（{type(e).__name__}）") from e
+        except BaseException:
+            state.breaker.release()
+            raise
+        else:
+            state.breaker.record_success()
+            return result
+        finally:
+            with _states_lock:
+                state.in_flight -= 1
+        _count(state, "retries")
+        time.sleep(_backoff_seconds(attempt))
+
+def generate_content(api_key, model, contents, **kwargs):
+    """model.generate_content(contents, **kwargs) を共通の入り口を通して呼ぶ"""
+    return _call_with_retries(api_key, lambda: model.generate_content(contents, **kwargs))
+
+def stream_content(api_key, model, contents, **kwargs):
+    """ストリーミング版。最初のチャンクが届くまでは再試行し、届いた後のエラーはそのまま投げる
+    （表示済みの途中までの文章と、やり直した文章が混ざらないように）"""
+    def first_chunk():
+        stream = iter(model.generate_content(contents, stream=True, **kwargs))
+        return stream, next(stream, None)
+    stream, chunk = _call_with_retries(api_key, first_chunk)
+    if chunk is None:
+        return
+    yield chunk
+    yield from stream
+
+# ===============================================================
+# メトリクス
+# ===============================================================
+def gateway_stats():
+    """キーの識別子ごとの {state, waiting, in_flight, calls, retries, rejected_busy, rejected_open, failures}"""
+    with _states_lock:
+        states = list(_states.items())
+        return {identifier: dict(state.counts, waiting=state.waiting, in_flight=state.in_flight, state=state.breaker.state) for identifier, state in states}
+
+def _render_prometheus(labels):
+    stats = gateway_stats()
+    lines = ["# HELP portal_gemini_queue_depth Gemini calls waiting for a rate-limit token.",
+             "# TYPE portal_gemini_queue_depth gauge"]
+    lines += [f"portal_gemini_queue_depth{labels(key=identifier)} {row['waiting']}" for identifier, row in sorted(stats.items())]
+    lines += ["# HELP portal_gemini_in_flight Gemini calls currently being sent.",
+              "# TYPE portal_gemini_in_flight gauge"]
+    lines += [f"portal_gemini_in_flight{labels(key=identifier)} {row['in_flight']}" for identifier, row in sorted(stats.items())]
+    lines += ["# HELP portal_gemini_circuit_open Whether the circuit breaker is open (1) or half-open (0.5).",
+              "# TYPE portal_gemini_circuit_open gauge"]
+    lines += [f"portal_gemini_circuit_open{labels(key=identifier)} {({OPEN: 1, HALF_OPEN: 0.5}).get(row['state'], 0)}" for identifier, row in sorted(stats.items())]
+    lines += ["# HELP portal_gemini_gateway_events_total Gemini gateway calls, retries and rejections.",
+              "# TYPE portal_gemini_gateway_events_total counter"]
+    for identifier, row in sorted(stats.items()):
+        for event in ("calls", "retries", "rejected_busy", "rejected_open", "failures"):
+            lines.append(f"portal_gemini_gateway_events_total{labels(key=identifier, event=event)} {row[event]}")
+    return lines
+
+register_collector(_render_prometheus)
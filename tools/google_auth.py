@@ -0,0 +1,101 @@
+# tools/google_auth.py
+
+import time
+import weakref
+import threading
+from datetime import datetime, timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google_auth_oauthlib.flow import Flow
+from google.auth.transport.requests import Request
+
+# ===============================================================
+# Google 認証情報の管理
+# - Google への通信は、プロセス全体で共有する keep-alive の接続プールを使う
+# - ログイン中の Credentials を登録しておき、期限切れになる前に裏で更新する
+# ===============================================================
+AUTH_URI = "https://accounts.google.com/o/oauth2/auth"
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+USERINFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+REFRESH_MARGIN = timedelta(minutes=5)
+REFRESH_CHECK_INTERVAL_SECONDS = 60
+
+_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+_http_session = requests.Session()
+_http_session.mount("https://", _adapter)
+_refresh_request = Request(session=_http_session)
+
+def build_flow(client_id, client_secret, redirect_uri, scopes):
+    """ログイン用の Flow を作る。トークン交換も共有の接続プールを通す"""
+    flow = Flow.from_client_config(
+        client_config={"web": {"client_id": client_id, "client_secret": client_secret,
+                               "auth_uri": AUTH_URI, "token_uri": TOKEN_URI, "redirect_uris": [redirect_uri]}},
+        scopes=scopes,
+        redirect_uri=redirect_uri,
+    )
+    flow.oauth2session.mount("https://", _adapter)
+    return flow
+
+# ===============================================================
+# 期限前の自動更新
+# ===============================================================
+_registered = weakref.WeakSet()  # セッションが終われば Credentials ごと自然に外れる
+_refresh_locks = weakref.WeakKeyDictionary()
+_registry_lock = threading.Lock()
+_refresher_thread = None
+
+def _needs_refresh(creds):
+    if not creds.refresh_token:
+        return False
+    # google-auth の expiry は、タイムゾーンなしの UTC
+    return creds.expiry is None or creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+def ensure_fresh(creds):
+    """期限切れが近ければ更新する。複数スレッドから同時に呼ばれても更新は1回だけ"""
+    with _registry_lock:
+        lock = _refresh_locks.setdefault(creds, threading.Lock())
+    with lock:
+        if _needs_refresh(creds):
+            creds.refresh(_refresh_request)
+    return creds
+
+def _refresh_loop():
+    while True:
+        time.sleep(REFRESH_CHECK_INTERVAL_SECONDS)
+        with _registry_lock:
+            targets = list(_registered)
+        for creds in targets:
+            try:
+                ensure_fresh(creds)
+            except Exception:
+                # 失効などで更新できないものは、次に使われたときにエラーとして表に出る
+                pass
+
+def register_credentials(creds):
+    """Credentials を自動更新の対象に加える"""
+    global _refresher_thread
+    with _registry_lock:
+        _registered.add(creds)
+        if _refresher_thread is None:
+            _refresher_thread = threading.Thread(target=_refresh_loop, name="google-credentials-refresher", daemon=True)
+            _refresher_thread.start()
+    return creds
+
+def unregister_credentials(creds):
+    with _registry_lock:
+        _registered.discard(creds)
+
+# ===============================================================
+# Google API 呼び出し
+# ===============================================================
+def authorized_request(creds, method, url, **kwargs):
+    """必要なら更新してから、共有の接続プールでリクエストを送る"""
+    ensure_fresh(creds)
+    headers = dict(kwargs.pop("headers", None) or {}, Authorization=f"Bearer {creds.token}")
+    response = _http_session.request(method, url, headers=headers, timeout=kwargs.pop("timeout", 30), **kwargs)
+    response.raise_for_status()
+    return response
+
+def fetch_user_info(creds):
+    return authorized_request(creds, "GET", USERINFO_URL).json()
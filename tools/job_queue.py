@@ -0,0 +1,166 @@
+# tools/job_queue.py
+
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tools.perf_trace import bind_session, trace_call
+
+# ===============================================================
+# バックグラウンドの処理キュー（プロセス全体で共有）
+# 文字起こしのような長い処理をスクリプトのスレッドから切り離し、ワーカーのプールで実行する。
+# 画面側はジョブIDだけをセッションステートに持ち、進み具合・途中までの結果をポーリングで読む。
+# ウィジェットの操作で再実行されても処理は止まらず、終わったジョブは一定時間だけ結果を残す。
+#   BACKGROUND_JOB_WORKERS           … 同時に実行するジョブの数（既定 2）
+#   BACKGROUND_JOB_RETENTION_MINUTES … 終わったジョブの結果を残す時間（既定 30分）
+# ===============================================================
+DEFAULT_MAX_WORKERS = int(os.environ.get("BACKGROUND_JOB_WORKERS", 2))
+DEFAULT_RETENTION_SECONDS = float(os.environ.get("BACKGROUND_JOB_RETENTION_MINUTES", 30)) * 60
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    """中止を求められたジョブが、処理の区切りで投げる"""
+
+class Job:
+    """ジョブ1つ分。処理側は set_progress / add_partial / check_cancelled を使い、画面側は snapshot() を読む"""
+    def __init__(self, job_id, kind, label, resources):
+        self.id = job_id
+        self.kind = kind
+        self.label = label
+        self.created_at = time.time()
+        self.finished_at = None
+        self._resources = list(resources)
+        self._lock = threading.Lock()
+        self._status = QUEUED
+        self._progress = (0, 0)
+        self._partials = {}  # 並び順のキー -> 途中までの結果
+        self._result = None
+        self._error = None
+        self._cancel_requested = False
+        self._future = None
+
+    # --- 処理側から ---
+    def set_progress(self, done, total):
+        with self._lock:
+            self._progress = (done, total)
+
+    def add_partial(self, order, text):
+        """終わった部分の結果を足す。order の順に並べて表示される（並列に終わる区間の順序をそろえるため）"""
+        with self._lock:
+            self._partials[order] = text
+
+    def check_cancelled(self):
+        if self._cancel_requested:
+            raise JobCancelled()
+
+    # --- 画面側から ---
+    @property
+    def status(self):
+        with self._lock:
+            return self._status
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id, "kind": self.kind, "label": self.label, "status": self._status,
+                "progress": self._progress, "partial_text": "\n".join(self._partials[key] for key in sorted(self._partials)),
+                "result": self._result, "error": self._error,
+                "created_at": self.created_at, "finished_at": self.finished_at,
+            }
+
+    # --- キューから ---
+    def _start(self):
+        with self._lock:
+            if self._cancel_requested:
+                return False
+            self._status = RUNNING
+            return True
+
+    def _finish(self, status, result=None, error=None):
+        with self._lock:
+            self._status = status
+            self._result = result
+            self._error = error
+            self.finished_at = time.time()
+        self._release_resources()
+
+    def _release_resources(self):
+        """ジョブに引き渡された AudioBuffer などを閉じる"""
+        resources, self._resources = self._resources, []
+        for resource in resources:
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+class JobQueue:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="background-job")
+        self._jobs = {}  # job_id -> Job
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, kind="job", label="", resources=()):
+        """fn(job, *args) をバックグラウンドで実行し、ジョブIDを返す
+        resources に渡したもの（AudioBuffer など）はジョブが引き取り、終了時（中止・失敗を含む）に close() する"""
+        self._purge_expired()
+        job = Job(uuid.uuid4().hex, kind, label, resources)
+        with self._lock:
+            self._jobs[job.id] = job
+        job._future = self._executor.submit(bind_session(self._run), job, fn, args)
+        return job.id
+
+    def _run(self, job, fn, args):
+        if not job._start():
+            job._finish(CANCELLED)
+            return
+        try:
+            with trace_call("background_job", job.kind):
+                result = fn(job, *args)
+        except JobCancelled:
+            job._finish(CANCELLED)
+        except Exception as e:
+            job._finish(FAILED, error=str(e))
+        else:
+            job._finish(DONE, result=result)
+
+    def get(self, job_id):
+        """ジョブを返す。保存期間を過ぎた（または存在しない）ジョブは None"""
+        self._purge_expired()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """待機中のジョブは実行せずに終わらせ、実行中のジョブには次の区切りで止まるよう伝える"""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return False
+        job._cancel_requested = True
+        if job._future is not None and job._future.cancel():
+            job._finish(CANCELLED)
+        return True
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status not in FINISHED_STATUSES)
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """プロセス全体で共有するジョブキュー"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
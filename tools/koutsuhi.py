@@ -1,35 +1,18 @@
 import streamlit as st
-import google.generativeai as genai
 import traceback
 import json
+from tools.structured_output import generate_structured, ROUTE_LIST_SCHEMA
+from tools.gemini_cache import cached_generate, get_response_cache
+from tools.route_engine import get_route_engine
+from tools.station_index import get_station_index
+from tools.perf_trace import trace_call
+from tools.gemini_clients import get_model
+from tools.gemini_gateway import generate_content, GeminiBusyError, GeminiUnavailableError
 
-# ===============================================================
-# 専門家のメインの仕事
-# ===============================================================
-def show_tool(gemini_api_key): # 司令塔から、Gemini APIキーを、受け取るように、近代化改修します
-    
-    # この専門家は、もはや、APIキーの管理について、一切、知りません。
-    # サイドバーに、何かを描画する、という、越権行為も、一切、行いません。
-
-    st.info("出発地と目的地を入力すると、AIが標準的な所要時間や料金に基づいた最適なルートを3つ提案します。")
-    st.warning("※これはリアルタイムの運行情報を反映したものではありません。あくまで目安としてご利用ください。")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        start_station = st.text_input("🚩 出発地を入力してください", "大阪")
-    with col2:
-        end_station = st.text_input("🎯 目的地を入力してください", "小阪")
+MODEL_NAME = 'gemini-1.5-flash-latest'
 
-    if st.button(f"「{start_station}」から「{end_station}」へのルートを検索"):
-        # 司令塔から渡された、APIキーの存在を、ここで、初めて、チェックします
-        if not gemini_api_key:
-            st.error("サイドバーでGemini APIキーを設定してください。")
-        else:
-            with st.spinner(f"AIが「{start_station}」から「{end_station}」への最適なルートをシミュレーションしています..."):
-                try:
-                    genai.configure(api_key=gemini_api_key)
-                    
-                    system_prompt = """
+# 時刻表データに無い駅のときだけ使う、AIによるルートのシミュレーション
+ROUTE_SYSTEM_PROMPT = """
                     あなたは、日本の公共交通機関の膨大なデータベースを内蔵した、世界最高の「乗り換え案内エンジン」です。
                     ユーザーから指定された「出発地」と「目的地」に基づき、標準的な所要時間、料金、乗り換え情報を基に、最適な移動ルートをシミュレートするのがあなたの役割です。
                     1. **3つのルート提案:** 必ず、「早さ・安さ・楽さ」のバランスが良い、優れたルートを「3つ」提案してください。
@@ -52,27 +35,139 @@ def show_tool(gemini_api_key): # 司令塔から、Gemini APIキーを、受け
                     ]
                     ```
                     """
-                    model = genai.GenerativeModel('gemini-1.5-flash-latest', system_instruction=system_prompt)
-                    response = model.generate_content(f"出発地：{start_station}, 目的地：{end_station}")
-                    json_text = response.text.strip().lstrip("```json").rstrip("```")
-                    routes = json.loads(json_text)
+
+PHRASING_SYSTEM_PROMPT = """
+あなたは親切な駅員です。渡された乗り換えルートのJSONを読み、それぞれのルートの特徴（速さ・安さ・乗り換えの楽さ）を、
+利用者に向けて日本語で2〜4文の短い説明にまとめてください。JSONに無い情報（遅延や混雑など）は書かないでください。
+"""
+
+# ===============================================================
+# 補助関数
+# ===============================================================
+def search_local_routes(start_station, end_station):
+    """時刻表データから経路を探す。どちらかの駅がデータに無ければ None"""
+    with trace_call("local", "route_search"):
+        return get_route_engine().search(start_station, end_station)
+
+def simulate_routes_with_gemini(start_station, end_station, api_key, bypass_cache=False):
+    """AIにルートをシミュレートさせる。戻り値は (routes, キャッシュから取得したか)"""
+    user_input = f"出発地：{start_station}, 目的地：{end_station}"
+    def generate():
+        model = get_model(api_key, MODEL_NAME, ROUTE_SYSTEM_PROMPT)
+        # 検証済みのデータを正規化したJSONとして保存する
+        return json.dumps(generate_structured(model, user_input, ROUTE_LIST_SCHEMA, "koutsuhi", api_key=api_key), ensure_ascii=False)
+    response_text, from_cache = cached_generate(MODEL_NAME, ROUTE_SYSTEM_PROMPT, user_input, generate, bypass=bypass_cache)
+    return json.loads(response_text), from_cache
+
+def describe_routes_with_gemini(routes, api_key):
+    """計算済みのルートを、AIに読みやすい文章にしてもらう（経路そのものはAIに考えさせない）"""
+    routes_json = json.dumps(routes, ensure_ascii=False)
+    def generate():
+        model = get_model(api_key, MODEL_NAME, PHRASING_SYSTEM_PROMPT)
+        with trace_call("gemini", "koutsuhi:phrasing", routes_json) as trace:
+            text = generate_content(api_key, model, routes_json).text.strip()
+            trace.response_bytes = len(text.encode("utf-8"))
+        return text
+    return cached_generate(MODEL_NAME, PHRASING_SYSTEM_PROMPT, routes_json, generate)[0]
+
+def _choose_station(input_key, station_name):
+    st.session_state[input_key] = station_name
+
+def station_input(label, input_key, default):
+    """駅名の入力欄と、その下の候補ボタン。入力が駅名そのものでなければ候補を出す（別名や曖昧な入力も含む）"""
+    if input_key not in st.session_state:
+        st.session_state[input_key] = default
+    value = st.text_input(label, key=input_key)
+    engine = get_route_engine()
+    stop = engine.find_stop(value)
+    if value and (stop is None or engine.stop_names[stop] != value.strip()):
+        suggestions = get_station_index().suggest(value)
+        if suggestions:
+            st.caption("もしかして：")
+            for i, (column, suggestion) in enumerate(zip(st.columns(len(suggestions)), suggestions)):
+                column.button(suggestion.name, key=f"{input_key}_suggestion_{i}", help=suggestion.kana,
+                              on_click=_choose_station, args=(input_key, suggestion.name), use_container_width=True)
+        elif stop is None:
+            st.caption("収録されていない駅です（AIでルートを推定します）。")
+    return value
+
+def render_routes(routes, end_station):
+    for i, route in enumerate(routes):
+        with st.expander(f"**{route.get('route_name', 'ルート')}** - 約{route.get('summary', {}).get('total_time', '?')}分 / {route.get('summary', {}).get('total_fare', '?')}円 / 乗り換え{route.get('summary', {}).get('transfers', '?')}回", expanded=(i==0)):
+            if route.get('steps'):
+                for step in route['steps']:
+                    if step.get('transport_type') == "電車":
+                        st.markdown(f"**<font color='blue'>{step.get('station_from', '?')}</font>**", unsafe_allow_html=True)
+                        st.markdown(f"｜ 🚃 {step.get('line_name', '不明な路線')} ({step.get('details', '')})")
+                    elif step.get('transport_type') == "徒歩":
+                        st.markdown(f"**<font color='green'>👟 {step.get('details', '徒歩')}</font>**", unsafe_allow_html=True)
+                    elif step.get('transport_type') == "バス":
+                        st.markdown(f"**<font color='purple'>{step.get('station_from', '?')}</font>**", unsafe_allow_html=True)
+                        st.markdown(f"｜ 🚌 {step.get('line_name', '不明なバス')} ({step.get('details', '')})")
+            st.markdown(f"**<font color='red'>{end_station}</font>**", unsafe_allow_html=True)
+
+# ===============================================================
+# 専門家のメインの仕事
+# ===============================================================
+def show_tool(gemini_api_key): # 司令塔から、Gemini APIキーを、受け取るように、近代化改修します
+    
+    # この専門家は、もはや、APIキーの管理について、一切、知りません。
+    # サイドバーに、何かを描画する、という、越権行為も、一切、行いません。
+
+    st.info("出発地と目的地を入力すると、標準的な所要時間や料金に基づいた最適なルート（最速・最安・乗り換え楽）を提案します。収録されていない駅は、AIがルートをシミュレーションします。")
+    st.warning("※これはリアルタイムの運行情報を反映したものではありません。あくまで目安としてご利用ください。")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        start_station = station_input("🚩 出発地を入力してください", "koutsuhi_start_station", "大阪")
+    with col2:
+        end_station = station_input("🎯 目的地を入力してください", "koutsuhi_end_station", "小阪")
+
+    bypass_cache = st.checkbox("🔄 キャッシュを使わずに再検索する", key="koutsuhi_bypass_cache")
+    ai_phrasing = st.toggle("🗣️ AIにルートの説明文を書いてもらう", value=False, key="koutsuhi_ai_phrasing")
+
+    if st.button(f"「{start_station}」から「{end_station}」へのルートを検索"):
+        # まずは手元の時刻表データで探す（APIキーも通信も不要）
+        try:
+            local_routes = search_local_routes(start_station, end_station)
+        except Exception as e:
+            st.warning(f"時刻表データでの検索に失敗したため、AIで検索します: {e}")
+            local_routes = None
+
+        if local_routes is not None:
+            if not local_routes:
+                st.warning("出発地と目的地が同じか、収録されている路線ではつながらない区間です。")
+            else:
+                st.success("時刻表データからルートを計算しました！")
+                if ai_phrasing:
+                    if not gemini_api_key:
+                        st.caption("説明文の作成には、サイドバーでGemini APIキーを設定してください。")
+                    else:
+                        try:
+                            st.info(describe_routes_with_gemini(local_routes, gemini_api_key))
+                        except Exception as e:
+                            # 説明文はおまけなので、失敗してもルートはそのまま表示する
+                            st.caption(f"説明文を作成できませんでした: {e}")
+                render_routes(local_routes, end_station)
+        # 司令塔から渡された、APIキーの存在を、ここで、初めて、チェックします
+        elif not gemini_api_key:
+            st.error("収録されていない駅が含まれるため、AIで検索します。サイドバーでGemini APIキーを設定してください。")
+        else:
+            with st.spinner(f"AIが「{start_station}」から「{end_station}」への最適なルートをシミュレーションしています..."):
+                try:
+                    routes, from_cache = simulate_routes_with_gemini(start_station, end_station, gemini_api_key, bypass_cache)
                     
                     st.success(f"AIによるルートシミュレーションが完了しました！")
-                    
-                    for i, route in enumerate(routes):
-                        with st.expander(f"**{route.get('route_name', 'ルート')}** - 約{route.get('summary', {}).get('total_time', '?')}分 / {route.get('summary', {}).get('total_fare', '?')}円 / 乗り換え{route.get('summary', {}).get('transfers', '?')}回", expanded=(i==0)):
-                            if route.get('steps'):
-                                for step in route['steps']:
-                                    if step.get('transport_type') == "電車":
-                                        st.markdown(f"**<font color='blue'>{step.get('station_from', '?')}</font>**", unsafe_allow_html=True)
-                                        st.markdown(f"｜ 🚃 {step.get('line_name', '不明な路線')} ({step.get('details', '')})")
-                                    elif step.get('transport_type') == "徒歩":
-                                        st.markdown(f"**<font color='green'>👟 {step.get('details', '徒歩')}</font>**", unsafe_allow_html=True)
-                                    elif step.get('transport_type') == "バス":
-                                        st.markdown(f"**<font color='purple'>{step.get('station_from', '?')}</font>**", unsafe_allow_html=True)
-                                        st.markdown(f"｜ 🚌 {step.get('line_name', '不明なバス')} ({step.get('details', '')})")
-                            st.markdown(f"**<font color='red'>{end_station}</font>**", unsafe_allow_html=True)
+                    if from_cache:
+                        st.caption("⚡ 同じ検索の結果をキャッシュから表示しています。")
+                    render_routes(routes, end_station)
 
+                except (GeminiBusyError, GeminiUnavailableError) as e:
+                    # 混雑や一時的な障害は、トレースバックではなく待ってほしい旨だけを伝える
+                    st.warning(str(e))
                 except Exception as e:
                     st.error(f"シミュレーション中にエラーが発生しました: {e}")
                     st.code(traceback.format_exc())
+
+    cache_stats = get_response_cache().stats()
+    st.caption(f"キャッシュ: ヒット {cache_stats['hits']} 回 / ミス {cache_stats['misses']} 回（ヒット率 {cache_stats['hit_rate']:.0%}）")
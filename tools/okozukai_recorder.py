@@ -1,14 +1,16 @@
 # tools/okozukai_recorder.py
 
 import streamlit as st
-import google.generativeai as genai
 from streamlit_local_storage import LocalStorage
-import json
-from PIL import Image
 import io
 import time
 import pandas as pd
 from datetime import datetime
+from tools.receipt_store import ReceiptStore, current_month
+from tools.receipt_image import preprocess_receipt_image, image_digest, find_cached_extraction
+from tools.structured_output import generate_structured, StructuredOutputError, RECEIPT_SCHEMA
+from tools.perf_trace import record_cache
+from tools.gemini_clients import get_model
 
 # --- このツール専用のプロンプト ---
 GEMINI_PROMPT = """
@@ -43,6 +45,16 @@ def format_balance_display(balance):
         return f"🔴 **{abs(balance):,.0f} 円 (予算オーバー)**"
 
 
+def receipts_to_csv(receipts):
+    flat_list_for_csv = []
+    for receipt in receipts:
+        items = receipt.get('items')
+        if not items: continue
+        for item in items:
+            flat_list_for_csv.append({ "日付": receipt.get('date', 'N/A'), "品物名": item.get('name', 'N/A'), "金額": item.get('price', 0), "レシート合計": receipt.get('total_amount', 0) })
+    return pd.DataFrame(flat_list_for_csv, columns=["日付", "品物名", "金額", "レシート合計"]).to_csv(index=False, encoding='utf-8-sig')
+
+
 # --- ポータルから呼び出されるメイン関数 ---
 def show_tool(gemini_api_key):
     st.header("💰 お小遣いレコーダー", divider='rainbow')
@@ -57,11 +69,19 @@ def show_tool(gemini_api_key):
     # --- セッションステートの初期化 ---
     # ツールごとにユニークなキーを接頭辞として使い、他のツールとの衝突を避ける
     prefix = "okozukai_"
-    if f"{prefix}initialized" not in st.session_state:
+    if f"{prefix}store_overlay" not in st.session_state:
+        st.session_state[f"{prefix}store_overlay"] = {}
+    store = ReceiptStore(localS, prefix=prefix, overlay=st.session_state[f"{prefix}store_overlay"])
+    # 初回、または月が替わったときは「今月の分だけ」を組み立てる（ローカルストレージ自体は全項目が送られてくる）
+    if f"{prefix}initialized" not in st.session_state or st.session_state[f"{prefix}month"] != current_month():
+        store.migrate_legacy()
+        month = current_month()
+        st.session_state[f"{prefix}month"] = month
         st.session_state[f"{prefix}monthly_allowance"] = float(localS.getItem("okozukai_monthly_allowance") or 0.0)
-        st.session_state[f"{prefix}total_spent"] = float(localS.getItem("okozukai_total_spent") or 0.0)
+        st.session_state[f"{prefix}total_spent"] = float(store.month_meta(month)["total"])
         st.session_state[f"{prefix}receipt_preview"] = None
-        st.session_state[f"{prefix}all_receipts"] = localS.getItem("okozukai_all_receipt_data") or []
+        st.session_state[f"{prefix}month_receipts"] = store.load_month(month)
+        st.session_state[f"{prefix}extraction_cache"] = {}  # 知覚ハッシュ -> 解析結果
         st.session_state[f"{prefix}initialized"] = True
 
     # --- 確認モードの処理 ---
@@ -113,11 +133,10 @@ def show_tool(gemini_api_key):
                 "total_amount": corrected_amount,
                 "items": edited_df.to_dict('records')
             }
-            st.session_state[f"{prefix}all_receipts"].append(new_receipt_record)
-            localS.setItem("okozukai_all_receipt_data", st.session_state[f"{prefix}all_receipts"])
-
-            st.session_state[f"{prefix}total_spent"] += corrected_amount
-            localS.setItem("okozukai_total_spent", st.session_state[f"{prefix}total_spent"])
+            # 今月のセグメントに1件だけ追記し、合計はメタ情報で差分更新する
+            month_meta = store.append(new_receipt_record)
+            st.session_state[f"{prefix}month_receipts"].append(new_receipt_record)
+            st.session_state[f"{prefix}total_spent"] = float(month_meta["total"])
 
             st.session_state[f"{prefix}receipt_preview"] = None
             st.success(f"🎉 {corrected_amount:,.0f} 円の支出を記録しました！")
@@ -177,51 +196,77 @@ def show_tool(gemini_api_key):
                     st.warning("サイドバーからGemini APIキーを設定してください。")
                 else:
                     try:
-                        with st.spinner("🧠 AIがレシートを解析中..."):
-                            genai.configure(api_key=gemini_api_key)
-                            model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                            image = Image.open(uploaded_file)
-                            gemini_response = model.generate_content([GEMINI_PROMPT, image])
-                            cleaned_text = gemini_response.text.strip().replace("```json", "```").replace("```", "")
-                            extracted_data = json.loads(cleaned_text)
+                        # 送信前に画像を軽くし、同じ画像なら前回の解析結果を使い回す
+                        _, jpeg_bytes = preprocess_receipt_image(uploaded_file)
+                        image_hash = image_digest(jpeg_bytes)
+                        extraction_cache = st.session_state[f"{prefix}extraction_cache"]
+                        extracted_data = find_cached_extraction(extraction_cache, image_hash)
+                        record_cache("receipt_extraction", extracted_data is not None)
+                        if extracted_data is None:
+                            with st.spinner("🧠 AIがレシートを解析中..."):
+                                model = get_model(gemini_api_key, 'gemini-1.5-flash-latest')
+                                image_blob = {"mime_type": "image/jpeg", "data": jpeg_bytes}
+                                extracted_data = generate_structured(model, [GEMINI_PROMPT, image_blob], RECEIPT_SCHEMA, "okozukai_recorder", api_key=gemini_api_key)
+                            extraction_cache[image_hash] = extracted_data
+                        else:
+                            st.toast("⚡ 解析済みのレシートなので、前回の結果を表示します。")
 
                         st.session_state[f"{prefix}receipt_preview"] = {
                             "total_amount": float(extracted_data.get("total_amount", 0)),
                             "items": extracted_data.get("items", [])
                         }
                         st.rerun()
+                    except StructuredOutputError as e:
+                        st.error(f"❌ 解析エラー: {e}")
+                        st.code(e.raw_text, language="text")
                     except Exception as e:
                         st.error(f"❌ 解析エラー: {e}")
-                        if 'gemini_response' in locals(): st.code(gemini_response.text, language="text")
         
         st.divider()
         st.subheader("🗂️ データ管理")
-        if st.session_state[f"{prefix}all_receipts"]:
-            st.info(f"現在、{len(st.session_state[f'{prefix}all_receipts'])} 件のレシートデータが保存されています。")
-            flat_list_for_csv = []
-            for receipt in st.session_state[f'{prefix}all_receipts']:
-                items = receipt.get('items');
-                if not items: continue
-                for item in items:
-                    flat_list_for_csv.append({ "日付": receipt.get('date', 'N/A'), "品物名": item.get('name', 'N/A'), "金額": item.get('price', 0), "レシート合計": receipt.get('total_amount', 0) })
-            
-            if flat_list_for_csv:
-                df_for_csv = pd.DataFrame(flat_list_for_csv)
-                st.download_button(label="✅ 全支出履歴をCSVでダウンロード", data=df_for_csv.to_csv(index=False, encoding='utf-8-sig'), file_name=f"okozukai_history_{datetime.now().strftime('%Y%m%d')}.csv", mime="text/csv")
-        
+        month_receipts = st.session_state[f"{prefix}month_receipts"]
+        stored_months = store.months()
+        if stored_months:
+            st.info(f"今月は {len(month_receipts)} 件、{len(stored_months)} か月分のレシートデータが保存されています。")
+            c_month, c_all = st.columns(2)
+            if month_receipts:
+                c_month.download_button(label="✅ 今月の支出履歴をCSVでダウンロード", data=receipts_to_csv(month_receipts), file_name=f"okozukai_{st.session_state[f'{prefix}month']}.csv", mime="text/csv", use_container_width=True)
+            # 過去の月は、必要になったときだけ読み込む
+            if c_all.button("📚 全期間の履歴を読み込む", use_container_width=True):
+                st.session_state[f"{prefix}all_history_csv"] = receipts_to_csv(store.load_all())
+            if st.session_state.get(f"{prefix}all_history_csv"):
+                st.download_button(label="✅ 全支出履歴をCSVでダウンロード", data=st.session_state[f"{prefix}all_history_csv"], file_name=f"okozukai_history_{datetime.now().strftime('%Y%m%d')}.csv", mime="text/csv")
+
+            # ローカルストレージは再実行のたびに全項目がサーバーへ送られるため、古い月は書き出してから整理できるようにする
+            past_months = [month for month in stored_months if month < st.session_state[f"{prefix}month"]]
+            if past_months:
+                with st.expander(f"📦 過去の月のデータを整理する（{len(past_months)} か月分）"):
+                    st.caption("保存している月が多いほど、画面の操作のたびに送られるデータが増えて遅くなります。CSVに書き出してから、ブラウザから削除できます。")
+                    if st.button("過去の月をCSVにまとめる", use_container_width=True):
+                        st.session_state[f"{prefix}archive_export"] = (past_months, receipts_to_csv([receipt for month in past_months for receipt in store.load_month(month)]))
+                    export = st.session_state.get(f"{prefix}archive_export")
+                    if export:
+                        export_months, export_csv = export
+                        st.download_button(label=f"✅ {export_months[0]}〜{export_months[-1]} の履歴をCSVでダウンロード", data=export_csv, file_name=f"okozukai_{export_months[0]}_{export_months[-1]}.csv", mime="text/csv")
+                        if st.button("🗑️ 書き出した月をブラウザから削除", use_container_width=True, help="CSVをダウンロードしてから押してください。削除した月は元に戻せません。"):
+                            store.remove_months(export_months)
+                            st.session_state.pop(f"{prefix}archive_export", None)
+                            st.session_state.pop(f"{prefix}all_history_csv", None)
+                            st.success("過去の月のデータを削除しました！"); time.sleep(1); st.rerun()
+
         c1, c2 = st.columns(2)
         if c1.button("支出履歴のみリセット", use_container_width=True):
+            store.clear()
             st.session_state[f"{prefix}total_spent"] = 0.0
-            st.session_state[f"{prefix}all_receipts"] = []
-            localS.setItem("okozukai_total_spent", 0.0)
-            localS.setItem("okozukai_all_receipt_data", [])
+            st.session_state[f"{prefix}month_receipts"] = []
+            st.session_state.pop(f"{prefix}all_history_csv", None)
+            st.session_state.pop(f"{prefix}archive_export", None)
             st.success("支出履歴をリセットしました！"); time.sleep(1); st.rerun()
         if c2.button("⚠️ 全データ完全初期化", use_container_width=True, help="予算設定も含め、このツールの全データを消去します。"):
             localS.setItem("okozukai_monthly_allowance", 0.0)
-            localS.setItem("okozukai_total_spent", 0.0)
-            localS.setItem("okozukai_all_receipt_data", [])
-            #セッションステートもクリア
+            store.clear()
+            #セッションステートもクリア（書き込み済みの値の控えだけは、古い読み込み結果を防ぐため残す）
             for key in list(st.session_state.keys()):
-                if key.startswith(prefix):
+                if key.startswith(prefix) and key != f"{prefix}store_overlay":
                     del st.session_state[key]
             st.success("全データをリセットしました！"); time.sleep(1); st.rerun()
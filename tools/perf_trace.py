@@ -0,0 +1,274 @@
+# tools/perf_trace.py
+
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ===============================================================
+# 外部API呼び出しの計測
+# Gemini・Speech-to-Text・Google OAuth への呼び出しを trace_call で囲み、
+# 所要時間・送受信サイズ・エラーの種類を記録する。キャッシュの当たり外れは record_cache で記録する。
+# - プロセス全体の集計は、Prometheus のテキスト形式で書き出せる
+#     PERF_METRICS_FILE … 指定したパスに定期的に書き出す
+#     PERF_METRICS_PORT … 指定したポートで /metrics を返す（標準ライブラリの HTTP サーバー）
+# - セッションごとの直近の記録は、サイドバーのパフォーマンス欄に表示する
+# ===============================================================
+LATENCY_BUCKETS_SECONDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SESSION_RECORD_LIMIT = 200
+MAX_TRACKED_SESSIONS = 256
+METRICS_FILE_INTERVAL_SECONDS = 10
+# st.rerun / st.stop が投げる制御用の例外は、エラーとして数えない
+_SCRIPT_CONTROL_EXCEPTIONS = ("RerunException", "StopException")
+
+_lock = threading.Lock()
+_calls = {}  # (backend, operation) -> {"count", "errors", "seconds", "buckets", "request_bytes", "response_bytes"}
+_errors = {}  # (backend, operation, エラーの種類) -> 回数
+_cache_lookups = {}  # (cache, "hit" | "miss") -> 回数
+_session_records = OrderedDict()  # session_id -> deque(直近の記録)
+_thread_session = threading.local()
+_last_file_write = 0.0
+_collectors = []  # render_prometheus に行を足す関数（labels を受け取り、行のリストを返す）
+
+# ===============================================================
+# セッションの特定
+# ワーカースレッドには Streamlit のセッション情報が無いため、
+# 投入時に bind_session で包んでおくと、そのセッションの記録として扱われる
+# ===============================================================
+def current_session_id():
+    session_id = getattr(_thread_session, "session_id", None)
+    if session_id:
+        return session_id
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+def bind_session(fn):
+    """呼び出し元のセッションIDを覚えた fn を返す（ThreadPoolExecutor に渡す関数を包む）"""
+    session_id = current_session_id()
+    def bound(*args, **kwargs):
+        previous = getattr(_thread_session, "session_id", None)
+        _thread_session.session_id = session_id
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _thread_session.session_id = previous
+    return bound
+
+def _append_session_record(record):
+    session_id = current_session_id()
+    if not session_id:
+        return
+    records = _session_records.pop(session_id, None) or deque(maxlen=SESSION_RECORD_LIMIT)
+    records.append(record)
+    _session_records[session_id] = records
+    while len(_session_records) > MAX_TRACKED_SESSIONS:
+        _session_records.popitem(last=False)
+
+def session_records(session_id=None):
+    """このセッションの直近の記録（古い順）"""
+    session_id = session_id or current_session_id()
+    with _lock:
+        return list(_session_records.get(session_id, ()))
+
+# ===============================================================
+# 記録
+# ===============================================================
+def payload_size(payload):
+    """文字列・バイト列・画像の辞書（{"data": ...}）・protobuf の応答・それらのリストの、おおよそのバイト数"""
+    if payload is None:
+        return 0
+    if hasattr(payload, "_pb"):
+        return payload._pb.ByteSize()
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode("utf-8"))
+    if isinstance(payload, dict):
+        return payload_size(payload.get("data"))
+    if isinstance(payload, (list, tuple)):
+        return sum(payload_size(part) for part in payload)
+    return 0
+
+class CallTrace:
+    """trace_call の中で、受信サイズやキャッシュの利用を後から書き込むための入れ物"""
+    def __init__(self, backend, operation, request_bytes):
+        self.backend = backend
+        self.operation = operation
+        self.request_bytes = request_bytes
+        self.response_bytes = 0
+        self.cache_hit = None
+
+@contextmanager
+def trace_call(backend, operation, request=None):
+    """外部呼び出しを囲んで、所要時間・送受信サイズ・エラーの種類を記録する
+    例外は記録したうえでそのまま投げ直す（st.rerun などの制御用の例外も含む）"""
+    trace = CallTrace(backend, operation, payload_size(request))
+    started_at = time.perf_counter()
+    error_class = None
+    try:
+        yield trace
+    except BaseException as e:
+        if type(e).__name__ not in _SCRIPT_CONTROL_EXCEPTIONS:
+            error_class = type(e).__name__
+        raise
+    finally:
+        _record_call(trace, time.perf_counter() - started_at, error_class)
+
+def _record_call(trace, seconds, error_class):
+    key = (trace.backend, trace.operation)
+    with _lock:
+        stats = _calls.setdefault(key, {"count": 0, "errors": 0, "seconds": 0.0, "buckets": [0] * len(LATENCY_BUCKETS_SECONDS),
+                                        "request_bytes": 0, "response_bytes": 0})
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["request_bytes"] += trace.request_bytes
+        stats["response_bytes"] += trace.response_bytes
+        for i, bound in enumerate(LATENCY_BUCKETS_SECONDS):
+            if seconds <= bound:
+                stats["buckets"][i] += 1
+        if error_class:
+            stats["errors"] += 1
+            error_key = (trace.backend, trace.operation, error_class)
+            _errors[error_key] = _errors.get(error_key, 0) + 1
+        _append_session_record({
+            "at": time.time(), "backend": trace.backend, "operation": trace.operation, "ms": seconds * 1000,
+            "request_bytes": trace.request_bytes, "response_bytes": trace.response_bytes,
+            "error": error_class, "cache_hit": trace.cache_hit,
+        })
+    _maybe_write_metrics_file()
+
+def record_cache(cache, hit):
+    """キャッシュ（応答キャッシュ・翻訳メモリなど）の当たり外れを1件記録する"""
+    key = (cache, "hit" if hit else "miss")
+    with _lock:
+        _cache_lookups[key] = _cache_lookups.get(key, 0) + 1
+        _append_session_record({
+            "at": time.time(), "backend": "cache", "operation": cache, "ms": 0.0,
+            "request_bytes": 0, "response_bytes": 0, "error": None, "cache_hit": bool(hit),
+        })
+
+def session_summary(session_id=None):
+    """このセッションの記録を (backend, operation) ごとにまとめる: 回数・合計ms・最大ms・エラー数・キャッシュ命中数"""
+    summary = {}
+    for record in session_records(session_id):
+        row = summary.setdefault((record["backend"], record["operation"]), {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "errors": 0, "cache_hits": 0})
+        row["count"] += 1
+        row["total_ms"] += record["ms"]
+        row["max_ms"] = max(row["max_ms"], record["ms"])
+        row["errors"] += bool(record["error"])
+        row["cache_hits"] += bool(record["cache_hit"])
+    return summary
+
+# ===============================================================
+# Prometheus 形式での書き出し
+# ===============================================================
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+def register_collector(collector):
+    """ほかのモジュールのメトリクスを /metrics に含める。collector(labels) は Prometheus 形式の行のリストを返す"""
+    with _lock:
+        if collector not in _collectors:
+            _collectors.append(collector)
+
+def render_prometheus():
+    with _lock:
+        calls = {key: dict(stats, buckets=list(stats["buckets"])) for key, stats in _calls.items()}
+        errors = dict(_errors)
+        cache_lookups = dict(_cache_lookups)
+    lines = [
+        "# HELP portal_external_call_duration_seconds Latency of external API calls.",
+        "# TYPE portal_external_call_duration_seconds histogram",
+    ]
+    for (backend, operation), stats in sorted(calls.items()):
+        for bound, count in zip(LATENCY_BUCKETS_SECONDS, stats["buckets"]):
+            lines.append(f"portal_external_call_duration_seconds_bucket{_labels(backend=backend, operation=operation, le=bound)} {count}")
+        lines.append(f"portal_external_call_duration_seconds_bucket{_labels(backend=backend, operation=operation, le='+Inf')} {stats['count']}")
+        lines.append(f"portal_external_call_duration_seconds_sum{_labels(backend=backend, operation=operation)} {stats['seconds']:.6f}")
+        lines.append(f"portal_external_call_duration_seconds_count{_labels(backend=backend, operation=operation)} {stats['count']}")
+    lines += ["# HELP portal_external_call_errors_total External API calls that raised, by exception class.",
+              "# TYPE portal_external_call_errors_total counter"]
+    for (backend, operation, error_class), count in sorted(errors.items()):
+        lines.append(f"portal_external_call_errors_total{_labels(backend=backend, operation=operation, error=error_class)} {count}")
+    lines += ["# HELP portal_external_payload_bytes_total Bytes sent to and received from external APIs.",
+              "# TYPE portal_external_payload_bytes_total counter"]
+    for (backend, operation), stats in sorted(calls.items()):
+        lines.append(f"portal_external_payload_bytes_total{_labels(backend=backend, operation=operation, direction='request')} {stats['request_bytes']}")
+        lines.append(f"portal_external_payload_bytes_total{_labels(backend=backend, operation=operation, direction='response')} {stats['response_bytes']}")
+    lines += ["# HELP portal_cache_lookups_total Cache lookups in front of external APIs.",
+              "# TYPE portal_cache_lookups_total counter"]
+    for (cache, result), count in sorted(cache_lookups.items()):
+        lines.append(f"portal_cache_lookups_total{_labels(cache=cache, result=result)} {count}")
+    with _lock:
+        collectors = list(_collectors)
+    for collector in collectors:
+        lines += collector(_labels)
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path):
+    """一時ファイルに書いてから置き換える（読み手が書きかけのファイルを見ないように）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+def _maybe_write_metrics_file():
+    global _last_file_write
+    path = os.environ.get("PERF_METRICS_FILE")
+    if not path:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_file_write < METRICS_FILE_INTERVAL_SECONDS:
+            return
+        _last_file_write = now
+    try:
+        write_metrics_file(path)
+    except OSError:
+        # 計測の書き出しに失敗しても、本来の処理は止めない
+        pass
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_metrics_server = None
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """/metrics を返すHTTPサーバーを裏のスレッドで1つだけ起動する"""
+    global _metrics_server
+    with _lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, name="perf-metrics-server", daemon=True).start()
+        return _metrics_server
+
+if os.environ.get("PERF_METRICS_PORT"):
+    try:
+        start_metrics_server(int(os.environ["PERF_METRICS_PORT"]), os.environ.get("PERF_METRICS_HOST", "127.0.0.1"))
+    except (OSError, ValueError):
+        # 別のプロセスがポートを使っている場合など。計測が無くてもアプリは動かす
+        pass
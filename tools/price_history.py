@@ -0,0 +1,146 @@
+# tools/price_history.py
+
+import os
+import time
+import sqlite3
+import statistics
+import threading
+import unicodedata
+
+# ===============================================================
+# 価格リサーチの履歴
+# リサーチ1回分（キーワード・取得時刻・価格リスト）を SQLite（PRICE_HISTORY_PATH）に残し、
+# - 十分に新しい結果があれば、AIを呼ばずにそれを返す
+# - 古くなったキーワードだけを選んで取り直す
+# - 項目ごとの価格の推移（最安・最高・中央値）を出す
+# ===============================================================
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ai-assistant-portal", "price_history.sqlite3")
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    keyword TEXT NOT NULL,
+    normalized_keyword TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    item_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_keyword_fetched_at ON runs (normalized_keyword, fetched_at DESC);
+CREATE TABLE IF NOT EXISTS items (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    normalized_name TEXT NOT NULL,
+    price NUMERIC
+);
+CREATE INDEX IF NOT EXISTS items_run ON items (run_id, position);
+CREATE INDEX IF NOT EXISTS items_name ON items (normalized_name, run_id);
+"""
+
+def normalize_keyword(text):
+    """全角半角・大文字小文字・空白の違いを無視する"""
+    return "".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+class PriceHistory:
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    # --- 書き込み ---
+    def record_run(self, keyword, item_list, fetched_at=None):
+        """リサーチ1回分を保存し、その run の id を返す"""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self._lock:
+            cursor = self._db.execute("INSERT INTO runs (keyword, normalized_keyword, fetched_at, item_count) VALUES (?, ?, ?, ?)",
+                                      (keyword, normalize_keyword(keyword), fetched_at, len(item_list)))
+            run_id = cursor.lastrowid
+            self._db.executemany("INSERT INTO items (run_id, position, name, normalized_name, price) VALUES (?, ?, ?, ?, ?)", [
+                (run_id, position, item.get("name", ""), normalize_keyword(item.get("name", "")), item.get("price"))
+                for position, item in enumerate(item_list)
+            ])
+            self._db.commit()
+            return run_id
+
+    # --- 読み込み ---
+    def latest_run(self, keyword):
+        """最新の run を (取得時刻, 価格リスト) で返す。無ければ None"""
+        with self._lock:
+            row = self._db.execute("SELECT id, fetched_at FROM runs WHERE normalized_keyword = ? ORDER BY fetched_at DESC LIMIT 1",
+                                   (normalize_keyword(keyword),)).fetchone()
+            if row is None:
+                return None
+            items = self._db.execute("SELECT name, price FROM items WHERE run_id = ? ORDER BY position", (row[0],)).fetchall()
+        return row[1], [{"name": name, "price": price} for name, price in items]
+
+    def fresh_items(self, keyword, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, now=None):
+        """max_age_seconds 以内に取得した結果があれば (取得時刻, 価格リスト)、無ければ None"""
+        latest = self.latest_run(keyword)
+        now = time.time() if now is None else now
+        if latest is None or now - latest[0] > max_age_seconds:
+            return None
+        return latest
+
+    def stale_keywords(self, keywords, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, now=None):
+        """取り直しが必要な（一度も取得していない、または古くなった）キーワードだけを返す"""
+        now = time.time() if now is None else now
+        normalized = {keyword: normalize_keyword(keyword) for keyword in keywords}
+        with self._lock:
+            placeholders = ",".join("?" * len(normalized))
+            rows = self._db.execute(f"SELECT normalized_keyword, MAX(fetched_at) FROM runs WHERE normalized_keyword IN ({placeholders}) GROUP BY normalized_keyword",
+                                    list(normalized.values())).fetchall() if normalized else []
+        last_fetched = dict(rows)
+        return [keyword for keyword in keywords if now - last_fetched.get(normalized[keyword], float("-inf")) > max_age_seconds]
+
+    def run_history(self, keyword, limit=50):
+        """そのキーワードの run ごとの (取得時刻, 件数, 最安, 中央値, 最高)。新しい順"""
+        with self._lock:
+            runs = self._db.execute("SELECT id, fetched_at, item_count FROM runs WHERE normalized_keyword = ? ORDER BY fetched_at DESC LIMIT ?",
+                                    (normalize_keyword(keyword), limit)).fetchall()
+            prices = {}
+            for run_id, price in self._db.execute(
+                    f"SELECT run_id, price FROM items WHERE run_id IN ({','.join('?' * len(runs))}) AND price > 0", [run[0] for run in runs]).fetchall() if runs else []:
+                prices.setdefault(run_id, []).append(price)
+        return [{
+            "fetched_at": fetched_at, "item_count": item_count,
+            "min": min(prices[run_id]) if run_id in prices else None,
+            "median": statistics.median(prices[run_id]) if run_id in prices else None,
+            "max": max(prices[run_id]) if run_id in prices else None,
+        } for run_id, fetched_at, item_count in runs]
+
+    def item_trends(self, keyword, since=None):
+        """項目ごとの価格の推移: 登場回数・最安・中央値・最高・最新の価格・初回と最新の取得時刻。登場回数の多い順"""
+        query = ("SELECT items.normalized_name, items.name, items.price, runs.fetched_at FROM items JOIN runs ON runs.id = items.run_id "
+                 "WHERE runs.normalized_keyword = ? AND items.price > 0")
+        params = [normalize_keyword(keyword)]
+        if since is not None:
+            query += " AND runs.fetched_at >= ?"
+            params.append(since)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY runs.fetched_at", params).fetchall()
+        grouped = {}
+        for normalized_name, name, price, fetched_at in rows:
+            entry = grouped.setdefault(normalized_name, {"name": name, "prices": [], "first_seen": fetched_at})
+            entry["name"] = name  # 表記は最新のものにそろえる
+            entry["prices"].append(price)
+            entry["last_seen"] = fetched_at
+        trends = [{
+            "name": entry["name"], "runs": len(entry["prices"]),
+            "min": min(entry["prices"]), "median": statistics.median(entry["prices"]), "max": max(entry["prices"]),
+            "latest": entry["prices"][-1], "first_seen": entry["first_seen"], "last_seen": entry["last_seen"],
+        } for entry in grouped.values()]
+        return sorted(trends, key=lambda trend: (-trend["runs"], trend["name"]))
+
+_history = None
+_history_lock = threading.Lock()
+
+def get_price_history():
+    """プロセス全体で共有する価格履歴（PRICE_HISTORY_PATH、未指定ならユーザーのキャッシュディレクトリ）"""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = PriceHistory(os.environ.get("PRICE_HISTORY_PATH") or DEFAULT_DB_PATH)
+        return _history
@@ -0,0 +1,56 @@
+# tools/receipt_image.py
+
+import io
+import hashlib
+from PIL import Image, ImageOps, ImageFilter
+
+# ===============================================================
+# レシート画像の前処理（Geminiへ送る前に、小さく・軽く・見やすくする）
+# EXIF回転 → レシート部分の切り抜き → グレースケール → 縮小 → JPEG再圧縮
+# ===============================================================
+TARGET_LONG_EDGE = 1600
+JPEG_QUALITY = 80
+CROP_MARGIN_RATIO = 0.02
+
+def crop_to_receipt(gray):
+    """背景より明るい紙の部分を探して切り抜く。見つからない・ほぼ全面のときはそのまま返す"""
+    thumb = gray.copy()
+    thumb.thumbnail((400, 400))
+    scale_x, scale_y = gray.width / thumb.width, gray.height / thumb.height
+    # ノイズを均してから、明るい領域だけを残す
+    mask = ImageOps.autocontrast(thumb.filter(ImageFilter.MedianFilter(5))).point(lambda v: 255 if v > 170 else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return gray
+    left, top, right, bottom = bbox
+    area_ratio = (right - left) * (bottom - top) / (thumb.width * thumb.height)
+    if area_ratio < 0.1 or area_ratio > 0.95:
+        return gray
+    margin_x, margin_y = gray.width * CROP_MARGIN_RATIO, gray.height * CROP_MARGIN_RATIO
+    return gray.crop((
+        max(0, int(left * scale_x - margin_x)), max(0, int(top * scale_y - margin_y)),
+        min(gray.width, int(right * scale_x + margin_x)), min(gray.height, int(bottom * scale_y + margin_y)),
+    ))
+
+def preprocess_receipt_image(image_file, long_edge=TARGET_LONG_EDGE, quality=JPEG_QUALITY):
+    """前処理済みの (PIL画像, JPEGバイト列) を返す"""
+    image = ImageOps.exif_transpose(Image.open(image_file))
+    gray = crop_to_receipt(image.convert("L"))
+    if max(gray.size) > long_edge:
+        gray.thumbnail((long_edge, long_edge), Image.LANCZOS)
+    buffer = io.BytesIO()
+    gray.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return gray, buffer.getvalue()
+
+# ===============================================================
+# 解析結果の使い回し
+# 同じ様式のレシートは、品目や合計が違っても見た目がほとんど変わらず、知覚ハッシュ（dHash）では
+# 数ビットしか違わない。別のレシートに前回の合計や品目を出さないよう、前処理後の JPEG が
+# 完全に一致したとき（同じ画像をもう一度解析したとき）だけ結果を使い回す
+# ===============================================================
+def image_digest(jpeg_bytes):
+    return hashlib.sha256(jpeg_bytes).hexdigest()
+
+def find_cached_extraction(cache, digest):
+    """{ダイジェスト: 抽出結果} から、同じ画像の結果を返す（無ければ None）"""
+    return cache.get(digest)
@@ -0,0 +1,121 @@
+# tools/receipt_store.py
+
+from datetime import datetime
+
+# ===============================================================
+# 月ごとに分割した、追記専用のレシート保存領域（ブラウザのローカルストレージ上）
+#
+# キーの構成（prefix = "okozukai_"）:
+#   okozukai_months               … 記録のある月の一覧 ["2026-09", "2026-10", ...]
+#   okozukai_m_2026-10            … その月のメタ情報 {"segments": 3, "count": 5, "total": 4200.0}
+#   okozukai_m_2026-10_s00002     … 追記された1回分のレシート（のリスト）
+#
+# 1回の確定で書き込むのは「新しいセグメント」と「小さなメタ情報」だけなので、
+# 履歴が増えても書き込み量は一定。合計はメタ情報で差分更新する。
+# ただし streamlit_local_storage は再実行のたびにローカルストレージの全項目をサーバーへ送るため、
+# 読み込み量は保存している月の数に比例して増える（画面で集計するのは今月分だけでも）。
+# 古い月は CSV に書き出したうえで remove_months() でブラウザから消し、送られる量を抑える。
+# 書き込みがブラウザに反映される前の再実行でも古い値を読まないよう、
+# このセッションで書いた値は overlay（セッションステート上の辞書）からも読む。
+# ===============================================================
+LEGACY_RECEIPTS_KEY = "okozukai_all_receipt_data"
+LEGACY_TOTAL_KEY = "okozukai_total_spent"
+
+def month_of(date_text):
+    """'YYYY-MM-DD HH:MM' 形式の日付から 'YYYY-MM' を取り出す"""
+    return (date_text or "")[:7] or current_month()
+
+def current_month():
+    return datetime.now().strftime('%Y-%m')
+
+class ReceiptStore:
+    def __init__(self, local_storage, prefix="okozukai_", overlay=None):
+        self.local_storage = local_storage
+        self.prefix = prefix
+        self.overlay = {} if overlay is None else overlay
+
+    # --- キー ---
+    def _months_key(self):
+        return f"{self.prefix}months"
+
+    def _meta_key(self, month):
+        return f"{self.prefix}m_{month}"
+
+    def _segment_key(self, month, index):
+        return f"{self.prefix}m_{month}_s{index:05d}"
+
+    def _get(self, item_key):
+        if item_key in self.overlay:
+            return self.overlay[item_key]
+        return self.local_storage.getItem(item_key)
+
+    def _set(self, item_key, value):
+        self.overlay[item_key] = value
+        # 同じ実行の中で複数の項目を書き込むため、コンポーネントのキーも項目ごとに分ける
+        self.local_storage.setItem(item_key, value, key=f"set_{item_key}")
+
+    def _delete(self, item_key):
+        self.overlay[item_key] = None
+        self.local_storage.deleteItem(item_key, key=f"delete_{item_key}")
+
+    # --- 読み込み ---
+    def months(self):
+        return self._get(self._months_key()) or []
+
+    def month_meta(self, month):
+        return self._get(self._meta_key(month)) or {"segments": 0, "count": 0, "total": 0.0}
+
+    def load_month(self, month):
+        receipts = []
+        for index in range(self.month_meta(month)["segments"]):
+            receipts.extend(self._get(self._segment_key(month, index)) or [])
+        return receipts
+
+    def load_all(self):
+        """全期間のレシート（CSV出力などで必要になったときだけ呼ぶ）"""
+        return [receipt for month in self.months() for receipt in self.load_month(month)]
+
+    # --- 書き込み ---
+    def _append_segment(self, month, receipts, update_months=True):
+        meta = self.month_meta(month)
+        self._set(self._segment_key(month, meta["segments"]), receipts)
+        new_meta = {
+            "segments": meta["segments"] + 1,
+            "count": meta["count"] + len(receipts),
+            "total": meta["total"] + sum(float(receipt.get("total_amount", 0)) for receipt in receipts),
+        }
+        self._set(self._meta_key(month), new_meta)
+        if update_months and month not in self.months():
+            self._set(self._months_key(), sorted(self.months() + [month]))
+        return new_meta
+
+    def append(self, receipt):
+        """レシートを1件追記し、その月の新しいメタ情報を返す"""
+        return self._append_segment(month_of(receipt.get("date")), [receipt])
+
+    def remove_months(self, months):
+        """指定した月のセグメントとメタ情報を消し、月の一覧からも外す"""
+        months = set(months)
+        for month in months:
+            for index in range(self.month_meta(month)["segments"]):
+                self._delete(self._segment_key(month, index))
+            self._delete(self._meta_key(month))
+        self._set(self._months_key(), [month for month in self.months() if month not in months])
+
+    def clear(self):
+        self.remove_months(self.months())
+
+    def migrate_legacy(self):
+        """1つのリストに全件を入れていた旧形式があれば、月ごとのセグメントに移し替える"""
+        legacy_receipts = self._get(LEGACY_RECEIPTS_KEY)
+        if not legacy_receipts:
+            return False
+        by_month = {}
+        for receipt in legacy_receipts:
+            by_month.setdefault(month_of(receipt.get("date")), []).append(receipt)
+        for month, receipts in by_month.items():
+            self._append_segment(month, receipts, update_months=False)
+        self._set(self._months_key(), sorted(set(self.months()) | set(by_month)))
+        self._set(LEGACY_RECEIPTS_KEY, None)
+        self._set(LEGACY_TOTAL_KEY, None)
+        return True
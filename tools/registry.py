@@ -0,0 +1,54 @@
+# tools/registry.py
+
+import time
+import importlib
+import threading
+from collections import namedtuple
+
+# ===============================================================
+# ツール登録簿
+# 各ツールは「表示名・モジュール名・呼び出す関数・必要なAPIキー」だけを宣言する。
+# モジュール（と google.cloud.speech や pandas などの重い依存）は、
+# そのツールが初めて選ばれたときに読み込む。
+# ===============================================================
+ToolSpec = namedtuple("ToolSpec", ["label", "module", "entry", "args"])
+
+TOOL_SPECS = [
+    ToolSpec("🤝 フレンドリー翻訳", "tools.translator_tool", "show_tool", ("gemini_api_key", "speech_api_key")),
+    ToolSpec("📅 カレンダー登録", "tools.calendar_tool", "show_tool", ("gemini_api_key", "speech_api_key")),
+    ToolSpec("💹 価格リサーチ", "tools.research_tool", "show_tool", ("gemini_api_key",)),
+    ToolSpec("📝 議事録作成", "tools.transcript_tool", "show_tool", ("speech_api_key",)),
+    ToolSpec("🚇 AI乗り換え案内", "tools.koutsuhi", "show_tool", ("gemini_api_key",)),
+    # ToolSpec("💰 お小遣いレコーダー", "tools.okozukai_recorder", "show_tool", ("gemini_api_key",)),
+]
+
+_specs_by_label = {spec.label: spec for spec in TOOL_SPECS}
+_import_costs = {}  # label -> 初回読み込みにかかったミリ秒
+_import_lock = threading.Lock()
+
+def tool_labels():
+    return tuple(spec.label for spec in TOOL_SPECS)
+
+def get_tool_spec(label):
+    return _specs_by_label.get(label)
+
+def load_tool(label):
+    """ツールのエントリ関数を返す。初回だけモジュールを読み込み、その時間を記録する"""
+    spec = _specs_by_label[label]
+    with _import_lock:
+        started_at = time.perf_counter()
+        module = importlib.import_module(spec.module)
+        if label not in _import_costs:
+            _import_costs[label] = (time.perf_counter() - started_at) * 1000
+    return getattr(module, spec.entry)
+
+def run_tool(label, **api_keys):
+    """ツールを起動する。宣言された引数だけを渡す"""
+    spec = _specs_by_label[label]
+    entry = load_tool(label)
+    return entry(**{name: api_keys.get(name, "") for name in spec.args})
+
+def import_cost_report():
+    """[(表示名, 読み込みミリ秒 or None)]。共有の依存は最初に読み込んだツールの時間に含まれる"""
+    with _import_lock:
+        return [(spec.label, _import_costs.get(spec.label)) for spec in TOOL_SPECS]
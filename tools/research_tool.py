@@ -1,7 +1,181 @@
 import streamlit as st
-import google.generativeai as genai
-import json
+import io
 import pandas as pd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tools.structured_output import generate_structured, PRICE_LIST_SCHEMA
+from tools.gemini_clients import get_model
+from tools.perf_trace import bind_session, record_cache
+from tools.price_history import get_price_history, DEFAULT_MAX_AGE_SECONDS
+
+MODEL_NAME = 'gemini-1.5-flash-latest'
+BULK_MAX_KEYWORDS = 100
+# 価格履歴の結果をそのまま使う期間（日）。これより古いキーワードだけAIに聞き直す
+FRESHNESS_OPTIONS_DAYS = [1, 3, 7, 14, 30]
+
+# ===============================================================
+# 補助関数
+# ===============================================================
+
+def build_system_prompt(keyword):
+    # 「成功コード」の魂である、洗練されたシステムプロンプト
+    return f"""
+    あなたは、ユーザーから指定されたキーワードに基づいて、関連商品のリストと、その平均的な価格を調査する、非常に優秀なリサーチアシスタントです。
+    ユーザーからのキーワードは「{keyword}」です。
+    このキーワードに関連する商品やサービスの情報を、20個、リストアップしてください。
+    情報は、必ず以下のJSON形式の配列のみで回答してください。他の言葉は一切含めないでください。
+    - 「name」には、商品名やサービス名を具体的に記入してください。
+    - 「price」には、日本円での平均的な販売価格を、必ず数値のみで記入してください。不明な場合は0と記入してください。
+    ```json
+    [
+      {{ "name": "（商品名1）", "price": (価格1) }},
+      {{ "name": "（商品名2）", "price": (価格2) }}
+    ]
+    ```
+    """
+
+def research_keyword(keyword, api_key, bypass_cache=False, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+    """1つのキーワードの価格リストを返す。戻り値は (item_list, 取得元)
+    取得元は "history"（価格履歴）/ "gemini"（AIに新しく問い合わせた）。
+    max_age_seconds 以内の価格履歴があればAIを呼ばずにそれを返し、新しく取得した結果は価格履歴に残す。
+    価格履歴が古いときに取り直すのが目的なので、AIの応答キャッシュは使わない
+    （キャッシュから返すと価格履歴に記録されず、いつまでも古いままになり、推移にも残らない）。
+    並列実行からも呼ばれるため st.* は使わない"""
+    history = get_price_history()
+    if not bypass_cache:
+        fresh = history.fresh_items(keyword, max_age_seconds)
+        record_cache("price_history", fresh is not None)
+        if fresh is not None:
+            return fresh[1], "history"
+    system_prompt = build_system_prompt(keyword)
+    user_input = f"「{keyword}」に関連する商品・サービスの価格情報を20個教えてください。"
+    model = get_model(api_key, MODEL_NAME, system_prompt)
+    item_list = generate_structured(model, user_input, PRICE_LIST_SCHEMA, "research_tool", api_key=api_key)
+    if item_list:
+        history.record_run(keyword, item_list)
+    return item_list, "gemini"
+
+def items_to_dataframe(item_list):
+    """pandasを使ってデータを整形し、価格の安い順に並べる"""
+    df = pd.DataFrame(item_list, columns=["name", "price"])
+    df.columns = ["項目名", "価格（円）"]
+    df['価格（円）'] = pd.to_numeric(df['価格（円）'], errors='coerce')
+    return df.sort_values(by="価格（円）", na_position='last')
+
+def research_keywords_concurrently(keywords, api_key, max_workers, bypass_cache=False, on_progress=None, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+    """複数キーワードを並列にリサーチし、「キーワード」列つきの1つのDataFrame、失敗したキーワードの辞書、
+    キーワードごとの取得元の辞書を返す。価格履歴が新しいキーワードはAIに問い合わせず、古いものだけ取り直す
+    on_progress(完了数, 全体数, キーワード) は、呼び出し元のスレッドから呼ばれる"""
+    frames, errors, sources = {}, {}, {}
+    stale = set(keywords if bypass_cache else get_price_history().stale_keywords(keywords, max_age_seconds))
+    # 新しい価格履歴があるキーワードはスレッドを使わずにその場で読む
+    done_count = 0
+    for keyword in keywords:
+        if keyword in stale:
+            continue
+        try:
+            item_list, sources[keyword] = research_keyword(keyword, api_key, bypass_cache, max_age_seconds)
+            frames[keyword] = items_to_dataframe(item_list)
+        except Exception as e:
+            # 1つのキーワードの失敗で、まとめてのリサーチ全体を止めない
+            errors[keyword] = str(e)
+        done_count += 1
+        if on_progress:
+            on_progress(done_count, len(keywords), keyword)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(bind_session(research_keyword), keyword, api_key, bypass_cache, max_age_seconds): keyword
+                   for keyword in keywords if keyword in stale}
+        for future in as_completed(futures):
+            keyword = futures[future]
+            try:
+                item_list, sources[keyword] = future.result()
+                if item_list:
+                    frames[keyword] = items_to_dataframe(item_list)
+                else:
+                    errors[keyword] = "情報を取得できませんでした"
+            except Exception as e:
+                errors[keyword] = str(e)
+            done_count += 1
+            if on_progress:
+                on_progress(done_count, len(keywords), keyword)
+    except BaseException:
+        # 画面の操作で再実行されたとき（on_progress の st.* から例外が出る）は、まだ始まっていないキーワードを取り消して、待たずに抜ける
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    # 入力したキーワードの順に並べて結合する
+    columns = ["キーワード", "項目名", "価格（円）"]
+    ordered = [frames[keyword].assign(キーワード=keyword) for keyword in keywords if keyword in frames]
+    merged = pd.concat(ordered, ignore_index=True)[columns] if ordered else pd.DataFrame(columns=columns)
+    return merged, errors, sources
+
+def trends_to_dataframe(trends):
+    """価格履歴の項目ごとの推移を、表示用のDataFrameにする"""
+    columns = ["項目名", "取得回数", "最安（円）", "中央値（円）", "最高（円）", "最新（円）", "初回取得", "最終取得"]
+    rows = [[trend["name"], trend["runs"], trend["min"], trend["median"], trend["max"], trend["latest"],
+             datetime.fromtimestamp(trend["first_seen"]).strftime("%Y-%m-%d"), datetime.fromtimestamp(trend["last_seen"]).strftime("%Y-%m-%d")]
+            for trend in trends]
+    return pd.DataFrame(rows, columns=columns)
+
+def show_price_trends(keyword):
+    """同じキーワードを2回以上リサーチしていれば、項目ごとの価格の推移を表示する"""
+    history = get_price_history()
+    runs = history.run_history(keyword)
+    if len(runs) < 2:
+        return
+    with st.expander(f"📈 「{keyword}」の価格の推移（{len(runs)} 回分の履歴）"):
+        st.dataframe(trends_to_dataframe(history.item_trends(keyword)), hide_index=True)
+
+def parse_keywords(text):
+    """改行またはカンマ区切りのキーワードを、重複を除いて入力順に返す"""
+    keywords = [part.strip() for line in text.splitlines() for part in line.replace("、", ",").split(",")]
+    return list(dict.fromkeys(keyword for keyword in keywords if keyword))
+
+# ===============================================================
+# 一括リサーチモード
+# ===============================================================
+
+def show_bulk_research(gemini_api_key, bypass_cache, max_age_seconds):
+    keywords_text = st.text_area("リサーチしたいキーワードを1行に1つ（またはカンマ区切りで）入力してください", height=150, key="research_bulk_keywords")
+    col1, col2 = st.columns(2)
+    max_workers = col1.slider("同時にリサーチする数", min_value=1, max_value=8, value=4, key="research_bulk_workers")
+    file_format = col2.radio("ダウンロード形式", ["CSV", "Parquet"], horizontal=True, key="research_bulk_format")
+
+    if st.button("これらのキーワードでまとめてリサーチする"):
+        keywords = parse_keywords(keywords_text)
+        if not gemini_api_key:
+            st.error("サイドバーでGemini APIキーを設定してください。")
+        elif not keywords:
+            st.warning("キーワードを入力してください。")
+        elif len(keywords) > BULK_MAX_KEYWORDS:
+            st.warning(f"一度にリサーチできるのは {BULK_MAX_KEYWORDS} 件までです。")
+        else:
+            progress_bar = st.progress(0.0, text=f"{len(keywords)} 件のキーワードをリサーチしています...")
+            def update_progress(done, total, keyword):
+                progress_bar.progress(done / total, text=f"「{keyword}」完了 ({done}/{total})")
+            merged, errors, sources = research_keywords_concurrently(keywords, gemini_api_key, max_workers, bypass_cache, on_progress=update_progress, max_age_seconds=max_age_seconds)
+            progress_bar.empty()
+            st.session_state.research_bulk_result = merged
+            st.session_state.research_bulk_errors = errors
+            st.session_state.research_bulk_sources = sources
+
+    merged = st.session_state.get("research_bulk_result")
+    if merged is not None:
+        for keyword, error in st.session_state.get("research_bulk_errors", {}).items():
+            st.warning(f"「{keyword}」のリサーチに失敗しました: {error}")
+        if not merged.empty:
+            st.success(f"{merged['キーワード'].nunique()} 件のキーワード、合計 {len(merged)} 件の価格情報を取得しました！")
+            reused = sum(1 for source in st.session_state.get("research_bulk_sources", {}).values() if source == "history")
+            if reused:
+                st.caption(f"⚡ {reused} 件のキーワードは価格履歴の結果を使い、古くなったキーワードだけをAIに問い合わせました。")
+            if file_format == "Parquet":
+                buffer = io.BytesIO()
+                merged.to_parquet(buffer, index=False)
+                st.download_button("まとめた価格リストをダウンロード (.parquet)", data=buffer.getvalue(), file_name="bulk_research.parquet", mime="application/octet-stream")
+            else:
+                st.download_button("まとめた価格リストをダウンロード (.csv)", data=merged.to_csv(index=False).encode('utf_8_sig'), file_name="bulk_research.csv", mime="text/csv")
+            st.dataframe(merged)
 
 # ===============================================================
 # 専門家のメインの仕事 (司令塔 app.py から呼び出される)
@@ -12,6 +186,17 @@ def show_tool(gemini_api_key):
     st.header("💹 万能！価格リサーチツール")
     st.info("調べたいもののキーワードを入力すると、AIが関連商品の価格情報をリサーチし、スプレッドシート用のファイル（CSV）を作成します。")
 
+    mode = st.radio("リサーチ方法", ["1つのキーワード", "複数のキーワードをまとめて"], horizontal=True, key="research_mode")
+    col1, col2 = st.columns(2)
+    bypass_cache = col1.checkbox("🔄 キャッシュを使わずに最新の情報を取得する", key="research_bypass_cache")
+    max_age_days = col2.select_slider("価格履歴を使う期間（日）", options=FRESHNESS_OPTIONS_DAYS, value=7, key="research_max_age_days",
+                                      help="この日数以内にリサーチしたキーワードは、AIに問い合わせず前回の結果を使います。")
+    max_age_seconds = max_age_days * 24 * 60 * 60
+
+    if mode == "複数のキーワードをまとめて":
+        show_bulk_research(gemini_api_key, bypass_cache, max_age_seconds)
+        return
+
     keyword = st.text_input("リサーチしたいキーワードを入力してください（例：20代向け メンズ香水, 北海道の人気お土産）")
 
     if st.button("このキーワードで価格情報をリサーチする"):
@@ -22,41 +207,17 @@ def show_tool(gemini_api_key):
         else:
             with st.spinner(f"AIが「{keyword}」の価格情報をリサーチしています..."):
                 try:
-                    genai.configure(api_key=gemini_api_key)
-                    
-                    # 「成功コード」の魂である、洗練されたシステムプロンプト
-                    system_prompt = f"""
-                    あなたは、ユーザーから指定されたキーワードに基づいて、関連商品のリストと、その平均的な価格を調査する、非常に優秀なリサーチアシスタントです。
-                    ユーザーからのキーワードは「{keyword}」です。
-                    このキーワードに関連する商品やサービスの情報を、20個、リストアップしてください。
-                    情報は、必ず以下のJSON形式の配列のみで回答してください。他の言葉は一切含めないでください。
-                    - 「name」には、商品名やサービス名を具体的に記入してください。
-                    - 「price」には、日本円での平均的な販売価格を、必ず数値のみで記入してください。不明な場合は0と記入してください。
-                    ```json
-                    [
-                      {{ "name": "（商品名1）", "price": (価格1) }},
-                      {{ "name": "（商品名2）", "price": (価格2) }}
-                    ]
-                    ```
-                    """
-                    model = genai.GenerativeModel('gemini-1.5-flash-latest', system_instruction=system_prompt)
-                    response = model.generate_content(f"「{keyword}」に関連する商品・サービスの価格情報を20個教えてください。")
-                    
-                    # AIの応答からJSON部分を安全に抽出
-                    json_text = response.text.strip().lstrip("```json").rstrip("```")
-                    item_list = json.loads(json_text)
-                    
+                    item_list, source = research_keyword(keyword, gemini_api_key, bypass_cache, max_age_seconds)
+
                     if not item_list:
                         st.warning("情報を取得できませんでした。キーワードを変えてお試しください。")
                     else:
-                        # pandasを使ってデータを整形・表示
-                        df = pd.DataFrame(item_list)
-                        df.columns = ["項目名", "価格（円）"]
-                        df['価格（円）'] = pd.to_numeric(df['価格（円）'], errors='coerce')
-                        df_sorted = df.sort_values(by="価格（円）", na_position='last')
+                        df_sorted = items_to_dataframe(item_list)
 
                         st.success(f"「{keyword}」のリサーチが完了しました！")
-                        
+                        if source == "history":
+                            st.caption(f"⚡ {max_age_days} 日以内にリサーチした結果を価格履歴から表示しています。")
+
                         # CSVダウンロードボタン
                         csv_data = df_sorted.to_csv(index=False, encoding='utf_8_sig').encode('utf_8_sig')
                         st.download_button(
@@ -66,6 +227,7 @@ def show_tool(gemini_api_key):
                             mime="text/csv"
                         )
                         st.dataframe(df_sorted)
+                        show_price_trends(keyword)
 
                 except Exception as e:
                     st.error(f"リサーチ中にエラーが発生しました: {e}")
@@ -0,0 +1,295 @@
+# tools/route_engine.py
+
+import os
+import re
+import csv
+import bisect
+import threading
+import unicodedata
+from array import array
+
+# ===============================================================
+# ローカルの経路探索エンジン
+# data/transit/ の GTFS 風データ（駅・路線・駅間の所要時間と距離・運転間隔・運賃表・徒歩乗り換え）を
+# 一度だけ読み込み、整数の添字で引ける配列に詰めておく。
+# 探索は McRAPTOR 風のラウンド方式（k 回目のラウンド = k 本目の乗車）で、
+# 各駅に「所要時間・運賃・乗車回数」のどれかで負けない候補（パレート最適）だけを残す。
+# 最後に目的地の候補から「最速・最安・乗り換え楽」を選び、AIが返していたのと同じ
+# route_name / summary / steps の形で返す。
+#
+# - 時刻表ではなく運転間隔で扱うため、乗り換えのたびに「乗り換え時間 + 運転間隔の半分」を待ち時間として足す
+# - 運賃は事業者ごとの距離帯の運賃表で計算する。同じ駅で同じ事業者の路線に乗り継ぐ場合は距離を通算する
+#   （改札を出る徒歩の乗り換えや、事業者が変わる場合は、そこで運賃を打ち切る）
+# ===============================================================
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "transit")
+MAX_RIDES = 4
+TRANSFER_MINUTES = 3  # 同じ駅での乗り換えにかかる時間
+ROUTE_LABELS = ("最速", "最安", "乗り換え楽")
+MAX_ROUTES = 3
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+_MACRONS = str.maketrans("āīūēōâîûêô", "aiueoaiueo")
+_LONG_VOWELS = re.compile(r"o[ou]|uu")
+
+def normalize_station_name(name):
+    """全角半角・大文字小文字・カタカナとひらがな・空白や区切り記号・末尾の「駅」・ローマ字の長音の書き方の違いを無視する"""
+    name = unicodedata.normalize("NFKC", name or "").strip().lower()
+    name = re.sub(r"[\s\-'・]", "", name)
+    if name.endswith("駅") and len(name) > 1:
+        name = name[:-1]
+    name = name.translate(_KATAKANA_TO_HIRAGANA).translate(_MACRONS)
+    return _LONG_VOWELS.sub(lambda match: match.group(0)[0], name)
+
+def _read_csv(data_dir, file_name):
+    with open(os.path.join(data_dir, file_name), encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+class _Route:
+    __slots__ = ("route_id", "name", "operator", "transport_type", "headway", "loop", "headsigns", "stops", "seg_minutes", "seg_km")
+
+class _Label:
+    """ある駅に着いた1つの候補。parent をたどると経路が復元できる"""
+    __slots__ = ("stop", "minutes", "fare", "rides", "parent", "route", "board", "alight", "ride_minutes", "walk", "fare_run")
+
+    def __init__(self, stop, minutes, fare, rides, parent=None, route=None, board=None, alight=None, ride_minutes=0, walk=None, fare_run=None):
+        self.stop = stop
+        self.minutes = minutes
+        self.fare = fare
+        self.rides = rides
+        self.parent = parent
+        self.route = route  # 乗車してきた路線の添字（徒歩・出発地は None）
+        self.board = board  # (乗車駅, 進行方向)
+        self.alight = alight
+        self.ride_minutes = ride_minutes
+        self.walk = walk  # 徒歩で移ってきた場合の分数
+        self.fare_run = fare_run  # 通算中の運賃 (事業者, 通算距離km, 通算を始める前の運賃)
+
+    def dominates_on_arrival(self, other):
+        """所要時間・運賃・乗車回数のどれでも負けていない（目的地に着いた後の比較）"""
+        return self.minutes <= other.minutes and self.fare <= other.fare and self.rides <= other.rides
+
+    def dominates(self, other):
+        """途中の駅での比較。この先の運賃は通算中の運賃によって変わるため、
+        同じ事業者の通算中どうし（または通算していないものどうし）で、通算距離と通算前の運賃も負けていないときだけ勝ちとする
+        （今は安くても、同じ事業者の乗り継ぎで通算できる候補の方が、着いたときには安いことがある）"""
+        if not self.dominates_on_arrival(other):
+            return False
+        run, other_run = self.fare_run, other.fare_run
+        if (run and run[0]) != (other_run and other_run[0]):
+            return False
+        return run is None or (run[1] <= other_run[1] and run[2] <= other_run[2])
+
+class RouteEngine:
+    def __init__(self, data_dir=DATA_DIR):
+        stops = _read_csv(data_dir, "stops.txt")
+        self.stop_ids = [row["stop_id"] for row in stops]
+        self.stop_names = [row["stop_name"] for row in stops]
+        self.stop_aliases = [[alias for alias in (row.get("aliases") or "").split("|") if alias] for row in stops]
+        self.stop_kana = [row.get("stop_name_kana") or "" for row in stops]
+        self.stop_romaji = [row.get("stop_name_romaji") or "" for row in stops]
+        self.stop_popularity = [int(row.get("popularity") or 0) for row in stops]
+        self._stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self._name_index = {}
+        for i in range(len(stops)):
+            for name in self.stop_forms(i):
+                self._name_index.setdefault(normalize_station_name(name), i)
+
+        # 運賃表: 事業者 -> (距離の上限の昇順リスト, 運賃のリスト)
+        self._fares = {}
+        for row in sorted(_read_csv(data_dir, "fare_bands.txt"), key=lambda row: float(row["max_km"])):
+            limits, fares = self._fares.setdefault(row["operator"], ([], []))
+            limits.append(float(row["max_km"]))
+            fares.append(int(row["fare"]))
+
+        sequences = {}
+        for row in _read_csv(data_dir, "route_stops.txt"):
+            sequences.setdefault(row["route_id"], []).append(row)
+        self.routes = []
+        for row in _read_csv(data_dir, "routes.txt"):
+            route = _Route()
+            route.route_id, route.name, route.operator = row["route_id"], row["route_name"], row["operator"]
+            route.transport_type, route.headway, route.loop = row["transport_type"], float(row["headway_min"]), row["loop"] == "1"
+            route.headsigns = (row["forward_headsign"], row["backward_headsign"])
+            ordered = sorted(sequences[row["route_id"]], key=lambda stop_row: int(stop_row["stop_sequence"]))
+            stop_list = [self._stop_index[stop_row["stop_id"]] for stop_row in ordered]
+            # seg_minutes[i] / seg_km[i] は stops[i] から stops[i + 1]（環状線なら最後から最初）まで
+            minutes = [float(stop_row["minutes_from_prev"]) for stop_row in ordered[1:]]
+            km = [float(stop_row["km_from_prev"]) for stop_row in ordered[1:]]
+            if route.loop and stop_list[0] == stop_list[-1]:
+                stop_list.pop()
+            route.stops = array("i", stop_list)
+            route.seg_minutes = array("d", minutes)
+            route.seg_km = array("d", km)
+            self.routes.append(route)
+
+        # 駅 -> その駅を通る (路線の添字, 駅の位置)
+        self.stop_routes = [[] for _ in self.stop_ids]
+        for route_index, route in enumerate(self.routes):
+            for position, stop in enumerate(route.stops):
+                self.stop_routes[stop].append((route_index, position))
+        # 駅 -> 徒歩で移れる (別の駅, 分)
+        self.footpaths = [[] for _ in self.stop_ids]
+        for row in _read_csv(data_dir, "transfers.txt"):
+            a, b, walk = self._stop_index[row["from_stop_id"]], self._stop_index[row["to_stop_id"]], float(row["walk_min"])
+            self.footpaths[a].append((b, walk))
+            self.footpaths[b].append((a, walk))
+
+    # --- 駅名 ---
+    def stop_forms(self, stop):
+        """駅名・別名・読み（ひらがな）・ローマ字。カタカナは正規化でひらがなとして扱う"""
+        return [form for form in (self.stop_names[stop], *self.stop_aliases[stop], self.stop_kana[stop], self.stop_romaji[stop]) if form]
+
+    def find_stop(self, name):
+        """駅名（別名・「駅」付きも可）から駅の添字を返す。見つからなければ None"""
+        return self._name_index.get(normalize_station_name(name))
+
+    def fare_for(self, operator, km):
+        limits, fares = self._fares[operator]
+        return fares[min(bisect.bisect_left(limits, km - 1e-9), len(fares) - 1)]
+
+    # --- 探索 ---
+    def _ride(self, route, position, direction):
+        """position から direction（+1 / -1）へ乗ったときの (降車位置, 所要分, 距離km) を順に返す"""
+        count = len(route.stops)
+        minutes = km = 0.0
+        current = position
+        for _ in range(count - 1):
+            if direction > 0:
+                if not route.loop and current + 1 >= count:
+                    return
+                minutes += route.seg_minutes[current]
+                km += route.seg_km[current]
+                current = (current + 1) % count
+            else:
+                if not route.loop and current == 0:
+                    return
+                current = (current - 1) % count
+                minutes += route.seg_minutes[current]
+                km += route.seg_km[current]
+            yield current, minutes, km
+
+    @staticmethod
+    def _insert(bags, label):
+        bag = bags[label.stop]
+        if any(existing.dominates(label) for existing in bag):
+            return False
+        bag[:] = [existing for existing in bag if not label.dominates(existing)]
+        bag.append(label)
+        return True
+
+    def _relax_footpaths(self, bags, labels):
+        added = []
+        for label in labels:
+            for other, walk in self.footpaths[label.stop]:
+                candidate = _Label(other, label.minutes + walk, label.fare, label.rides, parent=label, walk=walk)
+                if self._insert(bags, candidate):
+                    added.append(candidate)
+        return added
+
+    def _search_labels(self, origin, destination):
+        bags = [[] for _ in self.stop_ids]
+        start = _Label(origin, 0.0, 0, 0)
+        self._insert(bags, start)
+        frontier = [start] + self._relax_footpaths(bags, [start])
+        for ride_count in range(1, MAX_RIDES + 1):
+            reached = []
+            for label in frontier:
+                for route_index, position in self.stop_routes[label.stop]:
+                    if route_index == label.route:
+                        continue
+                    route = self.routes[route_index]
+                    # 出発駅での最初の乗車には待ち時間を足さない（表示する所要時間は乗車からの目安）
+                    wait = 0.0 if label.rides == 0 else (0.0 if label.walk else TRANSFER_MINUTES) + route.headway / 2
+                    if label.fare_run and label.fare_run[0] == route.operator:
+                        _, run_km, base_fare = label.fare_run
+                    else:
+                        run_km, base_fare = 0.0, label.fare
+                    for direction in (1, -1):
+                        for alight, minutes, km in self._ride(route, position, direction):
+                            candidate = _Label(route.stops[alight], label.minutes + wait + minutes, base_fare + self.fare_for(route.operator, run_km + km),
+                                               ride_count, parent=label, route=route_index, board=(position, direction), alight=alight, ride_minutes=minutes,
+                                               fare_run=(route.operator, run_km + km, base_fare))
+                            if self._insert(bags, candidate):
+                                reached.append(candidate)
+            reached += self._relax_footpaths(bags, reached)
+            # 同じラウンドの中で他の候補に負けて外れたものは、次のラウンドの起点にしない
+            frontier = [label for label in reached if label in bags[label.stop]]
+            if not frontier:
+                break
+        return bags[destination]
+
+    # --- 結果の組み立て ---
+    def _steps(self, label):
+        chain = []
+        while label.parent is not None:
+            chain.append(label)
+            label = label.parent
+        chain.reverse()
+        steps = []
+        for i, label in enumerate(chain):
+            if label.walk is not None:
+                steps.append({"transport_type": "徒歩", "details": f"{self.stop_names[label.parent.stop]}から{self.stop_names[label.stop]}まで徒歩約{label.walk:.0f}分"})
+                continue
+            if i > 0 and chain[i - 1].walk is None:
+                steps.append({"transport_type": "徒歩", "details": f"{self.stop_names[label.parent.stop]}で乗り換え"})
+            route = self.routes[label.route]
+            position, direction = label.board
+            steps.append({
+                "transport_type": route.transport_type,
+                "line_name": route.name,
+                "station_from": self.stop_names[route.stops[position]],
+                "station_to": self.stop_names[label.stop],
+                "details": f"{route.headsigns[0 if direction > 0 else 1]}・約{label.ride_minutes:.0f}分",
+            })
+        return steps
+
+    def _to_route(self, name, label):
+        return {
+            "route_name": name,
+            "summary": {"total_time": int(round(label.minutes)), "total_fare": label.fare, "transfers": max(0, label.rides - 1)},
+            "steps": self._steps(label),
+        }
+
+    def search(self, start_name, end_name):
+        """start_name から end_name への経路を最大3つ返す。どちらかの駅がデータに無ければ None"""
+        origin, destination = self.find_stop(start_name), self.find_stop(end_name)
+        if origin is None or destination is None:
+            return None
+        if origin == destination:
+            return []
+        candidates = self._search_labels(origin, destination)
+        if not candidates:
+            return []
+        # 着いた後は通算中かどうかは関係ないので、3つの基準だけで負けている候補を外す
+        candidates = [label for label in candidates
+                      if not any(other is not label and other.dominates_on_arrival(label) and not label.dominates_on_arrival(other) for other in candidates)]
+        picks = [
+            min(candidates, key=lambda label: (label.minutes, label.rides, label.fare)),
+            min(candidates, key=lambda label: (label.fare, label.minutes, label.rides)),
+            min(candidates, key=lambda label: (label.rides, label.minutes, label.fare)),
+        ]
+        # 同じ経路が複数の基準で選ばれたら名前をまとめ、空いた枠は他のパレート最適な候補で埋める
+        chosen, names = [], {}
+        for label_name, label in zip(ROUTE_LABELS, picks):
+            if id(label) not in names:
+                chosen.append(label)
+                names[id(label)] = []
+            names[id(label)].append(label_name)
+        for label in sorted(candidates, key=lambda label: (label.minutes, label.fare)):
+            if len(chosen) >= MAX_ROUTES:
+                break
+            if id(label) not in names:
+                chosen.append(label)
+                names[id(label)] = ["別の候補"]
+        return [self._to_route(f"ルート{i}：{'・'.join(names[id(label)])}", label) for i, label in enumerate(chosen, start=1)]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_route_engine():
+    """プロセス全体で共有する経路探索エンジン（初回にデータを読み込む）"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RouteEngine(os.environ.get("TRANSIT_DATA_DIR") or DATA_DIR)
+        return _engine
@@ -0,0 +1,131 @@
+# tools/speech_service.py
+
+import streamlit as st
+import threading
+import time
+from collections import OrderedDict
+from google.cloud import speech
+from google.api_core.client_options import ClientOptions
+from tools.perf_trace import trace_call, payload_size
+from tools.audio_buffer import audio_bytes_of
+from tools.audio_normalize import normalize_for_speech, recognition_config, SPEECH_SAMPLE_WIDTH
+
+# ===============================================================
+# Speech-to-Text クライアントの共有プール
+# SpeechClient の生成は gRPC チャネルの確立と認証を伴うため、
+# APIキーごとに1つだけ作り、再実行・セッションをまたいで使い回す
+# ===============================================================
+CLIENT_IDLE_TTL_SECONDS = 30 * 60
+MAX_POOLED_CLIENTS = 32
+
+_client_pool = OrderedDict()  # api_key -> (client, 最終利用時刻)
+_pool_lock = threading.Lock()
+
+def _evict_idle_clients(now):
+    """一定時間使われていないキーと、上限を超えた古いキーのクライアントをプールから外す
+    実行中の長い文字起こしなどが、取り出したクライアントをまだ使っていることがあるため、ここでは閉じない。
+    どこからも参照されなくなれば、ガベージコレクションでチャネルが閉じられる"""
+    expired = [key for key, (_, last_used) in _client_pool.items() if now - last_used > CLIENT_IDLE_TTL_SECONDS]
+    for key in expired:
+        del _client_pool[key]
+    while len(_client_pool) > MAX_POOLED_CLIENTS:
+        _client_pool.popitem(last=False)
+
+def get_speech_client(api_key):
+    """APIキーに対応する SpeechClient をプールから取り出す（無ければ作成する）"""
+    now = time.monotonic()
+    with _pool_lock:
+        _evict_idle_clients(now)
+        entry = _client_pool.pop(api_key, None)
+        client = entry[0] if entry else speech.SpeechClient(client_options=ClientOptions(api_key=api_key))
+        _client_pool[api_key] = (client, now)
+        return client
+
+def pooled_client_count():
+    with _pool_lock:
+        return len(_client_pool)
+
+# ===============================================================
+# 補助関数（3つのツールにあった transcribe_audio を1つに統合）
+# ===============================================================
+def _prepare_request(audio, model):
+    """モノラル・16kHz・FLAC に正規化した音声と、それに合わせた RecognitionConfig を返す
+    デコードできない形式のときは、これまでどおり元のデータを形式の指定なしで送る"""
+    try:
+        normalized = normalize_for_speech(audio)
+    except Exception:
+        return audio_bytes_of(audio), speech.RecognitionConfig(language_code="ja-JP", model=model or "")
+    return normalized.content, recognition_config(normalized, model=model or "")
+
+def recognize_audio(audio, api_key, model=None):
+    """transcribe_audio の本体。エラーはそのまま投げ、st.* を使わないのでワーカースレッドからも呼べる"""
+    if not audio or not api_key: return None
+    client = get_speech_client(api_key)
+    audio_bytes, config = _prepare_request(audio, model)
+    if not audio_bytes:
+        # 全体が無音だった
+        return None
+    audio = speech.RecognitionAudio(content=audio_bytes)
+    with trace_call("speech", "recognize", audio_bytes) as trace:
+        response = client.recognize(config=config, audio=audio)
+        trace.response_bytes = payload_size(response)
+    # 発話の区切りごとに result が分かれるため、すべてつなげる
+    transcript = "".join(result.alternatives[0].transcript for result in response.results if result.alternatives)
+    return transcript or None
+
+# ===============================================================
+# ストリーミング認識（マイク入力用）
+# 音声を短い区間に分けて streaming_recognize に流し、途中経過（interim）を on_interim で知らせる。
+# 複数の予定や複数の文を続けて話すこともあるため single_utterance は使わず、
+# 最後の区間まで送ったうえで、確定した結果（is_final）をすべてつなげて返す。
+# 前後の無音は送る前に削除済みなので、語尾の無音を待つ時間はかからない。
+# mic_recorder は録音停止後にまとめて音声を渡すため、録音中ではなく停止直後から流し始める
+# ===============================================================
+STREAM_CHUNK_MS = 100
+
+def _stream_requests(content, chunk_bytes):
+    for start in range(0, len(content), chunk_bytes):
+        yield speech.StreamingRecognizeRequest(audio_content=content[start:start + chunk_bytes])
+
+def stream_recognize(audio, api_key, model=None, on_interim=None):
+    """音声をストリーミング認識し、確定したテキストをすべてつなげて返す。エラーはそのまま投げる
+    on_interim(ここまでのテキスト) は、途中経過が届くたびに呼び出し元のスレッドから呼ばれる"""
+    if not audio or not api_key: return None
+    client = get_speech_client(api_key)
+    normalized = normalize_for_speech(audio, encoding="LINEAR16")
+    if not normalized.content:
+        return None
+    streaming_config = speech.StreamingRecognitionConfig(
+        config=recognition_config(normalized, model=model or ""),
+        interim_results=True,
+    )
+    chunk_bytes = normalized.sample_rate * SPEECH_SAMPLE_WIDTH * STREAM_CHUNK_MS // 1000
+    finals = []
+    with trace_call("speech", "streaming_recognize", normalized.content) as trace:
+        for response in client.streaming_recognize(streaming_config, _stream_requests(normalized.content, chunk_bytes)):
+            trace.response_bytes += payload_size(response)
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                if result.is_final:
+                    finals.append(result.alternatives[0].transcript)
+                elif on_interim:
+                    on_interim("".join(finals) + result.alternatives[0].transcript)
+    return "".join(finals) or None
+
+def transcribe_audio_streaming(audio, api_key, model=None, on_interim=None):
+    """stream_recognize を呼び、エラーは画面に表示して None を返す（transcribe_audio のストリーミング版）"""
+    try:
+        return stream_recognize(audio, api_key, model, on_interim)
+    except Exception as e:
+        st.error(f"音声認識エラー: APIキーが正しいか、有効期限が切れていないかをご確認ください。詳細: {e}")
+    return None
+
+def transcribe_audio(audio, api_key, model=None):
+    """Speech-to-Text APIを使用して音声データを文字に変換する関数
+    audio はバイト列か、一時置き場の AudioBuffer。送る前にローカルで正規化する"""
+    try:
+        return recognize_audio(audio, api_key, model)
+    except Exception as e:
+        st.error(f"音声認識エラー: APIキーが正しいか、有効期限が切れていないかをご確認ください。詳細: {e}")
+    return None
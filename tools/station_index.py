@@ -0,0 +1,71 @@
+# tools/station_index.py
+
+import re
+import bisect
+import threading
+from collections import namedtuple
+from tools.route_engine import get_route_engine, normalize_station_name
+
+# ===============================================================
+# 駅名の入力候補（前方一致の索引）
+# 経路探索エンジンの駅データ（駅名・別名・ひらがな・ローマ字・利用者数の目安）から、
+# 正規化した文字列を辞書順に並べた索引を作り、二分探索で候補を引く。
+# 「小阪」→「河内小阪」のように途中から始まる入力にも当たるよう、
+# 漢字・かなは各文字位置からの末尾を、ローマ字は単語の区切り（-）からの末尾も索引に入れる。
+# 並び順: 完全一致 → 先頭からの一致 → 途中からの一致、同じ順位なら利用者の多い駅を先に
+# ===============================================================
+SUGGESTION_LIMIT = 5
+_ASCII = re.compile(r"^[\x00-\x7f]*$")
+
+Suggestion = namedtuple("Suggestion", ["name", "kana", "matched", "popularity"])
+
+def _suffix_starts(form):
+    """索引に入れる末尾の、元の文字列での開始位置"""
+    if _ASCII.match(form):
+        return [0] + [match.end() for match in re.finditer(r"[\s\-]+", form)]
+    return range(len(form))
+
+class StationIndex:
+    def __init__(self, stations):
+        """stations: (駅名, ひらがな, [検索に使う表記], 利用者数の目安) のリスト"""
+        self._stations = stations
+        entries = set()
+        for station, (_, _, forms, _) in enumerate(stations):
+            for form in forms:
+                for start in _suffix_starts(form):
+                    key = normalize_station_name(form[start:])
+                    if key:
+                        entries.add((key, start > 0, station, form))
+        ordered = sorted(entries)
+        self._keys = [entry[0] for entry in ordered]
+        self._entries = ordered
+
+    def suggest(self, query, limit=SUGGESTION_LIMIT):
+        normalized = normalize_station_name(query)
+        if not normalized:
+            return []
+        lo = bisect.bisect_left(self._keys, normalized)
+        hi = bisect.bisect_left(self._keys, normalized + "\U0010ffff")
+        best = {}  # 駅 -> (並び順のキー, 一致した表記)
+        for key, is_infix, station, form in self._entries[lo:hi]:
+            rank = 0 if key == normalized and not is_infix else 1 + is_infix
+            score = (rank, -self._stations[station][3])
+            if station not in best or score < best[station][0]:
+                best[station] = (score, form)
+        ranked = sorted(best.items(), key=lambda item: item[1][0])[:limit]
+        return [Suggestion(self._stations[station][0], self._stations[station][1], form, self._stations[station][3]) for station, (_, form) in ranked]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_station_index():
+    """プロセス全体で共有する駅名の索引（経路探索エンジンの駅データから作る）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            engine = get_route_engine()
+            _index = StationIndex([
+                (engine.stop_names[stop], engine.stop_kana[stop], engine.stop_forms(stop), engine.stop_popularity[stop])
+                for stop in range(len(engine.stop_ids))
+            ])
+        return _index
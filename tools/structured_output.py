@@ -0,0 +1,245 @@
+# tools/structured_output.py
+
+import re
+import json
+import threading
+from tools.perf_trace import trace_call
+from tools.gemini_gateway import generate_content
+
+# ===============================================================
+# 構造化出力エンジン
+# JSONモードで問い合わせ → 寛容な抽出 → スキーマ検証（型の補正つき）
+# → 失敗時のみ「壊れた出力とエラー内容」だけを送る修復リトライ、を一箇所にまとめる
+# ===============================================================
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+DEFAULT_MAX_REPAIRS = 1
+
+# --- ツールごとのスキーマ（JSON Schema のごく一部の書式） ---
+_STRING = {"type": "string", "default": ""}
+
+ROUTE_LIST_SCHEMA = {
+    "type": "array", "minItems": 1,
+    "items": {
+        "type": "object", "required": ["route_name", "summary"],
+        "properties": {
+            "route_name": {"type": "string"},
+            "summary": {
+                "type": "object", "required": ["total_time", "total_fare", "transfers"],
+                "properties": {"total_time": {"type": "number"}, "total_fare": {"type": "number"}, "transfers": {"type": "integer"}},
+            },
+            "steps": {
+                "type": "array", "default": [],
+                "items": {
+                    "type": "object", "required": ["transport_type"],
+                    "properties": {
+                        "transport_type": {"type": "string"}, "line_name": _STRING,
+                        "station_from": _STRING, "station_to": _STRING, "details": _STRING,
+                    },
+                },
+            },
+        },
+    },
+}
+
+PRICE_LIST_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object", "required": ["name"],
+        "properties": {"name": {"type": "string"}, "price": {"type": "number", "default": 0}},
+    },
+}
+
+EVENT_SCHEMA = {
+    "type": "object", "required": ["title", "start_time"],
+    "properties": {
+        "title": {"type": "string"}, "start_time": {"type": "datetime"}, "end_time": {"type": "datetime", "default": ""},
+        "location": _STRING, "details": _STRING,
+    },
+}
+
+EVENT_LIST_SCHEMA = {"type": "array", "minItems": 1, "items": EVENT_SCHEMA}
+
+RECEIPT_SCHEMA = {
+    "type": "object", "required": ["total_amount"],
+    "properties": {
+        "total_amount": {"type": "number", "default": 0},
+        "items": {
+            "type": "array", "default": [],
+            "items": {
+                "type": "object", "required": ["name"],
+                "properties": {"name": {"type": "string"}, "price": {"type": "number", "default": 0}},
+            },
+        },
+    },
+}
+
+TRANSLATION_LIST_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+class StructuredOutputError(ValueError):
+    """抽出・検証・修復のすべてに失敗したときに送出する"""
+    def __init__(self, message, raw_text=""):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+# ===============================================================
+# 寛容な抽出
+# ===============================================================
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+def _find_json_span(text):
+    """文字列リテラルを考慮しながら、最初の { または [ に対応する閉じ括弧までを探す"""
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return None
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped: escaped = False
+            elif ch == "\\": escaped = True
+            elif ch == '"': in_string = False
+        elif ch == '"': in_string = True
+        elif ch in "{[": depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+def extract_json(text):
+    """前置き・コードフェンス・末尾カンマなどを許容して JSON を取り出す"""
+    text = (text or "").strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    span = _find_json_span(text)
+    if span is None:
+        raise ValueError("応答にJSONが見つかりません")
+    try:
+        return json.loads(span)
+    except ValueError:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", span))
+
+# ===============================================================
+# スキーマ検証（よくある型の揺れはここで補正する）
+# ===============================================================
+_NUMBER_NOISE = re.compile(r"[,，円¥￥\s]")
+
+def _to_number(value, path):
+    if isinstance(value, bool):
+        raise ValueError(f"{path}: 数値が必要です")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            number = float(_NUMBER_NOISE.sub("", value))
+        except ValueError:
+            raise ValueError(f"{path}: 数値に変換できません ({value!r})")
+        return int(number) if number.is_integer() else number
+    raise ValueError(f"{path}: 数値が必要です")
+
+def validate(data, schema, path="$"):
+    """スキーマに沿って検証し、補正済みのデータを返す。不一致なら ValueError"""
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: オブジェクトが必要です")
+        result = dict(data)
+        for name, sub_schema in schema.get("properties", {}).items():
+            if result.get(name) is None:
+                if name in schema.get("required", []) and "default" not in sub_schema:
+                    raise ValueError(f"{path}.{name}: 必須項目がありません")
+                if "default" in sub_schema:
+                    result[name] = sub_schema["default"]
+                continue
+            result[name] = validate(result[name], sub_schema, f"{path}.{name}")
+        return result
+    if expected == "array":
+        if isinstance(data, dict) and len(data) == 1 and isinstance(next(iter(data.values())), list):
+            # {"routes": [...]} のように包まれて返ってくる揺れを許容する
+            data = next(iter(data.values()))
+        if not isinstance(data, list):
+            raise ValueError(f"{path}: 配列が必要です")
+        if len(data) < schema.get("minItems", 0):
+            raise ValueError(f"{path}: 要素が{schema['minItems']}個以上必要です")
+        return [validate(item, schema["items"], f"{path}[{i}]") for i, item in enumerate(data)]
+    if expected == "number":
+        return _to_number(data, path)
+    if expected == "integer":
+        return int(_to_number(data, path))
+    if expected == "string":
+        return data if isinstance(data, str) else str(data)
+    if expected == "datetime":
+        # カレンダーURLが解釈できる YYYY-MM-DDTHH:MM:SS に揃える
+        text = str(data).strip().replace(" ", "T", 1)
+        if not text:
+            return text
+        match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})T(\d{1,2}):(\d{2})(?::(\d{2}))?", text)
+        if not match:
+            raise ValueError(f"{path}: YYYY-MM-DDTHH:MM:SS 形式の日時が必要です ({data!r})")
+        return f"{match[1]}T{int(match[2]):02d}:{match[3]}:{match[4] or '00'}"
+    return data
+
+# ===============================================================
+# 統計（解析失敗率・修復リトライ率）
+# ===============================================================
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _count(tool_name, field):
+    with _stats_lock:
+        counters = _stats.setdefault(tool_name, {"calls": 0, "parse_failures": 0, "repairs": 0, "repaired": 0, "failures": 0})
+        counters[field] += 1
+
+def get_structured_output_stats():
+    """ツールごとの {calls, parse_failures, repairs, repaired, failures, parse_failure_rate, retry_rate}"""
+    with _stats_lock:
+        report = {}
+        for tool_name, counters in _stats.items():
+            calls = counters["calls"] or 1
+            report[tool_name] = dict(counters, parse_failure_rate=counters["parse_failures"] / calls, retry_rate=counters["repairs"] / calls)
+        return report
+
+# ===============================================================
+# 問い合わせ本体
+# ===============================================================
+def _repair_prompt(raw_text, error, schema):
+    return (
+        "次のJSONは指定のスキーマに合っていません。内容は変えずに、スキーマに合う正しいJSONだけを出力してください。\n"
+        f"# エラー\n{error}\n"
+        f"# スキーマ\n{json.dumps(schema, ensure_ascii=False)}\n"
+        f"# 修正対象\n{raw_text}"
+    )
+
+def parse_structured(text, schema):
+    return validate(extract_json(text), schema)
+
+def _generate_json(model, contents, operation, api_key):
+    with trace_call("gemini", operation, contents) as trace:
+        raw_text = generate_content(api_key, model, contents, generation_config=JSON_GENERATION_CONFIG).text
+        trace.response_bytes = len(raw_text.encode("utf-8"))
+    return raw_text
+
+def generate_structured(model, contents, schema, tool_name, max_repairs=DEFAULT_MAX_REPAIRS, api_key=None):
+    """JSONモードで問い合わせ、検証済みのデータを返す。
+    失敗時は壊れた出力とエラーだけを送り直し（画像などの元入力は再送しない）、最大 max_repairs 回まで修復を試みる
+    api_key は、どのキーのレート制限・回路遮断に数えるか（gemini_gateway）"""
+    _count(tool_name, "calls")
+    raw_text = _generate_json(model, contents, tool_name, api_key)
+    try:
+        return parse_structured(raw_text, schema)
+    except ValueError as e:
+        _count(tool_name, "parse_failures")
+        error = e
+    for _ in range(max_repairs):
+        _count(tool_name, "repairs")
+        raw_text = _generate_json(model, _repair_prompt(raw_text, error, schema), f"{tool_name}:repair", api_key)
+        try:
+            data = parse_structured(raw_text, schema)
+            _count(tool_name, "repaired")
+            return data
+        except ValueError as e:
+            error = e
+    _count(tool_name, "failures")
+    raise StructuredOutputError(f"AIの応答を解析できませんでした: {error}", raw_text)
@@ -1,27 +1,172 @@
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import speech
-from google.api_core.client_options import ClientOptions
+from pydub.silence import detect_silence
+from tools.speech_service import get_speech_client, recognize_audio
+from tools.perf_trace import trace_call, bind_session, payload_size
+from tools.audio_buffer import get_audio_spool
+from tools.audio_normalize import decode_to_pcm, silence_bounds, to_normalized, recognition_config
+from tools.job_queue import get_job_queue, FINISHED_STATUSES, DONE, FAILED, CANCELLED
+
+# --- 長時間音声モードの設定 ---
+# 同期recognizeは約1分が上限のため、余裕を持たせた長さで区切る
+LONG_AUDIO_MAX_CHUNK_MS = 50_000
+LONG_AUDIO_MIN_SILENCE_MS = 400
+LONG_AUDIO_SILENCE_OFFSET_DB = 16
+LONG_AUDIO_MAX_WORKERS = 4
+
+# --- バックグラウンド処理の設定 ---
+JOB_POLL_SECONDS = 1.0  # 実行中のジョブがある間、進み具合を読み直す間隔
+SESSION_JOBS_KEY = "transcript_job_ids"
+
+# st.fragment は Streamlit 1.37 から。それより前は experimental_fragment
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
 
 # ===============================================================
-# 補助関数（calendar_tool.pyから「魂のコピー」をした、完全に同一の関数）
-# 原則④に従い、既存の動作するコードを尊重し、安全のために複製する
+# 長時間音声モード（無音で分割 → 並列に文字起こし → 時刻付きで結合）
 # ===============================================================
 
-def transcribe_audio(audio_bytes, api_key):
-    """Speech-to-Text APIを使用して音声データを文字に変換する関数"""
-    if not audio_bytes or not api_key:
+def split_audio_on_silence(pcm):
+    """デコード済みの PcmFile を、前後の無音を除いたうえで無音区間の位置で区切り、(開始ミリ秒, 終了ミリ秒) のリストを返す
+    区切りの候補は上限の長さ分だけを読んで探すので、長い音声でもメモリに載るのは1区間分だけ"""
+    bounds = silence_bounds(pcm)
+    if bounds is None:
+        return []
+    start_ms, end_ms = bounds
+    if end_ms - start_ms <= LONG_AUDIO_MAX_CHUNK_MS:
+        return [(start_ms, end_ms)]
+
+    # 完全な無音ファイルでは dBFS が -inf になるため、下限を設ける
+    silence_thresh = max(pcm.dbfs(start_ms, end_ms), -60) - LONG_AUDIO_SILENCE_OFFSET_DB
+    chunks = []
+    chunk_start = start_ms
+    while end_ms - chunk_start > LONG_AUDIO_MAX_CHUNK_MS:
+        limit = chunk_start + LONG_AUDIO_MAX_CHUNK_MS
+        window = pcm.segment(chunk_start, limit)
+        silences = detect_silence(window, min_silence_len=LONG_AUDIO_MIN_SILENCE_MS, silence_thresh=silence_thresh, seek_step=10)
+        # 上限以内で最も後ろにある無音の中心で切る。無ければ上限で強制的に切る
+        cut_points = [chunk_start + (start + end) // 2 for start, end in silences if (start + end) // 2 > 0]
+        cut = cut_points[-1] if cut_points else limit
+        chunks.append((chunk_start, cut))
+        chunk_start = cut
+    chunks.append((chunk_start, end_ms))
+    return chunks
+
+def _recognize_chunk(client, pcm, start_ms, end_ms):
+    """1つのチャンクを文字起こしし、全resultsを連結したテキストを返す"""
+    normalized = to_normalized(pcm.segment(start_ms, end_ms), "FLAC")
+    config = recognition_config(normalized, enable_automatic_punctuation=True)
+    audio = speech.RecognitionAudio(content=normalized.content)
+    with trace_call("speech", "recognize:long_audio_chunk", normalized.content) as trace:
+        response = client.recognize(config=config, audio=audio)
+        trace.response_bytes = payload_size(response)
+    return "".join(result.alternatives[0].transcript for result in response.results if result.alternatives)
+
+def format_timestamp(ms):
+    seconds = ms // 1000
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def transcribe_long_audio(audio_source, api_key, on_progress=None, on_partial=None):
+    """長い音声を分割して並列に文字起こしし、[HH:MM:SS] 付きのテキストを返す
+    on_progress(完了数, 全体数) と on_partial(開始ミリ秒, 時刻付きの1行) は、呼び出し元のスレッドから呼ばれる
+    on_progress が例外（JobCancelled など）を投げると、まだ送っていない区間は取り消される
+    エラーはそのまま投げ、st.* を使わないのでバックグラウンドのジョブからも呼べる"""
+    if not audio_source or not api_key:
         return None
+    # デコードした PCM は一時ファイルに置き、各区間はそこから必要な範囲だけを読む
+    with decode_to_pcm(audio_source) as pcm:
+        chunks = split_audio_on_silence(pcm)
+        texts = _recognize_chunks(pcm, chunks, api_key, on_progress, on_partial)
+    lines = [f"[{format_timestamp(start_ms)}] {text}" for (start_ms, _), text in zip(chunks, texts) if text]
+    return "\n".join(lines) if lines else None
+
+def _recognize_chunks(pcm, chunks, api_key, on_progress, on_partial):
+    # gRPCのクライアントはスレッドセーフなので、プールの1つを全チャンクで共有する
+    client = get_speech_client(api_key)
+    texts = [None] * len(chunks)
+    executor = ThreadPoolExecutor(max_workers=LONG_AUDIO_MAX_WORKERS)
     try:
-        client_options = ClientOptions(api_key=api_key)
-        client = speech.SpeechClient(client_options=client_options)
-        audio = speech.RecognitionAudio(content=audio_bytes)
-        config = speech.RecognitionConfig(language_code="ja-JP")
-        response = client.recognize(config=config, audio=audio)
-        if response.results:
-            return response.results[0].alternatives[0].transcript
-    except Exception as e:
-        st.error(f"音声認識中にエラーが発生しました。APIキーが正しいか、有効期限が切れていないかをご確認ください。詳細: {e}")
-    return None
+        futures = {executor.submit(bind_session(_recognize_chunk), client, pcm, start_ms, end_ms): i for i, (start_ms, end_ms) in enumerate(chunks)}
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            texts[index] = future.result()
+            if on_partial and texts[index]:
+                on_partial(chunks[index][0], f"[{format_timestamp(chunks[index][0])}] {texts[index]}")
+            if on_progress:
+                on_progress(done_count, len(chunks))
+    except BaseException:
+        # 中止やエラーのときは、まだ始まっていない区間を送らない（実行中の区間だけ終わるのを待たずに抜ける）
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return texts
+
+# ===============================================================
+# バックグラウンドのジョブ（スクリプトのスレッドを止めず、再実行されても続く）
+# ===============================================================
+
+def _long_audio_job(job, audio_buffer, api_key):
+    def update_progress(done, total):
+        job.set_progress(done, total)
+        # 中止を求められていたら、残りの区間を待たずに止める
+        job.check_cancelled()
+    return transcribe_long_audio(audio_buffer, api_key, on_progress=update_progress, on_partial=job.add_partial)
+
+def _short_audio_job(job, audio_buffer, api_key):
+    job.set_progress(0, 1)
+    transcript = recognize_audio(audio_buffer, api_key)
+    job.set_progress(1, 1)
+    return transcript
+
+def submit_transcription(uploaded_file, api_key, long_audio_mode):
+    """アップロードを一時置き場に移してジョブに引き渡し、ジョブIDをセッションに記録する"""
+    audio_buffer = get_audio_spool().spool(uploaded_file)
+    job_fn, kind = (_long_audio_job, "transcribe:long_audio") if long_audio_mode else (_short_audio_job, "transcribe")
+    job_id = get_job_queue().submit(job_fn, audio_buffer, api_key, kind=kind, label=audio_buffer.name or "音声ファイル", resources=[audio_buffer])
+    st.session_state.setdefault(SESSION_JOBS_KEY, []).append(job_id)
+    return job_id
+
+def _session_jobs():
+    """このセッションのジョブ（保存期間を過ぎたものはセッションからも外す）"""
+    queue = get_job_queue()
+    jobs = [(job_id, queue.get(job_id)) for job_id in st.session_state.get(SESSION_JOBS_KEY, [])]
+    st.session_state[SESSION_JOBS_KEY] = [job_id for job_id, job in jobs if job is not None]
+    return [job for _, job in jobs if job is not None]
+
+def _render_job(job):
+    snapshot = job.snapshot()
+    done, total = snapshot["progress"]
+    if snapshot["status"] not in FINISHED_STATUSES:
+        col1, col2 = st.columns([5, 1])
+        text = f"「{snapshot['label']}」を文字起こししています..." + (f" ({done}/{total} 区間)" if total else "")
+        col1.progress(done / total if total else 0.0, text=text)
+        col2.button("中止", key=f"transcript_cancel_{snapshot['id']}", on_click=get_job_queue().cancel, args=(snapshot["id"],))
+        if snapshot["partial_text"]:
+            st.text_area("ここまでの文字起こし", snapshot["partial_text"], height=150, disabled=True, key=f"transcript_partial_{snapshot['id']}")
+    elif snapshot["status"] == FAILED:
+        st.error(f"「{snapshot['label']}」の音声認識中にエラーが発生しました。APIキーが正しいか、有効期限が切れていないかをご確認ください。詳細: {snapshot['error']}")
+    elif snapshot["status"] == CANCELLED:
+        st.info(f"「{snapshot['label']}」の文字起こしを中止しました。")
+    elif snapshot["status"] == DONE and not snapshot["result"]:
+        st.warning(f"「{snapshot['label']}」から文字を認識できませんでした。")
+
+def show_jobs():
+    """このセッションのジョブの進み具合を表示する。実行中のジョブがある間だけ、この部分だけを定期的に描き直す"""
+    jobs = _session_jobs()
+    running = any(job.status not in FINISHED_STATUSES for job in jobs)
+
+    @_fragment(run_every=JOB_POLL_SECONDS if running else None)
+    def job_panel():
+        for job in jobs:
+            _render_job(job)
+        # 最後に終わったジョブの結果を表示用に取り込み、全体を描き直してポーリングを止める
+        if running and all(job.status in FINISHED_STATUSES for job in jobs):
+            st.rerun()
+
+    job_panel()
+    finished = [job.snapshot() for job in jobs if job.status == DONE]
+    if finished and finished[-1]["result"]:
+        st.session_state.transcript_text = finished[-1]["result"]
 
 # ===============================================================
 # 専門家のメインの仕事 (司令塔 app.py から呼び出される)
@@ -36,21 +181,18 @@ def show_tool(speech_api_key):
         st.session_state.transcript_text = None
 
     議事録_file = st.file_uploader("議事録を作成したい音声ファイルをアップロードしてください:", type=['wav', 'mp3', 'm4a', 'flac'], key="transcript_uploader")
-    
+    long_audio_mode = st.toggle("⏱️ 長時間音声モード（無音で区切って並列に文字起こしし、時刻付きで出力します）", value=True, key="transcript_long_mode")
+
     if st.button("この音声ファイルから議事録を作成する"):
         if not speech_api_key:
             st.error("サイドバーでSpeech-to-Text APIキーを設定してください。")
         elif 議事録_file is None:
             st.warning("音声ファイルをアップロードしてください。")
         else:
-            with st.spinner("音声ファイルを文字に変換しています。長い音声の場合、数分かかることがあります..."):
-                audio_bytes = 議事録_file.getvalue()
-                transcript = transcribe_audio(audio_bytes, speech_api_key)
-                if transcript:
-                    st.session_state.transcript_text = transcript
-                else:
-                    # transcribe_audio内でエラー表示されるため、ここでは警告を省略しても良い
-                    pass
+            # 文字起こしはバックグラウンドで進むので、ほかの操作をしても途中で失われない
+            submit_transcription(議事録_file, speech_api_key, long_audio_mode)
+
+    show_jobs()
 
     if st.session_state.transcript_text:
         st.success("文字起こしが完了しました！")
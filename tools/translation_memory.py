@@ -0,0 +1,180 @@
+# tools/translation_memory.py
+
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict, Counter
+from tools.perf_trace import record_cache
+
+# ===============================================================
+# 翻訳メモリ
+# 一度翻訳した文を全セッションで共有し、同じ文ならAIを呼ばずに即座に返す。
+# 正規化した文字バイグラムの索引で「ほぼ同じ文」も探せるようにする。
+# ただし「出席します」と「出席しません」のように、よく似ていても意味が逆の文があるため、
+# AIを呼ばずに使ってよいのは完全一致だけ。よく似た文は参考として並べて表示するためのもの。
+# 永続化は SQLite（TRANSLATION_MEMORY_PATH）、件数の上限を超えたら最も使われていないものから消す。
+# ===============================================================
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ai-assistant-portal", "translation_memory.sqlite3")
+DEFAULT_MAX_ENTRIES = 20000
+NEAR_MATCH_THRESHOLD = 0.85
+MAX_NEAR_CANDIDATES = 20
+# 使われた時刻（last_used）の書き込みは、毎回コミットせずにまとめて行う
+TOUCH_FLUSH_SIZE = 200
+TOUCH_FLUSH_INTERVAL_SECONDS = 30
+
+# 文末の「？」「！」は消さない（「明日来る？」と「明日来る。」を同じ文として扱わないため）
+_TRAILING_PUNCTUATION = re.compile(r"[。．.、,，\s]+$")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text):
+    """全角半角・大文字小文字・空白・文末の句読点の違いを無視するための正規化（文末の ? と ! は残す）"""
+    text = unicodedata.normalize("NFKC", text or "").lower().strip()
+    text = _TRAILING_PUNCTUATION.sub("", text)
+    return _WHITESPACE.sub("", text)
+
+def _bigrams(normalized):
+    padded = f"^{normalized}$"
+    return Counter(padded[i:i + 2] for i in range(len(padded) - 1))
+
+def dice_similarity(grams_a, grams_b):
+    total = sum(grams_a.values()) + sum(grams_b.values())
+    return 2 * sum((grams_a & grams_b).values()) / total if total else 0.0
+
+class TranslationMemory:
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_entries=DEFAULT_MAX_ENTRIES, near_threshold=NEAR_MATCH_THRESHOLD):
+        self.max_entries = max_entries
+        self.near_threshold = near_threshold
+        self._entries = OrderedDict()  # 正規化した文 -> (元の文, 訳文)。末尾ほど最近使われたもの
+        self._index = {}  # バイグラム -> その文字列を含む正規化文の集合
+        self._lock = threading.Lock()
+        self._pending_touches = {}  # 正規化した文 -> 使われた時刻（まだ SQLite に書いていないもの）
+        self._last_flush = time.monotonic()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS memory (normalized TEXT PRIMARY KEY, source TEXT NOT NULL, translation TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+        self._db.commit()
+        rows = self._db.execute("SELECT normalized, source, translation FROM memory ORDER BY last_used DESC LIMIT ?", (max_entries,)).fetchall()
+        for normalized, source, translation in reversed(rows):
+            # 正規化の規則が変わる前に保存された行は、今の規則のキーに付け替える
+            renormalized = normalize_text(source)
+            if renormalized != normalized:
+                self._db.execute("UPDATE OR REPLACE memory SET normalized = ? WHERE normalized = ?", (renormalized, normalized))
+                self._entries.pop(renormalized, None)
+            self._remember(renormalized, source, translation)
+        self._db.commit()
+
+    # --- 索引の更新（ロックを持った状態で呼ぶ） ---
+    def _remember(self, normalized, source, translation):
+        if normalized not in self._entries:
+            for gram in _bigrams(normalized):
+                self._index.setdefault(gram, set()).add(normalized)
+        self._entries[normalized] = (source, translation)
+        self._entries.move_to_end(normalized)
+
+    def _forget(self, normalized):
+        self._entries.pop(normalized, None)
+        self._pending_touches.pop(normalized, None)
+        for gram in _bigrams(normalized):
+            bucket = self._index.get(gram)
+            if bucket:
+                bucket.discard(normalized)
+                if not bucket: del self._index[gram]
+
+    def _touch(self, normalized):
+        self._entries.move_to_end(normalized)
+        self._pending_touches[normalized] = time.time()
+        if len(self._pending_touches) >= TOUCH_FLUSH_SIZE or time.monotonic() - self._last_flush >= TOUCH_FLUSH_INTERVAL_SECONDS:
+            self._write_touches()
+            self._db.commit()
+
+    def _write_touches(self):
+        """たまった last_used の更新を1回の executemany で書く（コミットは呼び出し元で）"""
+        if self._pending_touches:
+            self._db.executemany("UPDATE memory SET last_used = ? WHERE normalized = ?",
+                                 [(used_at, normalized) for normalized, used_at in self._pending_touches.items()])
+            self._pending_touches.clear()
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """たまっている last_used の更新を SQLite に書き込む"""
+        with self._lock:
+            self._write_touches()
+            self._db.commit()
+
+    # --- 検索 ---
+    def lookup(self, text, exact_only=False):
+        """(訳文, 一致した元の文, 類似度) を返す。完全一致は類似度 1.0、見つからなければ None
+        類似度が 1.0 未満の結果は意味が違うことがあるため、AIの翻訳の代わりには使わないこと"""
+        match = self._lookup(text, exact_only)
+        record_cache("translation_memory", match is not None)
+        return match
+
+    def _lookup(self, text, exact_only):
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        with self._lock:
+            if normalized in self._entries:
+                self._touch(normalized)
+                self.exact_hits += 1
+                source, translation = self._entries[normalized]
+                return translation, source, 1.0
+            match = None if exact_only else self._find_near(normalized)
+            if match:
+                self._touch(match[0])
+                self.near_hits += 1
+                source, translation = self._entries[match[0]]
+                return translation, source, match[1]
+            self.misses += 1
+            return None
+
+    def _find_near(self, normalized):
+        grams = _bigrams(normalized)
+        shared = Counter()
+        for gram in grams:
+            for candidate in self._index.get(gram, ()):
+                shared[candidate] += 1
+        best = None
+        for candidate, _ in shared.most_common(MAX_NEAR_CANDIDATES):
+            score = dice_similarity(grams, _bigrams(candidate))
+            if score >= self.near_threshold and (best is None or score > best[1]):
+                best = (candidate, score)
+        return best
+
+    # --- 登録 ---
+    def add(self, source, translation):
+        normalized = normalize_text(source)
+        if not normalized or not translation:
+            return
+        with self._lock:
+            self._remember(normalized, source, translation)
+            self._pending_touches.pop(normalized, None)
+            self._write_touches()
+            self._db.execute("INSERT OR REPLACE INTO memory (normalized, source, translation, last_used) VALUES (?, ?, ?, ?)", (normalized, source, translation, time.time()))
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._forget(oldest)
+                self._db.execute("DELETE FROM memory WHERE normalized = ?", (oldest,))
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "exact_hits": self.exact_hits, "near_hits": self.near_hits, "misses": self.misses}
+
+_memory = None
+_memory_lock = threading.Lock()
+
+def get_translation_memory():
+    """プロセス全体で共有する翻訳メモリ（初回に SQLite から読み込む）"""
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory(os.environ.get("TRANSLATION_MEMORY_PATH") or DEFAULT_DB_PATH)
+        return _memory
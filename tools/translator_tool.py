@@ -1,44 +1,182 @@
 # tools/translator_tool.py
 
 import streamlit as st
-import google.generativeai as genai
-from google.cloud import speech
-from google.api_core.client_options import ClientOptions
+import json
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from streamlit_mic_recorder import mic_recorder
+from tools.speech_service import transcribe_audio_streaming
+from tools.rate_limit import TokenBucket
+from tools.translation_memory import get_translation_memory
+from tools.perf_trace import trace_call, bind_session
+from tools.structured_output import generate_structured, TRANSLATION_LIST_SCHEMA
+from tools.gemini_clients import get_model
+from tools.gemini_gateway import generate_content, stream_content, RATE_PER_MINUTE as GATEWAY_RATE_PER_MINUTE
 
 # ===============================================================
 # 補助関数 (変更なし、私たちの信頼できる技能)
 # ===============================================================
-def transcribe_audio(audio_bytes, api_key):
-    if not audio_bytes or not api_key: return None
+TRANSLATOR_SYSTEM_PROMPT = """
+あなたは、言語の壁を乗り越える手助けをする、非常に優秀な翻訳アシスタントです。
+ユーザーから渡された日本語のテキストを、海外の親しい友人との会話で使われるような、自然で、カジュアルでありながら礼儀正しく、そしてフレンドリーな英語に翻訳してください。
+- 非常に硬い表現や、ビジネス文書のような翻訳は避けてください。
+- 翻訳後の英語テキストのみを回答してください。他の言葉は一切含めないでください。
+"""
+
+def translate_text_with_gemini(text_to_translate, api_key):
+    if not text_to_translate or not api_key: return None
     try:
-        client_options = ClientOptions(api_key=api_key)
-        client = speech.SpeechClient(client_options=client_options)
-        audio = speech.RecognitionAudio(content=audio_bytes)
-        config = speech.RecognitionConfig(language_code="ja-JP")
-        response = client.recognize(config=config, audio=audio)
-        if response.results: return response.results[0].alternatives[0].transcript
+        model = get_model(api_key, 'gemini-1.5-flash-latest', TRANSLATOR_SYSTEM_PROMPT)
+        with trace_call("gemini", "translator", text_to_translate) as trace:
+            response = generate_content(api_key, model, text_to_translate)
+            trace.response_bytes = len(response.text.encode("utf-8"))
+        return response.text.strip()
     except Exception as e:
-        st.error(f"音声認識エラー: APIキーが正しいかご確認ください。詳細: {e}")
+        st.error(f"翻訳エラー: AIとの通信に失敗しました。詳細: {e}")
     return None
 
-def translate_text_with_gemini(text_to_translate, api_key):
+def stream_translation_with_gemini(text_to_translate, api_key, placeholder):
+    """翻訳をストリーミングで受け取り、届いた分から placeholder に描画する。完成した翻訳文を返す"""
     if not text_to_translate or not api_key: return None
     try:
-        genai.configure(api_key=api_key)
-        system_prompt = """
-        あなたは、言語の壁を乗り越える手助けをする、非常に優秀な翻訳アシスタントです。
-        ユーザーから渡された日本語のテキストを、海外の親しい友人との会話で使われるような、自然で、カジュアルでありながら礼儀正しく、そしてフレンドリーな英語に翻訳してください。
-        - 非常に硬い表現や、ビジネス文書のような翻訳は避けてください。
-        - 翻訳後の英語テキストのみを回答してください。他の言葉は一切含めないでください。
-        """
-        model = genai.GenerativeModel('gemini-1.5-flash-latest', system_instruction=system_prompt)
-        response = model.generate_content(text_to_translate)
-        return response.text.strip()
+        model = get_model(api_key, 'gemini-1.5-flash-latest', TRANSLATOR_SYSTEM_PROMPT)
+        translated_text = ""
+        # 所要時間は最後のチャンクを受け取るまで（描画の時間も含む）
+        with trace_call("gemini", "translator:stream", text_to_translate) as trace:
+            for chunk in stream_content(api_key, model, text_to_translate):
+                # 安全フィルタ等でテキストを持たないチャンクもあるため、partsの有無で判定する
+                if not chunk.parts: continue
+                translated_text += chunk.text
+                placeholder.markdown(f"**🇺🇸 AIの翻訳:**\n> {translated_text}▌")
+            trace.response_bytes = len(translated_text.encode("utf-8"))
+        return translated_text.strip() or None
     except Exception as e:
         st.error(f"翻訳エラー: AIとの通信に失敗しました。詳細: {e}")
     return None
 
+# ===============================================================
+# 一括翻訳（ファイルの各行をまとめてプロンプトに詰め、並列に翻訳する）
+# ===============================================================
+BATCH_SYSTEM_PROMPT = TRANSLATOR_SYSTEM_PROMPT + """
+- 入力は日本語テキストのJSON配列です。各要素を個別に翻訳し、同じ順番・同じ要素数の英語のJSON配列のみで回答してください。
+"""
+
+def read_batch_lines(uploaded_file, column=None):
+    """.txt は空行以外の各行、.csv は指定列（省略時は先頭列）の各セルを翻訳対象として返す"""
+    if uploaded_file.name.lower().endswith(".csv"):
+        df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+        values = df[column or df.columns[0]]
+    else:
+        values = uploaded_file.getvalue().decode("utf-8-sig").splitlines()
+    return [value.strip() for value in values if value and value.strip()]
+
+def pack_batches(lines, lines_per_prompt, max_chars=4000):
+    """行を (開始行番号, 行のリスト) に詰める。1プロンプトあたりの行数と文字数の両方で区切る"""
+    batches, current, current_chars, start = [], [], 0, 0
+    for i, line in enumerate(lines):
+        if current and (len(current) >= lines_per_prompt or current_chars + len(line) > max_chars):
+            batches.append((start, current))
+            current, current_chars, start = [], 0, i
+        current.append(line)
+        current_chars += len(line)
+    if current:
+        batches.append((start, current))
+    return batches
+
+def _translate_batch(model, lines, limiter, api_key):
+    """1バッチを翻訳する。要素数が合わない場合は半分に割って再試行する（スクリプトスレッド外で実行）"""
+    limiter.acquire()
+    translations = generate_structured(model, json.dumps(lines, ensure_ascii=False), TRANSLATION_LIST_SCHEMA, "translator_batch", api_key=api_key)
+    if len(translations) == len(lines):
+        return translations
+    if len(lines) == 1:
+        return [" ".join(translations)]
+    half = len(lines) // 2
+    return _translate_batch(model, lines[:half], limiter, api_key) + _translate_batch(model, lines[half:], limiter, api_key)
+
+def translate_lines_in_batches(lines, api_key, lines_per_prompt, max_workers, requests_per_minute, on_rows=None):
+    """全行を並列・レート制限つきで翻訳する。バッチが終わるたびに、呼び出し元のスレッドで on_rows(行番号つきの行リスト) を呼ぶ"""
+    model = get_model(api_key, 'gemini-1.5-flash-latest', BATCH_SYSTEM_PROMPT)
+    # gemini_gateway のキーごとの上限より速くは送れないため、上限を超える指定はそこに合わせる
+    limiter = TokenBucket(min(requests_per_minute, GATEWAY_RATE_PER_MINUTE), burst=max_workers)
+    # 翻訳メモリに完全一致がある行は、AIに送らずその場で確定させる
+    memory = get_translation_memory()
+    pending_numbers, pending_lines, remembered_rows = [], [], []
+    for number, line in enumerate(lines, start=1):
+        match = memory.lookup(line, exact_only=True)
+        if match:
+            remembered_rows.append({"行": number, "日本語": line, "英語": match[0], "状態": "OK（翻訳メモリ）"})
+        else:
+            pending_numbers.append(number)
+            pending_lines.append(line)
+    memory.flush()
+    if remembered_rows and on_rows:
+        on_rows(remembered_rows)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(bind_session(_translate_batch), model, batch, limiter, api_key): (start, batch) for start, batch in pack_batches(pending_lines, lines_per_prompt)}
+        for future in as_completed(futures):
+            start, batch = futures[future]
+            try:
+                translations, status = future.result(), "OK"
+                for original, translated in zip(batch, translations):
+                    memory.add(original, translated)
+            except Exception as e:
+                translations, status = [""] * len(batch), f"エラー: {e}"
+            if on_rows:
+                on_rows([{"行": pending_numbers[start + i], "日本語": original, "英語": translated, "状態": status} for i, (original, translated) in enumerate(zip(batch, translations))])
+    except BaseException:
+        # 画面の操作で再実行されたとき（on_rows の st.* から例外が出る）は、まだ送っていないバッチを取り消して、待たずに抜ける
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+def show_batch_translation(gemini_api_key):
+    """ファイルをアップロードして、まとめて翻訳するUI"""
+    batch_file = st.file_uploader("日本語の .txt（1行1フレーズ）または .csv をアップロード", type=['txt', 'csv'], key="translator_batch_file")
+    column = None
+    if batch_file and batch_file.name.lower().endswith(".csv"):
+        columns = list(pd.read_csv(batch_file, dtype=str, nrows=0).columns)
+        batch_file.seek(0)
+        column = st.selectbox("翻訳する列", columns, key="translator_batch_column")
+    col1, col2, col3 = st.columns(3)
+    lines_per_prompt = col1.number_input("1回に送る行数", min_value=1, max_value=200, value=40, key="translator_batch_lines")
+    max_workers = col2.number_input("同時実行数", min_value=1, max_value=16, value=4, key="translator_batch_workers")
+    requests_per_minute = col3.number_input("1分あたりの最大リクエスト数", min_value=1, max_value=1000, value=60, key="translator_batch_rpm",
+                                            help=f"APIキーごとの上限（{GATEWAY_RATE_PER_MINUTE:.0f} 回/分、GEMINI_RATE_PER_MINUTE で変更）を超える値を指定しても、その上限で送られます。")
+    if requests_per_minute > GATEWAY_RATE_PER_MINUTE:
+        col3.caption(f"⚠️ APIキーごとの上限により、実際には 1分あたり {GATEWAY_RATE_PER_MINUTE:.0f} 回までで送ります。")
+
+    if st.button("📄 ファイルをまとめて翻訳する", key="translator_batch_start"):
+        if not gemini_api_key:
+            st.error("サイドバーでGemini APIキーを設定してください。")
+        elif batch_file is None:
+            st.warning("ファイルをアップロードしてください。")
+        else:
+            lines = read_batch_lines(batch_file, column)
+            if not lines:
+                st.warning("翻訳する行が見つかりませんでした。")
+                return
+            progress_bar = st.progress(0.0, text=f"{len(lines)} 行を翻訳しています...")
+            table = st.empty()
+            # 完了したバッチの行から順にセッションへ積んでいく（途中で再実行されても、終わった分はダウンロードできる）
+            st.session_state.translator_batch_rows = []
+            def on_rows(rows):
+                completed_rows = st.session_state.translator_batch_rows
+                completed_rows.extend(rows)
+                progress_bar.progress(len(completed_rows) / len(lines), text=f"翻訳中... ({len(completed_rows)}/{len(lines)} 行)")
+                table.dataframe(pd.DataFrame(completed_rows[-20:]), use_container_width=True, hide_index=True)
+            translate_lines_in_batches(lines, gemini_api_key, int(lines_per_prompt), int(max_workers), int(requests_per_minute), on_rows=on_rows)
+            progress_bar.empty()
+            table.empty()
+
+    if st.session_state.get("translator_batch_rows"):
+        # ダウンロード用には、元の行順に並べ直したCSVを作る
+        df_result = pd.DataFrame(st.session_state.translator_batch_rows).sort_values("行")
+        error_count = int(df_result["状態"].str.startswith("エラー").sum())
+        if error_count:
+            st.warning(f"{error_count} 行の翻訳に失敗しました。「状態」列をご確認ください。")
+        st.download_button(f"翻訳結果をダウンロード（{len(df_result)} 行, .csv）", data=df_result.to_csv(index=False).encode('utf_8_sig'), file_name="translated.csv", mime="text/csv", key="translator_batch_download")
 
 # ===============================================================
 # 専門家のメインの仕事 (私たちの叡智の結晶)
@@ -61,6 +199,10 @@ def show_tool(gemini_api_key, speech_api_key):
         audio_info = mic_recorder(start_prompt="🎤 話し始める", stop_prompt="⏹️ 翻訳する", key='translator_mic')
     with col2:
         text_prompt = st.text_input("または、ここに日本語を入力してEnterキーを押してください...", key="translator_text")
+    streaming_mode = st.toggle("⚡ 翻訳を届いた順に表示する（ストリーミング）", value=True, key="translator_streaming")
+    show_near_matches = st.toggle("📚 よく似た過去の翻訳を参考として並べて表示する（翻訳メモリ）", value=False, key="translator_show_near_matches")
+    with st.expander("📄 ファイルをまとめて翻訳する（一括翻訳モード）"):
+        show_batch_translation(gemini_api_key)
 
     # --- 結果表示エリア ---
     if st.session_state.translator_results:
@@ -70,6 +212,12 @@ def show_tool(gemini_api_key, speech_api_key):
                 st.caption(f"翻訳履歴 No.{len(st.session_state.translator_results) - i}")
                 st.markdown(f"**🇯🇵 あなたの入力:**\n> {result['original']}")
                 st.markdown(f"**🇺🇸 AIの翻訳:**\n> {result['translated']}")
+                if result.get("memory_note"):
+                    st.caption(result["memory_note"])
+                if result.get("suggestion"):
+                    suggestion = result["suggestion"]
+                    st.caption(f"📚 参考: よく似た過去の翻訳（一致度 {suggestion['similarity']:.0%}）「{suggestion['source']}」→「{suggestion['translation']}」"
+                               "　※ 入力とは意味が異なる場合があります")
         
         # ★★★ クリアボタンのロジックをここに集約 ★★★
         if st.button("翻訳履歴をクリア", key="clear_translator_history"):
@@ -86,8 +234,10 @@ def show_tool(gemini_api_key, speech_api_key):
     
     # 新しい音声入力か？
     if audio_info and audio_info['id'] != st.session_state.translator_last_mic_id:
-        with st.spinner("音声を日本語に変換中..."):
-            text_from_mic = transcribe_audio(audio_info['bytes'], speech_api_key)
+        # 途中経過を表示しながらストリーミング認識し、認識が終わったらすぐ翻訳に進む
+        interim = st.empty()
+        text_from_mic = transcribe_audio_streaming(audio_info['bytes'], speech_api_key, on_interim=lambda text: interim.caption(f"🎙️ {text}"))
+        interim.empty()
         if text_from_mic:
             japanese_text_to_process = text_from_mic
             # 検知した瞬間に、IDとテキストの両方を「処理済み」として記憶
@@ -102,12 +252,30 @@ def show_tool(gemini_api_key, speech_api_key):
 
     # --- Step 2: 「検知された新しい入力がある場合のみ」、翻訳処理を実行する ---
     if japanese_text_to_process:
-        if not gemini_api_key: st.error("サイドバーでGemini APIキーを設定してください。")
+        # 翻訳メモリに同じ文があれば、AIを呼ばずにそれを使う
+        # よく似た文（「出席します」と「出席しません」など）は意味が違うことがあるため、AIの翻訳に添える参考にとどめる
+        memory = get_translation_memory()
+        memory_match = memory.lookup(japanese_text_to_process, exact_only=not show_near_matches)
+        suggestion = None
+        if memory_match and memory_match[2] < 1.0:
+            suggestion = {"translation": memory_match[0], "source": memory_match[1], "similarity": memory_match[2]}
+        if memory_match and memory_match[2] == 1.0:
+            st.session_state.translator_results.insert(0, {"original": japanese_text_to_process, "translated": memory_match[0], "memory_note": "📚 翻訳メモリから表示しました。"})
+            st.rerun()
+        elif not gemini_api_key: st.error("サイドバーでGemini APIキーを設定してください。")
         else:
-            with st.spinner("AIが最適な英語を考えています..."):
-                translated_text = translate_text_with_gemini(japanese_text_to_process, gemini_api_key)
+            if streaming_mode:
+                # 翻訳の途中経過を表示し、ストリームが完了してから履歴に確定させる
+                with st.container(border=True):
+                    st.caption("翻訳中...")
+                    st.markdown(f"**🇯🇵 あなたの入力:**\n> {japanese_text_to_process}")
+                    translated_text = stream_translation_with_gemini(japanese_text_to_process, gemini_api_key, st.empty())
+            else:
+                with st.spinner("AIが最適な英語を考えています..."):
+                    translated_text = translate_text_with_gemini(japanese_text_to_process, gemini_api_key)
             if translated_text:
-                st.session_state.translator_results.insert(0, {"original": japanese_text_to_process, "translated": translated_text})
+                memory.add(japanese_text_to_process, translated_text)
+                st.session_state.translator_results.insert(0, {"original": japanese_text_to_process, "translated": translated_text, "suggestion": suggestion})
                 st.rerun()
             else:
                 # 翻訳に失敗した場合は、同じテキストで再試行できるよう、記憶をリセットする